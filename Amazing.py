@@ -12,6 +12,7 @@ import math, random
 
 import demo
 import pi3d
+import recorder
 
 rads = 0.017453292512 # degrees to radians
 
@@ -128,6 +129,7 @@ gravity = 0.02
 
 #screenshot number key p for screenshots
 scshots = 1
+rec = recorder.FrameRecorder() # encodes screenshots in the background
 
 #energy counter (space bar jumping)
 hp = 25
@@ -247,7 +249,7 @@ while DISPLAY.loop_running():
         zm -= dz
         ym += dy
     elif k==112: #key P
-      pi3d.screenshot("amazing"+str(scshots)+".jpg")
+      rec.capture("amazing"+str(scshots)+".jpg")
       scshots += 1
     elif k==32 and hp > 0: #key SPACE
       walk = False
@@ -262,6 +264,7 @@ while DISPLAY.loop_running():
       DISPLAY.destroy()
       mykeys.close()
       mymouse.stop()
+      rec.close()
       break
   # this will save a little time each loop if the camera is not moved
   CAMERA.was_moved = False
@@ -8,6 +8,8 @@ import math, time
 
 import demo
 import pi3d
+from billboard_batch import BillboardBatch
+from cluster_cache import cluster # the trees are kept in clusters/ after the first run
 
 # Setup display and initialise pi3d
 DISPLAY = pi3d.Display.create(x=0, y=0, background=(0.4, 0.8, 0.8, 1.0))
@@ -39,10 +41,11 @@ mymap.set_fog(*FOG)
 # Create billboard trees
 tree_sprite = pi3d.Sprite(w=hb2img.ix * 0.01, h=hb2img.iy * 0.01) # this isn't a square image
 trees = pi3d.MergeShape()
-trees.cluster(tree_sprite, mymap, 0.0, 0.0, 300.0, 600.0, 1000, "", 4.0, 2.0, billboard=True)
-trees.cluster(tree_sprite, mymap, 150.0, 300.0, 400.0, 50.0, 25, "", 20.0, 10.0, billboard=True) # some big ones too
+cluster(trees, tree_sprite, mymap, 0.0, 0.0, 300.0, 600.0, 1000, "", 4.0, 2.0, billboard=True)
+cluster(trees, tree_sprite, mymap, 150.0, 300.0, 400.0, 50.0, 25, "", 20.0, 10.0, billboard=True) # some big ones too
 trees.set_draw_details(shader, [hb2img, bumpimg], 0.0, 0.0)
 trees.set_fog(*TFOG)
+tree_batch = BillboardBatch(trees) # all the sprites turned at once
 
 #avatar camera
 rot = 0.0
@@ -70,7 +73,7 @@ while DISPLAY.loop_running():
   xm, ym, zm = CAMERA.relocate(rot, tilt, point=[xm, ym, zm], distance=step, 
                               normal=norm, crab=crab, slope_factor=1.5)
   if step != [0.0, 0.0, 0.0]: #i.e. previous loop set movmement
-    trees.billboard([xm, ym, zm]) # only do this if moving, not needed when just rotating camera
+    tree_batch.billboard([xm, ym, zm]) # only do this if moving, not needed when just rotating camera
     ym, norm = mymap.calcHeight(xm, zm, True)
     ym += avhgt
     step = [0.0, 0.0, 0.0]
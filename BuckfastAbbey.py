@@ -8,6 +8,7 @@ import math, random
 
 import demo
 import pi3d
+import meshcache # parsed models are cached as name.egg.p3m
 
 # Setup display and initialise pi3d
 DISPLAY = pi3d.Display.create(x=100, y=100, frames_per_second=30)
@@ -33,8 +34,8 @@ myecube = pi3d.EnvironmentCube(size=900.0, maptype="FACES",
 myecube.set_draw_details(flatsh, ectex)
 
 # load model_loadmodel
-mymodel = pi3d.Model(
-  file_string="models/Buckfast Abbey/BuckfastAbbey.egg",
+mymodel = meshcache.load_model(
+  "models/Buckfast Abbey/BuckfastAbbey.egg",
   name="Abbey",
   rx=90, sx=0.03, sy=0.03, sz=0.03)
 
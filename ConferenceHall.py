@@ -7,6 +7,7 @@ import math, random, time
 
 import demo
 import pi3d
+import meshcache # parsed models are cached as name.egg.p3m
 
 rads = 0.017453292512  # degrees to radians
 
@@ -34,7 +35,7 @@ myecube = pi3d.EnvironmentCube(size=1800.0, maptype="FACES", nobottom=True)
 myecube.set_draw_details(flatsh, ectex)
 
 #Load Hall model
-hall = pi3d.Model(file_string="models/ConferenceHall/conferencehall.egg", name="Hall", sx=0.1, sy=0.1, sz=0.1)
+hall = meshcache.load_model("models/ConferenceHall/conferencehall.egg", name="Hall", sx=0.1, sy=0.1, sz=0.1)
 hall.set_shader(flatsh)
 
 #key presses
@@ -2,21 +2,24 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 """quite a complicated demo showing many features of pi3d as well as
 communication between players using httpRequest (see rpi_json.sql and
-rpi_json.php) json serialisation and threading.
+rpi_json.php) json serialisation and threading. The networking is done by
+DogFight_net.NetClient over one persistent connection and the other planes
+are drawn DogFight_interp.DELAY seconds in the past, interpolated between
+the replies. AI_PLANES local enemies are flown by a DogFight_flight.Fleet. To play on a local
+network run DogFight_server.py and give its url as an argument:
+
+  python3 DogFight.py http://192.168.1.10:8080/rpi_json.php
 """
 import sys
-import time, math, glob, random, threading, json
+import time, math, glob, random
+import numpy as np
 
 import demo
 import pi3d
-
-if sys.version_info[0] == 3:
-  from urllib import request as urllib_request
-  from urllib import parse as urllib_parse
-else:
-  import urllib
-  urllib_request = urllib
-  urllib_parse = urllib
+from assets import ASSETS
+import DogFight_net
+import DogFight_interp
+from DogFight_flight import Fleet, FlightModel
 
 #display, camera, shader
 DISPLAY = pi3d.Display.create(x=100, y=100, frames_per_second=20)
@@ -35,60 +38,30 @@ print("""===================================
 == X jumps to location of 1st enemy in list
 ================================""")
 
-SHADER = pi3d.Shader("uv_bump") #for objects to look 3D
-ELEVSH = pi3d.Shader("uv_elev_map") # for multi textured terrain
-FLATSH = pi3d.Shader("uv_flat") #for 'unlit' objects like the background
+SHADER = ASSETS.shader("uv_bump") #for objects to look 3D
+ELEVSH = ASSETS.shader("uv_elev_map") # for multi textured terrain
+FLATSH = ASSETS.shader("uv_flat") #for 'unlit' objects like the background
 
-GRAVITY = 9.8 #m/s**2
-LD = 10 #lift/drag ratio
-DAMPING = 0.95 #reduce roll and pitch rate each update_variables
 BOOSTER = 1.5 #extra manoevreability boost to defy 1st Low of Thermodynamics.
 #load bullet images
 BULLET_TEX = [] #list to hold Texture refs
 iFiles = glob.glob(sys.path[0] + "/textures/biplane/bullet??.png") 
 iFiles.sort() # order is vital to animation!
 for f in iFiles:
-  BULLET_TEX.append(pi3d.Texture(f))
+  BULLET_TEX.append(ASSETS.texture(f))
 DAMAGE_FACTOR = 50 #dived by distance of shoot()
-NR_TM = 1.0 #check much less frequently until something comes back
-FA_TM = 5.0
-NR_DIST = 250
-FA_DIST = 1500
-P_FACTOR = 0.001
-I_FACTOR = 0.00001
+AI_PLANES = 3 #computer controlled enemies, 0 for network players only
+AI_KILL = 20.0 #damage before an AI plane is sent off to start again
+NEEDLE_STEP = 0.5 #degrees a needle has to move before it is rotated again
+BLIP_STEP = 0.5 #pixels a radar blip has to move before the buffer is rewritten
+MAX_BLIPS = 128 #size of the radar Points buffer, others beyond this aren't shown
 
 #define Aeroplane class
-class Aeroplane(object):
+class Aeroplane(FlightModel):
   def __init__(self, model, recalc_time, refid):
-    self.refid = refid
-    self.recalc_time = recalc_time #in theory use different values for enemy
-    self.x, self.y, self. z = 0.0, 0.0, 0.0
-    self.x_perr, self.y_perr, self.z_perr = 0.0, 0.0, 0.0
-    self.x_ierr, self.y_ierr, self.z_ierr = 0.0, 0.0, 0.0
-    self.d_err = 0.0
-    self.v_speed, self.h_speed = 0.0, 0.0
-    self.rollrate, self.pitchrate, self.yaw = 0.0, 0.0, 0.0
-    self.direction, self.roll, self.pitch = 0.0, 0.0, 0.0
-    self.max_roll, self.max_pitch = 65, 30 #limit rotations
-    self.ailerons, self.elevator = 0.0, 0.0
-    self.max_ailerons, self.max_elevator = 10.0, 10.0 #limit conrol surface movement
-    self.VNE = 120 #max speed (Velocity Not to be Exceeded)
-    self.mass = 300
-    self.a_factor, self.e_factor = 10, 10
-    self.roll_inrta, self.pitch_inrta = 100, 100
-    self.max_power = 2000 #force units of thrust really
-    self.lift_factor = 20.0 #randomly adjusted to give required performance!
-    self.power_setting = 0.0
-    self.throttle_step = 20
-    self.last_time = time.time()
-    self.last_pos_time = self.last_time
-    self.del_time = None #difference in pi time for other aero c.f. main one
-    self.rtime = 60
-    self.nearest = None
-    self.other_damage = 0.0 #done to nearest others since last json_load
-    self.damage = 0.0 #done to this aeroplane by others
-    #create the actual model
-    self.model = pi3d.Model(file_string=model, camera=CAMERA)
+    FlightModel.__init__(self, refid, recalc_time)
+    #create the actual model, Buffers are shared with all other planes using this file
+    self.model = ASSETS.model(model, camera=CAMERA)
     self.model.set_shader(SHADER)
     #create the bullets
     plane = pi3d.Plane(h=25, w=1)
@@ -104,23 +77,6 @@ class Aeroplane(object):
     self.seq_b = self.num_b
     self.bullets.set_draw_details(FLATSH, [BULLET_TEX[0]])
 
-  def set_ailerons(self, dx):
-    self.ailerons = dx
-    if abs(self.ailerons) > self.max_ailerons:
-      self.ailerons = math.copysign(self.max_ailerons, self.ailerons)
-
-  def set_elevator(self, dy):
-    self.elevator = dy
-    if abs(self.elevator) > self.max_elevator:
-      self.elevator = math.copysign(self.max_elevator, self.elevator)
-
-  def set_power(self, incr):
-    self.power_setting += incr * self.throttle_step
-    if self.power_setting < 0:
-      self.power_setting = 0
-    elif self.power_setting > self.max_power:
-      self.power_setting = self.max_power
-
   def shoot(self, target):
     #only shoot if animation seq. ended
     if self.seq_b < self.num_b:
@@ -147,91 +103,24 @@ class Aeroplane(object):
     print("distance={0:.2f}".format(distance))
     return DAMAGE_FACTOR / distance if distance > 0.0 else 2.0 * DAMAGE_FACTOR
 
-  def home(self, target):
-    #turn towards target location, mainly for AI control of enemy aircraft
-    dir_t = math.degrees(math.atan2((target[0] - self.x), (target[2] - self.z)))
-    #make sure the direction is alway a value between +/- 180 degrees
-    #roll so bank is half direction, 
-    self.roll = -((dir_t - self.direction + 180) % 360 - 180) / 2
-    #find angle between self and target
-    pch_t = math.degrees(math.atan2((target[1] - self.y),
-            math.sqrt((target[2] - self.z)**2 + (target[0] - self.x)**2)))
-    self.pitch = pch_t
-    return True
-
-  def update_variables(self):
-    #time
-    tm = time.time()
-    dt = tm - self.last_time
-    if dt < self.recalc_time: # don't need to do all this physics every loop
-      return
-    self.last_time = tm
-    #force from ailerons and elevators to get rotational accelerations
-    spsq = self.v_speed**2 + self.h_speed**2 #speed squared
-    a_force = self.a_factor * self.ailerons * spsq #ailerons force (moment really)
-    roll_acc = a_force / self.roll_inrta #good old Newton
-    e_force = self.e_factor * self.elevator * spsq #elevator
-    pitch_acc = e_force / self.pitch_inrta
-    #velocities and positions
-    if abs(self.roll) > self.max_roll: #make it easier to do flight control
-      self.roll = math.copysign(self.max_roll, self.roll)
-      self.rollrate = 0.0
-    if abs(self.pitch) > self.max_pitch:
-      self.pitch = math.copysign(self.max_pitch, self.pitch)
-      self.pitchrate = 0.0
-    self.roll += self.rollrate * dt #update roll position
-    self.pitch += self.pitchrate * dt #update roll rate
-    self.rollrate += roll_acc * dt
-    self.rollrate *= DAMPING # to stop going out of contol while looking around!
-    self.pitchrate += pitch_acc * dt
-    self.pitchrate *= DAMPING
-    #angle of attack
-    aofa = math.atan2(self.v_speed, self.h_speed)
-    aofa = math.radians(self.pitch) - aofa # approximation to sin difference
-    lift = self.lift_factor * spsq * aofa
-    drag = lift / LD 
-    if spsq < 100: #stall!
-      lift *= 0.9
-      drag *= 1.3
-
-    cos_pitch = math.cos(math.radians(self.pitch))
-    sin_pitch = math.sin(math.radians(self.pitch))
-    cos_roll = math.cos(math.radians(self.roll))
-    sin_roll = math.sin(math.radians(self.roll))
-    h_force = (self.power_setting - drag) * cos_pitch - lift * sin_pitch
-    v_force = lift * cos_pitch * cos_roll - self.mass * GRAVITY
-    h_acc = h_force / self.mass
-    v_acc = v_force / self.mass
-    self.h_speed += h_acc * dt
-    if self.h_speed > self.VNE:
-      self.h_speed = self.VNE
-    elif self.h_speed < 0:
-      self.h_speed = 0
-    self.v_speed += v_acc * dt
-    if abs(self.v_speed) > self.VNE:
-      self.v_speed = math.copysign(self.VNE, self.v_speed)
-    turn_force = -lift * sin_roll * 1.5
-    radius = self.mass * spsq / turn_force if turn_force != 0.0 else 0.0
-    self.yaw = math.sqrt(spsq) / radius if radius != 0.0 else 0.0
-
   def update_position(self, height):
     #time
     tm = time.time()
     dt = tm - self.last_pos_time
     self.last_pos_time = tm
 
-    self.x += (self.h_speed * math.sin(math.radians(self.direction)) * dt -
-              self.x_perr * P_FACTOR - self.x_ierr * I_FACTOR)
-    self.y += self.v_speed * dt - self.y_perr * P_FACTOR - self.y_ierr * I_FACTOR
-    if self.y < (height + 3):
-      self.y = height + 3
-      self.v_speed = 0
-      self.pitch = 2.5
-      #self.roll = 0
-    self.z += (self.h_speed * math.cos(math.radians(self.direction)) * dt -
-              self.z_perr * P_FACTOR - self.z_ierr * I_FACTOR)
+    self.move(dt, height)
+    return self.place_model()
 
-    self.direction += math.degrees(self.yaw) * dt - self.d_err * P_FACTOR
+  def set_state(self, state, height):
+    #for other players, state as sampled from DogFight_interp.Buffers
+    (self.x, self.y, self.z, self.h_speed, self.v_speed, self.pitch,
+                      self.direction, self.roll, self.yaw) = state
+    self.y = max(self.y, height + 3)
+    self.last_pos_time = time.time()
+    return self.place_model()
+
+  def place_model(self):
     #set values of model
     sin_d = math.sin(math.radians(self.direction))
     cos_d = math.cos(math.radians(self.direction))
@@ -278,135 +167,68 @@ class Instruments(object):
           w=128, h=128, x=0, y=-ht/2+64, z=2)
     self.rad = pi3d.ImageSprite(rad_tex, FLATSH, camera=CAMERA2D,
           w=128, h=128, x=128, y=-ht/2+64, z=2)
-    self.dot = pi3d.ImageSprite(dot_tex, FLATSH, camera=CAMERA2D,
-          w=16, h=16, z=1)
+    #all the blips are one Points buffer, unused ones parked off screen
+    self.park = (-10.0 * wd, -10.0 * ht, 1.0)
+    self.blip_pts = np.tile(self.park, (MAX_BLIPS, 1))
+    self.blips = pi3d.Points(camera=CAMERA2D, vertices=self.blip_pts, point_size=16)
+    self.blips.set_draw_details(ASSETS.shader("shaders/uv_sprite"), [dot_tex])
+    self.n_blips = 0
+    self.blips_dirty = False
     self.ndl1 = pi3d.ImageSprite(ndl_tex, FLATSH, camera=CAMERA2D,
           w=128, h=128, x=-128, y=-ht/2+64, z=1)
     self.ndl2 = pi3d.ImageSprite(ndl_tex, FLATSH, camera=CAMERA2D,
           w=128, h=128, x=0, y=-ht/2+64, z=1)
     self.ndl3 = pi3d.ImageSprite(ndl_tex, FLATSH, camera=CAMERA2D,
           w=128, h=128, x=128, y=-ht/2+64, z=1)
-    self.dot_list = []
-    self.update_time = 0.0
+    self.angles = [None, None, None] #needle rotations last applied
     
   def draw(self):
+    if self.blips_dirty: #re_init makes the opengl buffers first if need be
+      self.blips.buf[0].re_init(pts=self.blip_pts)
+      self.blips_dirty = False
     self.asi.draw()
     self.alt.draw()
     self.rad.draw()
-    for i in self.dot_list:
-      self.dot.position(i[1] + 128, i[2] + self.rad.y(), 1)
-      self.dot.draw()
+    if self.n_blips > 0:
+      self.blips.draw()
     self.ndl1.draw()
     self.ndl2.draw()
     self.ndl3.draw()
     
-  def update(self, ae, others):
-    self.ndl1.rotateToZ(-360*ae.h_speed/140)
-    self.ndl2.rotateToZ(-360*ae.y/3000)
-    self.ndl3.rotateToZ(-ae.direction)
-    self.dot_list = []
-    for i in others:
-      if i == "start":
-        continue
-      o = others[i]
-      dx = (o.x - ae.x) / 50
-      dy = (o.z - ae.z) / 50
-      d = math.hypot(dx, dy)
-      if d > 40:
-        dx *= 40 / d
-        dy *= 40 / d
-      self.dot_list.append([o.refid, dx, dy])
-    self.update_time = ae.last_pos_time
+  def update(self, ae, others, ai=()):
+    '''cheap enough to call every frame, the needles are only rotated and
+    the blip buffer only rewritten when they have moved far enough to see.
+    ai is a list of the computer controlled planes
+    '''
+    for i, (ndl, angle) in enumerate(((self.ndl1, -360*ae.h_speed/140),
+                                      (self.ndl2, -360*ae.y/3000),
+                                      (self.ndl3, -ae.direction))):
+      if self.angles[i] is None or abs(angle - self.angles[i]) > NEEDLE_STEP:
+        ndl.rotateToZ(angle)
+        self.angles[i] = angle
+    #other players then the server's summary of the ones it left out
+    pos = [(others[i].x, others[i].z) for i in others if i != "start"]
+    pos.extend((b.x, b.z) for b in ai)
+    pos.extend(zip(ae.radar[0::3], ae.radar[1::3]))
+    pos = np.array(pos[:MAX_BLIPS], dtype=float).reshape(-1, 2)
+    n = len(pos)
+    d = (pos - (ae.x, ae.z)) / 50
+    r = np.hypot(d[:,0], d[:,1])
+    far = r > 40 #put on the edge of the radar
+    d[far] *= (40 / r[far]).reshape(-1, 1)
+    pts = np.tile(self.park, (MAX_BLIPS, 1))
+    pts[:n,0] = d[:,0] + self.rad.x()
+    pts[:n,1] = d[:,1] + self.rad.y()
+    if n != self.n_blips or (n > 0 and
+                  np.abs(pts[:n,:2] - self.blip_pts[:n,:2]).max() > BLIP_STEP):
+      self.blip_pts = pts
+      self.n_blips = n
+      self.blips_dirty = True
 
-def json_load(ae, others):
-  """httprequest other players. Sends own data and gets back array of all
-  other players within sight. This function runs in a background thread
+def new_plane(refid):
+  """called by DogFight_net.apply_reply() for each new player
   """
-  #TODO pass nearest, nearest.hp and own hp merge in some way
-  tm_now = time.time()
-  jstring = json.dumps([ae.refid, ae.last_time, ae.x, ae.y, ae.z,
-      ae.h_speed, ae.v_speed, ae.pitch, ae.direction, ae.roll,
-      ae.pitchrate, ae.yaw, ae.rollrate, ae.power_setting, ae.damage], separators=(',',':'))
-  if ae.nearest:
-    n_id = ae.nearest.refid
-    n_damage = ae.nearest.other_damage
-    ae.nearest.other_damage = 0.0
-  else:
-    n_id = ""
-    n_damage = 0.0
-  params = urllib_parse.urlencode({"id":ae.refid, "tm":tm_now, "x":ae.x, "z":ae.z,
-          "json":jstring, "nearest":n_id, "damage":n_damage})
-  others["start"] = tm_now #used for polling freqency
-  urlstring = "http://www.eldwick.org.uk/sharecalc/rpi_json.php?{0}".format(params)
-  try:
-    r = urllib_request.urlopen(urlstring)
-    if r.getcode() == 200: #good response
-      jstring = r.read().decode("utf-8")
-      if len(jstring) > 50: #error messages are shorter than this
-        olist = json.loads(jstring)
-        #smooth time offset value
-        ae.del_time = ae.del_time * 0.9 + olist[0] * 0.1 if ae.del_time else olist[0]
-        #own damage is cumulative and not reset on server until dead!
-        ae.damage = olist[1]
-        #if ae.damage > 2.0 * DAMAGE_FACTOR: #explode return to GO etc
-        #print(ae.damage)
-        olist = olist[2:]
-        """
-        synchronisation system: sends time.time() which is used to calculate
-        an offset on the server and which is inserted as the second term 
-        in the json string. When the list of other players comes back from
-        the server it is preceded by the same offset time inserted in this json.
-        This is used to adjust the last_time for all
-        the other avatars.
-        """
-        nearest = None
-        ae.rtime = 60
-        for o in olist:
-          if not(o[0] in others):
-            others[o[0]] = Aeroplane("models/biplane.obj", 0.1, o[0])
-          oa = others[o[0]] #oa is other aeroplane, ae is this one!
-          oa.refif = o[0]
-          #exponential smooth time offset values
-          oa.del_time = oa.del_time * 0.9 + o[1] * 0.1 if oa.del_time else o[1]
-          oa.last_time = o[2] + oa.del_time - ae.del_time # o[1] inserted by server code
-          dt = tm_now - oa.last_time
-          if oa.x == 0.0:
-            oa.x, oa.y, oa.z = o[3], o[4], o[5]
-          nx = o[3] + o[6] * math.sin(math.radians(o[9])) * dt
-          ny = o[4] + o[7] * dt
-          nz = o[5] + o[6] * math.cos(math.radians(o[9])) * dt
-          distance = math.hypot(nx - ae.x, nz - ae.z)
-          if not nearest or distance < nearest:
-            nearest = distance
-            ae.nearest = oa
-          oa.x_perr, oa.y_perr, oa.z_perr = oa.x - nx, oa.y - ny, oa.z - nz
-          oa.x_ierr += oa.x_perr
-          oa.y_ierr += oa.y_perr
-          oa.z_ierr += oa.z_perr
-          oa.d_err = ((oa.direction - (o[9] + o[12] * dt) + 180) % 360 - 180) / 2
-          oa.h_speed = o[6]
-          oa.v_speed = o[7]
-          oa.pitch = o[8]
-          oa.roll = o[10]
-          oa.pitchrate = o[11]
-          oa.yaw = o[12]
-          oa.rollrate = o[13]
-          oa.power_setting = o[14]
-          oa.damage = o[15]
-
-        if nearest:
-          ae.rtime = NR_TM + (max(min(nearest, FA_DIST), NR_DIST) - NR_DIST) / \
-                  (FA_DIST - NR_DIST) * (FA_TM - NR_TM)
-        #TODO tidy up inactive others; flag not to draw, delete if inactive for long enough
-        return True
-      else:
-        print(jstring)
-        return False
-    else:
-      print(r.getcode())
-      return False
-  except Exception as e:
-    print("exception:", e)
+  return Aeroplane("models/biplane.obj", 0.1, refid)
 
 #MAC address
 try:
@@ -419,12 +241,19 @@ except:
 #create the instances of Aeroplane
 a = Aeroplane("models/biplane.obj", 0.02, refid)
 a.z, a.direction = 900, 180
+#computer controlled planes, all flown by one Fleet and drawn as Aeroplanes
+fleet = Fleet(AI_PLANES)
+fleet.spawn(centre=(0.0, 500.0, -900.0), spread=2000.0)
+ai = [new_plane("ai{}".format(i)) for i in range(AI_PLANES)]
+last_ai = time.time()
 #create instance of instruments
 inst = Instruments()
 others = {"start": 0.0} #contains a dictionary of other players keyed by refid
-thr = threading.Thread(target=json_load, args=(a, others))
-thr.daemon = True #allows the program to exit even if a Thread is still running
-thr.start()
+#one thread and connection for all the polling. Only this (main) thread
+#alters others, replies are collected from net each loop
+net = DogFight_net.NetClient(sys.argv[1] if len(sys.argv) > 1 else DogFight_net.URL)
+#recent positions of the others, sampled a little in the past to draw them
+buffers = DogFight_interp.Buffers()
 # Load textures for the environment cube
 ectex = pi3d.loadECfiles("textures/ecubes", "sbox")
 myecube = pi3d.EnvironmentCube(size=7000.0, maptype="FACES", camera=CAMERA)
@@ -495,11 +324,18 @@ while DISPLAY.loop_running() and not inputs.key_state("KEY_ESC"):
     cam_toggle = True
     cam_rot, cam_pitch = 0, 0
   if inputs.key_state("BTN_LEFT") or inputs.key_state("BTN_PINKIE"): #shoot
-    #target is always nearest others set during last json_load()
+    #target is always nearest others set by the last DogFight_net.apply_reply()
     #tx, ty, tz = 0., 0.0, 0.0
-    if a.nearest:
-      tx, ty, tz = a.nearest.x, a.nearest.y, a.nearest.z
-      a.nearest.other_damage += a.shoot([tx, ty, tz])
+    #unless an AI plane is closer
+    target = a.nearest
+    d_target = math.hypot(target.x - a.x, target.z - a.z) if target else None
+    for b in ai:
+      d = math.hypot(b.x - a.x, b.z - a.z)
+      if d_target is None or d < d_target:
+        target, d_target = b, d
+    if target:
+      tx, ty, tz = target.x, target.y, target.z
+      target.other_damage += a.shoot([tx, ty, tz])
 
   a.update_variables()
   loc = a.update_position(mymap.calcHeight(a.x, a.z))
@@ -510,25 +346,55 @@ while DISPLAY.loop_running() and not inputs.key_state("KEY_ESC"):
   inst.draw()
   a.draw()
 
+  tm_draw = time.time()
+  #AI planes all chase the player
+  if AI_PLANES > 0:
+    dt = min(tm_draw - last_ai, 0.2)
+    last_ai = tm_draw
+    fleet.intercept(np.arange(AI_PLANES), a.x, a.y, a.z, a.h_speed, a.v_speed,
+                    a.direction, dt)
+    fleet.step(dt, mymap.calcHeight)
+    for i, b in enumerate(ai):
+      fleet.damage[i] += b.other_damage
+      b.other_damage = 0.0
+      if fleet.damage[i] > AI_KILL: #shot down, another one turns up
+        fleet.spawn(centre=(a.x, 500.0, a.z), spread=2000.0, idx=[i])
+      fleet.copy_to(i, b)
+      b.place_model()
+      b.draw()
+  #forget players that have stopped arriving, gone or no longer sent by the server
+  for i in buffers.stale(tm_draw):
+    buffers.remove(i)
+    if i in others:
+      if a.nearest is others[i]:
+        a.nearest = None
+      del others[i]
   for i in others:
     if i == "start":
       continue
     b = others[i]
-    b.update_variables()
-    b.update_position(mymap.calcHeight(b.x, b.z))
+    state = buffers.sample(i, tm_draw)
+    if state is not None:
+      b.set_state(state, mymap.calcHeight(state[0], state[2]))
+    else: #nothing buffered yet so carry on as before
+      b.update_variables()
+      b.update_position(mymap.calcHeight(b.x, b.z))
     b.draw()
-  #do httprequest if thread not already started and enough time has elapsed
-  if not (thr.isAlive()) and (a.last_pos_time > (others["start"] + a.rtime)):
-    thr = threading.Thread(target=json_load, args=(a, others))
-    thr.daemon = True #allows the program to exit even if a Thread is still running
-    thr.start()
+  #apply the last reply then ask again if not waiting and enough time has elapsed
+  reply = net.get_reply()
+  if reply is not None:
+    DogFight_net.apply_reply(a, others, reply, new_plane, buffers)
+  if not net.busy and (a.last_pos_time > (others["start"] + a.rtime)):
+    params = DogFight_net.make_params(a, radar=True)
+    others["start"] = params["tm"] #used for polling freqency
+    net.send(params)
     
-  if a.last_pos_time > (inst.update_time + NR_TM):
-    inst.update(a, others)
+  inst.update(a, others, ai)
 
   mymap.draw()
   myecube.position(loc[0], loc[1], loc[2])
   myecube.draw()
 
+net.close()
 inputs.release()
 DISPLAY.destroy()
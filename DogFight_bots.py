@@ -0,0 +1,385 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Headless DogFight players for load testing a server from one ordinary
+linux box instead of a room full of Pis. Each bot is one plane of a
+DogFight_flight.Fleet chasing whichever plane the server says is nearest
+(and shooting at it when close) with its own DogFight_net.NetClient, so the
+requests are exactly what DogFight.py sends: the same parameters from
+make_params(), the same keep-alive connection and, with --wire, the
+DogFight_wire binary format instead of json.
+
+Unless --url is given DogFight_server.py is started in a separate process
+on a free port so that its cpu time can be measured on its own. Bots join
+over --ramp seconds then the run lasts --time seconds. Every --report
+seconds, and at the end, it prints requests per second, latency
+percentiles, bytes each way, errors and the cpu used by the server and by
+the bots. With --json the final numbers are written to a file so that runs
+before and after a change can be compared:
+
+  python3 DogFight_bots.py -n 300 -t 60
+  python3 DogFight_bots.py -n 300 --poll 0.2 --wire --radar --json wire.json
+  python3 DogFight_bots.py -u http://pi4.local:8080/rpi_json.php --server_pid 1234
+
+--poll 0 uses the same adaptive interval as DogFight (DogFight_net.NR_TM
+when someone is near up to FA_TM). Extra arguments after -- are passed to
+DogFight_server.py, for instance -- -k 0 to compare with the php behaviour.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+try:
+  from urllib.parse import urlencode
+except ImportError: # python2
+  from urllib import urlencode
+
+import numpy as np
+
+import DogFight_net
+import DogFight_wire
+from DogFight_flight import Fleet
+
+LOGGER = logging.getLogger(__name__)
+
+N_BOTS = 100
+DT = 0.05 # seconds per physics step
+POLL_TM = 0.0 # seconds between polls, 0 for the DogFight schedule
+RUN_TM = 30.0
+RAMP_TM = 5.0 # seconds over which the bots join
+REPORT_TM = 5.0
+SPREAD = 3000.0 # bots start in a square twice this size
+CENTRE = (0.0, 500.0, 0.0) # bots with no one near head for here
+SHOOT_DIST = 300.0
+SHOT_DAMAGE = 0.5 # per second while within SHOOT_DIST
+PERCENTILES = (50, 90, 99)
+
+def refid(i):
+  '''made up mac address for bot i
+  '''
+  h = '{:012x}'.format(0xb0b000000000 + i)
+  return ':'.join(h[j:j + 2] for j in range(0, 12, 2))
+
+def cpu_seconds(pid=None):
+  '''user + system cpu time of process pid, or of this one, None if it
+  can't be found (other processes are only read from linux /proc)
+  '''
+  if pid is None:
+    t = os.times()
+    return t[0] + t[1]
+  try:
+    with open('/proc/{}/stat'.format(pid)) as f:
+      fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf(str('SC_CLK_TCK'))
+  except (IOError, OSError, ValueError, IndexError):
+    return None
+
+def start_server(extra=()):
+  '''run DogFight_server.py on a free local port, returns (Popen, url) once
+  it is accepting connections
+  '''
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  s.bind(('127.0.0.1', 0))
+  port = s.getsockname()[1]
+  s.close()
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DogFight_server.py')
+  proc = subprocess.Popen([sys.executable, path, '-a', '127.0.0.1', '-p', str(port)] +
+                          list(extra))
+  deadline = time.time() + 10.0
+  while True:
+    try:
+      socket.create_connection(('127.0.0.1', port), 0.5).close()
+      break
+    except socket.error:
+      if proc.poll() is not None or time.time() > deadline:
+        proc.kill()
+        raise RuntimeError('DogFight_server.py did not start')
+      time.sleep(0.05)
+  return proc, 'http://127.0.0.1:{}/rpi_json.php'.format(port)
+
+class Stats(object):
+  LISTS = ('latency', 'received', 'failed', 'players', 'sent')
+  COUNTS = ('empty', 'late')
+
+  def __init__(self):
+    '''what happened to each request since the last reset()
+    '''
+    self.resets = 0
+    self.reset()
+
+  def reset(self):
+    self.latency = [] # seconds, one for each reply
+    self.received = [] # bytes
+    self.failed = [] # True if the reply was an error
+    self.players = [] # others in each reply with a list
+    self.sent = [] # bytes of query string and body for each request
+    self.empty = 0 # "nobody near"
+    self.late = 0 # polls due while the last was still waiting
+    self.resets += 1
+
+  def mark(self):
+    '''where each list and count has got to, for summary() of what
+    happens after
+    '''
+    since = dict((k, len(getattr(self, k))) for k in self.LISTS)
+    since.update((k, getattr(self, k)) for k in self.COUNTS)
+    since['resets'] = self.resets
+    return since
+
+  def summary(self, elapsed, since=None):
+    '''dict of the numbers for everything after the mark() since, or
+    since the last reset() if None or there has been one after it
+    '''
+    if since is None or since['resets'] != self.resets:
+      since = dict((k, 0) for k in self.LISTS + self.COUNTS)
+    w = dict((k, getattr(self, k)[since[k]:]) for k in self.LISTS)
+    ms = np.array(w['latency']) * 1000.0
+    n = len(ms)
+    errors = sum(w['failed'])
+    result = {'requests': n, 'rate': n / elapsed if elapsed > 0 else 0.0,
+              'errors': errors, 'error_rate': errors / n if n else 0.0,
+              'empty': self.empty - since['empty'], 'late': self.late - since['late']}
+    if n:
+      for p in PERCENTILES:
+        result['p{}_ms'.format(p)] = float(np.percentile(ms, p))
+      result['max_ms'] = float(ms.max())
+      result['received_mean'] = float(np.mean(w['received']))
+      result['received_max'] = int(np.max(w['received']))
+      result['players_mean'] = float(np.mean(w['players'])) if w['players'] else 0.0
+    if w['sent']:
+      result['sent_mean'] = float(np.mean(w['sent']))
+    return result
+
+class Bots(object):
+  def __init__(self, url, n=N_BOTS, poll_tm=POLL_TM, wire=False, radar=False,
+               spread=SPREAD, seed=1):
+    '''n bots flying round CENTRE, none of them connected until start()
+    '''
+    self.url = url
+    self.n = n
+    self.poll_tm = poll_tm
+    self.wire = wire
+    self.radar = radar
+    self.fleet = Fleet(n)
+    self.fleet.spawn(CENTRE, spread, seed)
+    self.avatars = [DogFight_net.Avatar(refid(i)) for i in range(n)]
+    self.index = dict((a.refid, i) for i, a in enumerate(self.avatars))
+    self.others = [{} for i in range(n)]
+    self.nets = [None] * n
+    self.channels = [DogFight_wire.Channel(DogFight_wire.UPDATE) for i in range(n)] if wire else None
+    self.next_poll = np.random.RandomState(seed).uniform(0.0, max(poll_tm, DT), n)
+    self.stats = Stats()
+
+  def start(self, i):
+    self.nets[i] = DogFight_net.NetClient(self.url)
+    self.next_poll[i] += time.time()
+
+  def sync(self, i, tm):
+    '''copy plane i from the fleet to its Avatar for make_params()
+    '''
+    ae = self.avatars[i]
+    self.fleet.copy_to(i, ae)
+    ae.last_time = tm
+
+  def poll(self, i, tm):
+    ae, net = self.avatars[i], self.nets[i]
+    if net.busy:
+      self.stats.late += 1
+      return
+    self.sync(i, tm)
+    params = DogFight_net.make_params(ae, self.radar)
+    if self.wire:
+      state = self.fleet.player_list(i, ae.refid, tm)
+      state[14] = ae.damage
+      for k in ('json', 'x', 'z'):
+        del params[k]
+      body = self.channels[i].encode([state[:1] + [0.0] + state[1:]])
+      net.send(params, body)
+      self.stats.sent.append(len(urlencode(params)) + len(body))
+    else:
+      net.send(params)
+      self.stats.sent.append(len(urlencode(params)))
+    ae.last_pos_time = tm
+    self.next_poll[i] = tm + (self.poll_tm or ae.rtime)
+
+  def receive(self, i):
+    '''pick up a reply for bot i if there is one
+    '''
+    reply = self.nets[i].get_reply()
+    if reply is None:
+      return
+    tm_sent, status, text = reply
+    self.stats.latency.append(self.nets[i].latency)
+    self.stats.received.append(len(text))
+    self.stats.failed.append(status != 200)
+    if status != 200:
+      return
+    if self.wire:
+      try:
+        olist = DogFight_wire.to_reply(self.channels[i].decode(text))
+      except DogFight_wire.WireError:
+        olist = None
+    else:
+      olist = DogFight_net.parse_reply(text)
+      if olist is None and text == 'nobody near':
+        self.stats.empty += 1
+        return
+    if olist is None:
+      self.stats.failed[-1] = True
+      return
+    self.stats.players.append(len([o for o in olist[2:] if o[0] not in
+                                   (DogFight_net.RADAR_ID, DogFight_net.NEAREST_ID)]))
+    ae = self.avatars[i]
+    DogFight_net.apply_list(ae, self.others[i], tm_sent, olist)
+    self.fleet.damage[i] = ae.damage
+    if not self.poll_tm: # rtime depends on how near the others are
+      self.next_poll[i] = ae.last_pos_time + ae.rtime
+
+  def step(self, dt):
+    '''chase the nearest plane the server told each bot about, the others
+    head back to CENTRE
+    '''
+    targets = np.full(self.n, -1, dtype=int)
+    for i, ae in enumerate(self.avatars):
+      if ae.nearest is not None:
+        targets[i] = self.index.get(ae.nearest.refid, -1)
+    f = self.fleet
+    idle = np.nonzero(targets < 0)[0]
+    f.home(CENTRE[0], CENTRE[1], CENTRE[2], idle)
+    f.pursue(targets, dt)
+    chasing = np.nonzero(targets >= 0)[0]
+    t = targets[chasing]
+    dist = np.sqrt((f.x[t] - f.x[chasing]) ** 2 + (f.y[t] - f.y[chasing]) ** 2 +
+                   (f.z[t] - f.z[chasing]) ** 2)
+    for i in chasing[dist < SHOOT_DIST]:
+      self.avatars[i].nearest.other_damage += SHOT_DAMAGE * dt
+    f.step(dt)
+
+  def run(self, run_tm=RUN_TM, ramp_tm=RAMP_TM, report_tm=REPORT_TM, dt=DT,
+          server_pid=None):
+    '''fly and poll in real time for ramp_tm + run_tm seconds, printing a
+    line every report_tm. Returns the summary of the run_tm part
+    '''
+    tm_start = time.time()
+    tm_end = tm_start + ramp_tm + run_tm
+    joined = 0
+    measuring = False
+    lag = 0.0 # longest step over dt, if large the bots are the bottleneck
+    tm_last = tm_start
+    tm_report = tm_start + report_tm
+    marks = self.marks(server_pid)
+    period = self.marks(server_pid)
+    while True:
+      tm = time.time()
+      if tm >= tm_end:
+        break
+      while joined < self.n and tm >= tm_start + ramp_tm * joined / self.n:
+        self.start(joined)
+        joined += 1
+      if not measuring and tm >= tm_start + ramp_tm:
+        measuring = True
+        self.stats.reset()
+        marks = self.marks(server_pid)
+        lag = 0.0
+      step_tm = tm - tm_last
+      tm_last = tm
+      lag = max(lag, step_tm - dt)
+      for i in range(joined):
+        self.receive(i)
+      for i in np.nonzero(self.next_poll[:joined] <= tm)[0]:
+        self.poll(i, tm)
+      self.step(min(max(step_tm, dt * 0.1), dt * 4.0)) # keep up with real time
+      if tm >= tm_report:
+        report = self.report(period, server_pid)
+        print('{:6.1f}s {:4d} bots {:7.1f} req/s  p50 {:6.2f}ms  p99 {:6.2f}ms  '
+              'err {:4d}  server cpu {}'.format(tm - tm_start, joined, report['rate'],
+              report.get('p50_ms', 0.0), report.get('p99_ms', 0.0), report['errors'],
+              '{:.0f}%'.format(report['server_cpu'] * 100.0)
+                  if report['server_cpu'] is not None else '?'))
+        period = self.marks(server_pid)
+        tm_report += report_tm
+      pause = tm + dt - time.time()
+      if pause > 0.0:
+        time.sleep(pause)
+    result = self.report(marks, server_pid)
+    result['lag'] = lag
+    return result
+
+  def marks(self, server_pid):
+    '''starting point for report()
+    '''
+    return (time.time(), cpu_seconds(), cpu_seconds(server_pid) if server_pid else None,
+            self.stats.mark())
+
+  def report(self, marks, server_pid):
+    '''Stats.summary() of the replies since marks was taken with the cpu
+    used since then as a fraction of one core
+    '''
+    tm0, bots0, server0, since = marks
+    elapsed = time.time() - tm0
+    result = self.stats.summary(elapsed, since)
+    result['bots_cpu'] = (cpu_seconds() - bots0) / elapsed
+    server1 = cpu_seconds(server_pid) if server_pid else None
+    result['server_cpu'] = (server1 - server0) / elapsed if server1 is not None and \
+                                                             server0 is not None else None
+    return result
+
+  def close(self):
+    for net in self.nets:
+      if net is not None:
+        net.close()
+
+if __name__ == '__main__':
+  parse = argparse.ArgumentParser(description="headless DogFight players for load testing",
+                                  epilog="arguments after -- are passed to DogFight_server.py")
+  parse.add_argument("-u", "--url", default=None, help="server to use, otherwise DogFight_server.py is started")
+  parse.add_argument("--server_pid", default=None, type=int, help="process to measure the cpu of when --url is given")
+  parse.add_argument("-n", "--bots", default=N_BOTS, type=int)
+  parse.add_argument("-p", "--poll", default=POLL_TM, type=float, help="seconds between polls, 0 for the DogFight schedule")
+  parse.add_argument("-t", "--time", default=RUN_TM, type=float, help="seconds to measure for, after the ramp")
+  parse.add_argument("-r", "--ramp", default=RAMP_TM, type=float, help="seconds over which the bots join")
+  parse.add_argument("--report", default=REPORT_TM, type=float, help="seconds between progress lines")
+  parse.add_argument("-s", "--spread", default=SPREAD, type=float, help="bots start up to this far from the centre")
+  parse.add_argument("--seed", default=1, type=int)
+  parse.add_argument("-w", "--wire", action="store_true", help="use the DogFight_wire binary format")
+  parse.add_argument("--radar", action="store_true", help="ask for the radar summary")
+  parse.add_argument("--json", default=None, help="file to write the settings and results to")
+  argv = sys.argv[1:]
+  extra = []
+  if '--' in argv:
+    extra = argv[argv.index('--') + 1:]
+    argv = argv[:argv.index('--')]
+  args = parse.parse_args(argv)
+  logging.basicConfig(level=logging.WARNING)
+
+  proc = None
+  url, server_pid = args.url, args.server_pid
+  if url is None:
+    proc, url = start_server(extra)
+    server_pid = proc.pid
+  bots = Bots(url, args.bots, args.poll, args.wire, args.radar, args.spread, args.seed)
+  try:
+    result = bots.run(args.time, args.ramp, args.report, server_pid=server_pid)
+  except KeyboardInterrupt:
+    result = None
+  finally:
+    bots.close()
+    if proc is not None:
+      proc.terminate()
+      proc.wait()
+  if result is not None:
+    print()
+    print('{} bots polling {} for {:.0f}s using {}'.format(args.bots,
+          'every {}s'.format(args.poll) if args.poll else 'as DogFight does',
+          args.time, 'DogFight_wire' if args.wire else 'json'))
+    for k in sorted(result):
+      v = result[k]
+      print('  {:14s} {}'.format(k, '{:.4g}'.format(v) if isinstance(v, float) else v))
+    if args.json:
+      with open(args.json, 'w') as f:
+        json.dump({'settings': vars(args), 'server_args': extra, 'result': result}, f, indent=1)
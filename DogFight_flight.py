@@ -0,0 +1,434 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Flight model of the DogFight planes. FlightModel is the physics of one
+plane, without anything to draw, and DogFight.Aeroplane adds the model and
+bullets to it. Fleet is the same for many planes at once. Each value (x,
+roll, h_speed etc) is a numpy array with one entry per plane so a step is
+a few dozen array operations whatever the number of planes, rather than a
+few dozen python statements for each one. The equations are the same as
+FlightModel.step_variables() and move() (without the network error
+correction) and home() is the same steering as FlightModel.home().
+intercept() uses home() on the point where the target will be by the time
+it is reached, with throttle and brakes to close to STANDOFF then match
+speed. DogFight.py flies its computer controlled planes with a Fleet:
+
+  fleet = DogFight_flight.Fleet(50)
+  fleet.spawn(centre=(0.0, 500.0, 900.0), spread=2000.0)
+  ...
+  fleet.home(a.x, a.y, a.z) # all chase the player
+  fleet.step(dt, mymap.calcHeight) # or a function taking arrays of x, z
+  abspitch, absroll = fleet.model_angles()
+
+python3 DogFight_flight.py checks Fleet against FlightModel and times both
+with 1 to 10000 planes.
+"""
+import math
+import time
+
+import numpy as np
+
+GRAVITY = 9.8 #m/s**2
+LD = 10 #lift/drag ratio
+DAMPING = 0.95 #reduce roll and pitch rate each update_variables
+MAX_ROLL, MAX_PITCH = 65.0, 30.0 #limit rotations
+MAX_AILERONS, MAX_ELEVATOR = 10.0, 10.0
+VNE = 120 #max speed (Velocity Not to be Exceeded)
+MASS = 300
+A_FACTOR, E_FACTOR = 10, 10
+ROLL_INRTA, PITCH_INRTA = 100, 100
+MAX_POWER = 2000 #force units of thrust really
+LIFT_FACTOR = 20.0 #randomly adjusted to give required performance!
+THROTTLE_STEP = 20
+GROUND_CLEARANCE = 3.0
+P_FACTOR = 0.001 #correction towards the position sent by the server
+I_FACTOR = 0.00001
+STANDOFF = 100.0 # distance pursuers try to sit behind the target
+LEAD_TM = 10.0 # max seconds ahead to aim
+THROTTLE_GAIN = 200.0 # power per unit of speed error per second
+BRAKE = 0.99 # as the B key in DogFight
+
+class FlightModel(object):
+  def __init__(self, refid, recalc_time):
+    '''one plane with all values zero, update_variables() only does the
+    physics if recalc_time seconds have passed
+    '''
+    self.refid = refid
+    self.recalc_time = recalc_time #in theory use different values for enemy
+    self.x, self.y, self. z = 0.0, 0.0, 0.0
+    self.x_perr, self.y_perr, self.z_perr = 0.0, 0.0, 0.0
+    self.x_ierr, self.y_ierr, self.z_ierr = 0.0, 0.0, 0.0
+    self.d_err = 0.0
+    self.v_speed, self.h_speed = 0.0, 0.0
+    self.rollrate, self.pitchrate, self.yaw = 0.0, 0.0, 0.0
+    self.direction, self.roll, self.pitch = 0.0, 0.0, 0.0
+    self.max_roll, self.max_pitch = MAX_ROLL, MAX_PITCH
+    self.ailerons, self.elevator = 0.0, 0.0
+    self.max_ailerons, self.max_elevator = MAX_AILERONS, MAX_ELEVATOR
+    self.VNE = VNE
+    self.mass = MASS
+    self.a_factor, self.e_factor = A_FACTOR, E_FACTOR
+    self.roll_inrta, self.pitch_inrta = ROLL_INRTA, PITCH_INRTA
+    self.max_power = MAX_POWER
+    self.lift_factor = LIFT_FACTOR
+    self.power_setting = 0.0
+    self.throttle_step = THROTTLE_STEP
+    self.last_time = time.time()
+    self.last_pos_time = self.last_time
+    self.del_time = None #difference in pi time for other aero c.f. main one
+    self.rtime = 60
+    self.nearest = None
+    self.other_damage = 0.0 #done to nearest others since last poll
+    self.damage = 0.0 #done to this aeroplane by others
+    self.radar = [] #x, z, count of players the server didn't send in full
+
+  def set_ailerons(self, dx):
+    self.ailerons = dx
+    if abs(self.ailerons) > self.max_ailerons:
+      self.ailerons = math.copysign(self.max_ailerons, self.ailerons)
+
+  def set_elevator(self, dy):
+    self.elevator = dy
+    if abs(self.elevator) > self.max_elevator:
+      self.elevator = math.copysign(self.max_elevator, self.elevator)
+
+  def set_power(self, incr):
+    self.power_setting += incr * self.throttle_step
+    if self.power_setting < 0:
+      self.power_setting = 0
+    elif self.power_setting > self.max_power:
+      self.power_setting = self.max_power
+
+  def home(self, target):
+    #turn towards target location, mainly for AI control of enemy aircraft
+    dir_t = math.degrees(math.atan2((target[0] - self.x), (target[2] - self.z)))
+    #make sure the direction is alway a value between +/- 180 degrees
+    #roll so bank is half direction, 
+    self.roll = -((dir_t - self.direction + 180) % 360 - 180) / 2
+    #find angle between self and target
+    pch_t = math.degrees(math.atan2((target[1] - self.y),
+            math.sqrt((target[2] - self.z)**2 + (target[0] - self.x)**2)))
+    self.pitch = pch_t
+    return True
+
+  def update_variables(self):
+    #time
+    tm = time.time()
+    dt = tm - self.last_time
+    if dt < self.recalc_time: # don't need to do all this physics every loop
+      return
+    self.last_time = tm
+    self.step_variables(dt)
+
+  def step_variables(self, dt):
+    #force from ailerons and elevators to get rotational accelerations
+    spsq = self.v_speed**2 + self.h_speed**2 #speed squared
+    a_force = self.a_factor * self.ailerons * spsq #ailerons force (moment really)
+    roll_acc = a_force / self.roll_inrta #good old Newton
+    e_force = self.e_factor * self.elevator * spsq #elevator
+    pitch_acc = e_force / self.pitch_inrta
+    #velocities and positions
+    if abs(self.roll) > self.max_roll: #make it easier to do flight control
+      self.roll = math.copysign(self.max_roll, self.roll)
+      self.rollrate = 0.0
+    if abs(self.pitch) > self.max_pitch:
+      self.pitch = math.copysign(self.max_pitch, self.pitch)
+      self.pitchrate = 0.0
+    self.roll += self.rollrate * dt #update roll position
+    self.pitch += self.pitchrate * dt #update roll rate
+    self.rollrate += roll_acc * dt
+    self.rollrate *= DAMPING # to stop going out of contol while looking around!
+    self.pitchrate += pitch_acc * dt
+    self.pitchrate *= DAMPING
+    #angle of attack
+    aofa = math.atan2(self.v_speed, self.h_speed)
+    aofa = math.radians(self.pitch) - aofa # approximation to sin difference
+    lift = self.lift_factor * spsq * aofa
+    drag = lift / LD 
+    if spsq < 100: #stall!
+      lift *= 0.9
+      drag *= 1.3
+
+    cos_pitch = math.cos(math.radians(self.pitch))
+    sin_pitch = math.sin(math.radians(self.pitch))
+    cos_roll = math.cos(math.radians(self.roll))
+    sin_roll = math.sin(math.radians(self.roll))
+    h_force = (self.power_setting - drag) * cos_pitch - lift * sin_pitch
+    v_force = lift * cos_pitch * cos_roll - self.mass * GRAVITY
+    h_acc = h_force / self.mass
+    v_acc = v_force / self.mass
+    self.h_speed += h_acc * dt
+    if self.h_speed > self.VNE:
+      self.h_speed = self.VNE
+    elif self.h_speed < 0:
+      self.h_speed = 0
+    self.v_speed += v_acc * dt
+    if abs(self.v_speed) > self.VNE:
+      self.v_speed = math.copysign(self.VNE, self.v_speed)
+    turn_force = -lift * sin_roll * 1.5
+    radius = self.mass * spsq / turn_force if turn_force != 0.0 else 0.0
+    self.yaw = math.sqrt(spsq) / radius if radius != 0.0 else 0.0
+
+  def move(self, dt, height):
+    #position, with the correction towards where the server says it is
+    self.x += (self.h_speed * math.sin(math.radians(self.direction)) * dt -
+              self.x_perr * P_FACTOR - self.x_ierr * I_FACTOR)
+    self.y += self.v_speed * dt - self.y_perr * P_FACTOR - self.y_ierr * I_FACTOR
+    if self.y < (height + GROUND_CLEARANCE):
+      self.y = height + GROUND_CLEARANCE
+      self.v_speed = 0
+      self.pitch = 2.5
+      #self.roll = 0
+    self.z += (self.h_speed * math.cos(math.radians(self.direction)) * dt -
+              self.z_perr * P_FACTOR - self.z_ierr * I_FACTOR)
+    self.direction += math.degrees(self.yaw) * dt - self.d_err * P_FACTOR
+
+class Fleet(object):
+  def __init__(self, n):
+    '''n planes with all values zero, as a new Aeroplane
+    '''
+    self.n = n
+    z = lambda: np.zeros(n)
+    self.x, self.y, self.z = z(), z(), z()
+    self.h_speed, self.v_speed = z(), z()
+    self.rollrate, self.pitchrate, self.yaw = z(), z(), z()
+    self.direction, self.roll, self.pitch = z(), z(), z()
+    self.ailerons, self.elevator = z(), z()
+    self.power_setting = z()
+    self.damage = z()
+
+  def spawn(self, centre=(0.0, 500.0, 0.0), spread=1000.0, seed=None, idx=slice(None)):
+    '''scatter the planes idx round centre flying in random directions,
+    undamaged
+    '''
+    rnd = np.random.RandomState(seed)
+    n = len(self.x[idx])
+    self.x[idx] = centre[0] + rnd.uniform(-spread, spread, n)
+    self.y[idx] = centre[1] + rnd.uniform(0.0, spread * 0.1, n)
+    self.z[idx] = centre[2] + rnd.uniform(-spread, spread, n)
+    self.direction[idx] = rnd.uniform(0.0, 360.0, n)
+    self.h_speed[idx] = rnd.uniform(40.0, 60.0, n)
+    self.v_speed[idx] = 0.0
+    self.power_setting[idx] = MAX_POWER * 0.6
+    self.damage[idx] = 0.0
+
+  def set_ailerons(self, dx, idx=slice(None)):
+    self.ailerons[idx] = np.clip(dx, -MAX_AILERONS, MAX_AILERONS)
+
+  def set_elevator(self, dy, idx=slice(None)):
+    self.elevator[idx] = np.clip(dy, -MAX_ELEVATOR, MAX_ELEVATOR)
+
+  def home(self, tx, ty, tz, idx=slice(None)):
+    '''turn towards the target(s) as Aeroplane.home(), tx, ty, tz can be
+    numbers or arrays the same length as the planes picked by idx. Power is
+    raised when the target is far away
+    '''
+    dx, dy, dz = tx - self.x[idx], ty - self.y[idx], tz - self.z[idx]
+    dir_t = np.degrees(np.arctan2(dx, dz))
+    #roll so bank is half direction
+    self.roll[idx] = -((dir_t - self.direction[idx] + 180) % 360 - 180) / 2
+    dist = np.sqrt(dx ** 2 + dz ** 2)
+    self.pitch[idx] = np.degrees(np.arctan2(dy, dist))
+    self.power_setting[idx] = MAX_POWER * np.clip(dist / 1000.0, 0.5, 1.0)
+
+  def intercept(self, idx, tx, ty, tz, t_hspeed, t_vspeed, t_direction, dt):
+    '''planes idx chase targets at tx, ty, tz moving with the given speeds
+    and direction (arrays or numbers)
+    '''
+    idx = np.asarray(idx)
+    dist = np.sqrt((tx - self.x[idx]) ** 2 + (ty - self.y[idx]) ** 2 + (tz - self.z[idx]) ** 2)
+    t_go = np.minimum(dist / np.maximum(self.h_speed[idx], 1.0), LEAD_TM)
+    rd = np.radians(t_direction)
+    self.home(tx + t_hspeed * np.sin(rd) * t_go, ty + t_vspeed * t_go,
+              tz + t_hspeed * np.cos(rd) * t_go, idx)
+    want = t_hspeed + np.clip((dist - STANDOFF) * 0.1, -10.0, 40.0) # speed to close the gap
+    err = want - self.h_speed[idx]
+    self.power_setting[idx] = np.clip(self.power_setting[idx] + err * THROTTLE_GAIN * dt,
+                                      0, MAX_POWER)
+    fast = idx[err < -5.0]
+    self.h_speed[fast] *= BRAKE
+
+  def pursue(self, targets, dt):
+    '''each plane chases the plane with the index in targets, -1 for none
+    '''
+    targets = np.asarray(targets)
+    idx = np.nonzero(targets >= 0)[0]
+    t = targets[idx]
+    self.intercept(idx, self.x[t], self.y[t], self.z[t], self.h_speed[t],
+                   self.v_speed[t], self.direction[t], dt)
+
+  def nearest(self, exclude_self=True):
+    '''index of the nearest other plane to each one, O(n**2) in memory so
+    only for a few hundred planes, use spatial_hash for more
+    '''
+    d = (self.x[:, np.newaxis] - self.x) ** 2 + (self.z[:, np.newaxis] - self.z) ** 2
+    if exclude_self:
+      np.fill_diagonal(d, np.inf)
+    return np.argmin(d, axis=1)
+
+  def step(self, dt, ground=None):
+    '''advance all the planes by dt seconds. ground is None (height zero) or
+    a function returning the height at x, z, either for arrays (faster) or
+    single values such as ElevationMap.calcHeight
+    '''
+    self.update_variables(dt)
+    self.update_position(dt, self.heights(ground))
+
+  def heights(self, ground):
+    if ground is None:
+      return np.zeros(self.n)
+    try:
+      h = np.asarray(ground(self.x, self.z), dtype=float)
+      if h.shape == (self.n,):
+        return h
+    except (TypeError, ValueError):
+      pass
+    return np.array([ground(x, z) for x, z in zip(self.x, self.z)], dtype=float)
+
+  def update_variables(self, dt):
+    #force from ailerons and elevators to get rotational accelerations
+    spsq = self.v_speed ** 2 + self.h_speed ** 2 #speed squared
+    roll_acc = A_FACTOR * self.ailerons * spsq / ROLL_INRTA #good old Newton
+    pitch_acc = E_FACTOR * self.elevator * spsq / PITCH_INRTA
+    #velocities and positions
+    over = np.abs(self.roll) > MAX_ROLL #make it easier to do flight control
+    self.roll[over] = np.copysign(MAX_ROLL, self.roll[over])
+    self.rollrate[over] = 0.0
+    over = np.abs(self.pitch) > MAX_PITCH
+    self.pitch[over] = np.copysign(MAX_PITCH, self.pitch[over])
+    self.pitchrate[over] = 0.0
+    self.roll += self.rollrate * dt
+    self.pitch += self.pitchrate * dt
+    self.rollrate += roll_acc * dt
+    self.rollrate *= DAMPING
+    self.pitchrate += pitch_acc * dt
+    self.pitchrate *= DAMPING
+    #angle of attack
+    aofa = np.radians(self.pitch) - np.arctan2(self.v_speed, self.h_speed)
+    lift = LIFT_FACTOR * spsq * aofa
+    drag = lift / LD
+    stall = spsq < 100
+    lift[stall] *= 0.9
+    drag[stall] *= 1.3
+    rp, rr = np.radians(self.pitch), np.radians(self.roll)
+    cos_pitch, sin_pitch = np.cos(rp), np.sin(rp)
+    h_force = (self.power_setting - drag) * cos_pitch - lift * sin_pitch
+    v_force = lift * cos_pitch * np.cos(rr) - MASS * GRAVITY
+    self.h_speed += h_force / MASS * dt
+    np.clip(self.h_speed, 0, VNE, out=self.h_speed)
+    self.v_speed += v_force / MASS * dt
+    np.clip(self.v_speed, -VNE, VNE, out=self.v_speed)
+    turn_force = -lift * np.sin(rr) * 1.5
+    radius = np.zeros(self.n)
+    ok = turn_force != 0.0
+    radius[ok] = MASS * spsq[ok] / turn_force[ok]
+    self.yaw[:] = 0.0
+    ok = radius != 0.0
+    self.yaw[ok] = np.sqrt(spsq[ok]) / radius[ok]
+
+  def update_position(self, dt, height):
+    rd = np.radians(self.direction)
+    self.x += self.h_speed * np.sin(rd) * dt
+    self.y += self.v_speed * dt
+    low = self.y < (height + GROUND_CLEARANCE)
+    self.y[low] = height[low] + GROUND_CLEARANCE
+    self.v_speed[low] = 0
+    self.pitch[low] = 2.5
+    self.z += self.h_speed * np.cos(rd) * dt
+    self.direction += np.degrees(self.yaw) * dt
+
+  def model_angles(self):
+    '''(abspitch, absroll) arrays used for Model.rotateToX() and rotateToZ()
+    '''
+    rd, rr, rp = np.radians(self.direction), np.radians(self.roll), np.radians(self.pitch)
+    sin_d, cos_d = np.sin(rd), np.cos(rd)
+    sin_r, cos_r = np.sin(rr), np.cos(rr)
+    sin_p = np.sin(rp)
+    absroll = np.degrees(np.arcsin(np.clip(sin_r * cos_d + cos_r * sin_p * sin_d, -1, 1)))
+    abspitch = np.degrees(np.arcsin(np.clip(sin_r * sin_d - cos_r * sin_p * cos_d, -1, 1)))
+    return abspitch, absroll
+
+  def copy_to(self, i, plane):
+    '''set the position, speeds and angles of plane (a FlightModel or
+    DogFight_net.Avatar) to those of plane i
+    '''
+    plane.x, plane.y, plane.z = float(self.x[i]), float(self.y[i]), float(self.z[i])
+    plane.h_speed, plane.v_speed = float(self.h_speed[i]), float(self.v_speed[i])
+    plane.pitch, plane.direction = float(self.pitch[i]), float(self.direction[i])
+    plane.roll = float(self.roll[i])
+    plane.pitchrate, plane.yaw = float(self.pitchrate[i]), float(self.yaw[i])
+    plane.rollrate = float(self.rollrate[i])
+    plane.power_setting = float(self.power_setting[i])
+
+  def player_list(self, i, refid, tm):
+    '''plane i as the list DogFight_net.make_params() sends as json
+    '''
+    return [refid, tm, float(self.x[i]), float(self.y[i]), float(self.z[i]),
+            float(self.h_speed[i]), float(self.v_speed[i]), float(self.pitch[i]),
+            float(self.direction[i]), float(self.roll[i]), float(self.pitchrate[i]),
+            float(self.yaw[i]), float(self.rollrate[i]), float(self.power_setting[i]),
+            float(self.damage[i])]
+
+if __name__ == '__main__':
+  def scalar(fleet, i):
+    '''FlightModel with the values of plane i of fleet
+    '''
+    p = FlightModel(i, 0.0)
+    for k in ('x', 'y', 'z', 'h_speed', 'v_speed', 'rollrate', 'pitchrate', 'yaw',
+              'direction', 'roll', 'pitch', 'ailerons', 'elevator', 'power_setting'):
+      setattr(p, k, float(getattr(fleet, k)[i]))
+    return p
+
+  def step(p, dt):
+    p.step_variables(dt)
+    p.move(dt, 0.0)
+
+  # same answers
+  fleet = Fleet(200)
+  fleet.spawn(spread=3000.0, seed=1)
+  fleet.y[:20] = 1.0 # some on the ground
+  fleet.roll[:] = np.random.RandomState(2).uniform(-80, 80, 200)
+  fleet.set_ailerons(np.random.RandomState(3).uniform(-0.01, 0.01, 200))
+  planes = [scalar(fleet, i) for i in range(fleet.n)]
+  for s in range(100):
+    fleet.step(0.05)
+    for p in planes:
+      step(p, 0.05)
+  for k in ('x', 'y', 'z', 'h_speed', 'direction', 'roll', 'pitch', 'yaw'):
+    err = np.abs(getattr(fleet, k) - [getattr(p, k) for p in planes]).max()
+    assert err < 1e-6, (k, err)
+  print('matches FlightModel after 100 steps')
+  # 99 bots chase plane 0 which flies slowly in a wide circle
+  fleet = Fleet(100)
+  fleet.spawn(centre=(0.0, 500.0, 0.0), spread=2000.0, seed=4)
+  targets = np.zeros(100, dtype=int)
+  targets[0] = -1
+  dist = lambda: np.sqrt((fleet.x[1:] - fleet.x[0]) ** 2 + (fleet.y[1:] - fleet.y[0]) ** 2 +
+                         (fleet.z[1:] - fleet.z[0]) ** 2)
+  start = dist()
+  for s in range(2400): # two minutes
+    fleet.home(fleet.x[0] + 1000.0 * math.sin(s * 0.003), 500.0,
+               fleet.z[0] + 1000.0 * math.cos(s * 0.003), [0])
+    fleet.power_setting[0] = MAX_POWER * 0.2
+    fleet.pursue(targets, 0.05)
+    fleet.step(0.05)
+  print('pursuit: distance to target median {:.0f} from {:.0f}, within 200 {} of 99'.format(
+        np.median(dist()), np.median(start), (dist() < 200.0).sum()))
+
+  print('{:>6s} {:>12s} {:>12s} {:>8s}'.format('planes', 'scalar us', 'fleet us', 'speedup'))
+  for n in (1, 10, 100, 1000, 10000):
+    fleet = Fleet(n)
+    fleet.spawn(seed=5)
+    planes = [scalar(fleet, i) for i in range(n)]
+    steps = max(20, 2000 // n)
+    tm = time.time()
+    for s in range(steps):
+      for p in planes:
+        step(p, 0.05)
+    t_scalar = (time.time() - tm) / steps
+    tm = time.time()
+    for s in range(steps):
+      fleet.step(0.05)
+    t_fleet = (time.time() - tm) / steps
+    print('{:6d} {:12.1f} {:12.1f} {:7.1f}x'.format(n, t_scalar * 1e6, t_fleet * 1e6,
+          t_scalar / t_fleet))
@@ -0,0 +1,321 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Smooth movement of the other planes in DogFight. At the moment each
+reply resets the velocities of the remote Aeroplane and a PI correction
+pulls it towards the position extrapolated from the packet, so a late or
+out of order reply makes it jump.
+
+SnapshotBuffer keeps the recent states of one player in the order they
+were sent and is asked for the state a fixed delay in the past, which is
+normally between two received snapshots so can be interpolated (Hermite
+curve for position using the speeds and direction, shortest way round for
+angles). If packets stop arriving it extrapolates from the newest one for
+up to MAX_EXTRAP seconds then holds, and after STALE seconds Buffers.stale()
+lists the player so it can be removed and no longer drawn. The sender's clock is related to the
+local one by the smallest transit time seen, changes to this are slewed
+in gradually so they don't make the plane jump. When snapshots arrive
+again after extrapolating the difference is faded out over BLEND seconds.
+
+Nothing here reads the clock so a trace of (receive time, player list)
+pairs always gives the same result, python3 DogFight_interp.py compares it
+with extrapolating from the latest packet using a synthetic trace, or a
+json file of [[t_recv, player_list], ...] given as an argument:
+
+  buffers = DogFight_interp.Buffers(delay=1.5)
+  ...
+  for o in olist: # player lists from DogFight_net.parse_reply()[2:]
+    buffers.add(o, time.time())
+  ...
+  state = buffers.sample(refid, time.time())
+  if state is not None:
+    x, y, z, h_speed, v_speed, pitch, direction, roll, yaw = state
+  ...
+  for refid in buffers.stale(time.time()):
+    buffers.remove(refid) # and stop drawing it
+"""
+import bisect
+import math
+
+DELAY = 1.5 # seconds in the past, more than the usual gap between replies
+MAX_EXTRAP = 1.0 # longest time to carry on past the newest snapshot
+OFFSET_WINDOW = 32 # packets used for the clock offset estimate
+SLEW = 0.1 # max rate of change of the offset, seconds per second
+BLEND = 0.3 # time constant for fading out the jump after extrapolating
+KEEP = 8 # snapshots older than the render time kept
+STALE = 20.0 # seconds with nothing received before a player is forgotten, 4 x FA_TM
+
+# indices in the player list from the server
+T_SENT, X, Y, Z, H_SPEED, V_SPEED, PITCH, DIRECTION, ROLL, YAW = 2, 3, 4, 5, 6, 7, 8, 9, 10, 12
+
+def _angle_lerp(a, b, f):
+  return a + ((b - a + 180.0) % 360.0 - 180.0) * f
+
+def _velocity(s):
+  d = math.radians(s[6])
+  return (s[3] * math.sin(d), s[4], s[3] * math.cos(d))
+
+class SnapshotBuffer(object):
+  def __init__(self, delay=DELAY, max_extrap=MAX_EXTRAP):
+    '''states of one player as (local time, state) in time order, state
+    is the tuple x, y, z, h_speed, v_speed, pitch, direction, roll, yaw
+    '''
+    self.delay = delay
+    self.max_extrap = max_extrap
+    self.times = []
+    self.states = []
+    self.offsets = [] # t_recv - t_sent of recent packets
+    self.offset = None # in use, moves towards min(offsets)
+    self.last_local = None
+    self.last_render = None
+    self.render_sent = None # time drawn by the last sample() on the sender's clock
+    self.last_out = None # state returned by the last sample()
+    self.guessing = None # time of the snapshot extrapolated from by the last sample()
+    self.error = (0.0, 0.0, 0.0) # position correction being faded out
+    self.last_sent = None
+    self.last_transit = None
+    self.last_recv = None
+    # statistics
+    self.received = 0
+    self.late = 0 # arrived after the time it applies to had been drawn
+    self.out_of_order = 0
+    self.duplicates = 0
+    self.interpolated = 0
+    self.extrapolated = 0
+    self.held = 0 # further past the newest than max_extrap
+    self.jitter = 0.0 # running estimate as rfc3550
+    self.interval = 0.0 # smoothed time between packets
+
+  def add(self, t_sent, state, t_recv):
+    '''t_sent is the sender's clock, t_recv the local one
+    '''
+    self.received += 1
+    transit = t_recv - t_sent
+    if self.last_transit is not None:
+      self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16.0
+    self.last_transit = transit
+    if self.last_recv is not None:
+      gap = t_recv - self.last_recv
+      self.interval = self.interval * 0.9 + gap * 0.1 if self.interval else gap
+    self.last_recv = t_recv
+    self.offsets.append(transit)
+    if len(self.offsets) > OFFSET_WINDOW:
+      self.offsets.pop(0)
+    if self.offset is None:
+      self.offset = transit
+    if self.last_sent is not None and t_sent < self.last_sent:
+      self.out_of_order += 1
+    self.last_sent = t_sent if self.last_sent is None else max(t_sent, self.last_sent)
+    i = bisect.bisect_left(self.times, t_sent)
+    if i < len(self.times) and self.times[i] == t_sent:
+      self.duplicates += 1
+      return
+    if self.last_render is not None and t_sent + self.offset < self.last_render:
+      self.late += 1 # still kept in case an earlier time is asked for
+    self.times.insert(i, t_sent)
+    self.states.insert(i, tuple(state))
+
+  def sample(self, t_local):
+    '''state at t_local - delay or None if nothing has arrived
+    '''
+    if not self.times:
+      return None
+    target = min(self.offsets)
+    frame = 0.0 if self.last_local is None else abs(t_local - self.last_local)
+    self.offset += max(-frame * SLEW, min(frame * SLEW, target - self.offset))
+    self.last_local = t_local
+    t = t_local - self.delay - self.offset # on the sender's clock
+    self.last_render = t_local - self.delay
+    self.render_sent = t
+    i = bisect.bisect_right(self.times, t)
+    if i > KEEP: # forget what can't be needed
+      del self.times[:i - KEEP]
+      del self.states[:i - KEEP]
+      i = KEEP
+    guessing = None
+    if i == 0:
+      s = self.states[0]
+    elif i < len(self.times):
+      self.interpolated += 1
+      s = self._interpolate(i - 1, i, t)
+    else:
+      guessing = self.times[-1]
+      dt = t - self.times[-1]
+      if dt > self.max_extrap:
+        self.held += 1
+        dt = self.max_extrap
+      else:
+        self.extrapolated += 1
+      s = extrapolate(self.states[-1], dt)
+    if self.guessing is not None and guessing != self.guessing: # new data, fade out the jump
+      expect = extrapolate(self.last_out, frame)
+      self.error = tuple(expect[k] - s[k] for k in range(3))
+    else:
+      fade = math.exp(-frame / BLEND)
+      self.error = tuple(e * fade for e in self.error)
+    self.guessing = guessing
+    s = (s[0] + self.error[0], s[1] + self.error[1], s[2] + self.error[2]) + tuple(s[3:])
+    self.last_out = s
+    return s
+
+  def _interpolate(self, i0, i1, t):
+    t0, t1 = self.times[i0], self.times[i1]
+    s0, s1 = self.states[i0], self.states[i1]
+    span = t1 - t0
+    f = (t - t0) / span
+    # cubic hermite for position using the velocities at each end
+    f2, f3 = f * f, f * f * f
+    h00, h10, h01, h11 = 2 * f3 - 3 * f2 + 1, f3 - 2 * f2 + f, -2 * f3 + 3 * f2, f3 - f2
+    v0, v1 = _velocity(s0), _velocity(s1)
+    pos = [h00 * s0[k] + h10 * span * v0[k] + h01 * s1[k] + h11 * span * v1[k]
+           for k in range(3)]
+    return (pos[0], pos[1], pos[2],
+            s0[3] + (s1[3] - s0[3]) * f, s0[4] + (s1[4] - s0[4]) * f,
+            _angle_lerp(s0[5], s1[5], f), _angle_lerp(s0[6], s1[6], f),
+            _angle_lerp(s0[7], s1[7], f), s0[8] + (s1[8] - s0[8]) * f)
+
+  def suggested_delay(self):
+    '''delay that would normally have a snapshot either side
+    '''
+    return self.interval + 4.0 * self.jitter
+
+  def stats(self):
+    return {'received': self.received, 'late': self.late,
+            'out_of_order': self.out_of_order, 'duplicates': self.duplicates,
+            'interpolated': self.interpolated, 'extrapolated': self.extrapolated,
+            'held': self.held, 'jitter': self.jitter, 'interval': self.interval}
+
+def extrapolate(s, dt):
+  '''move state s on by dt seconds as Aeroplane.update_position() would
+  '''
+  vx, vy, vz = _velocity(s)
+  return (s[0] + vx * dt, s[1] + vy * dt, s[2] + vz * dt, s[3], s[4], s[5],
+          s[6] + math.degrees(s[8]) * dt, s[7], s[8])
+
+def state_of(o):
+  '''the tuple used by SnapshotBuffer from a player list sent by the server
+  '''
+  return (o[X], o[Y], o[Z], o[H_SPEED], o[V_SPEED], o[PITCH], o[DIRECTION], o[ROLL], o[YAW])
+
+class Buffers(object):
+  def __init__(self, delay=DELAY, max_extrap=MAX_EXTRAP):
+    '''a SnapshotBuffer for each player keyed by refid
+    '''
+    self.delay = delay
+    self.max_extrap = max_extrap
+    self.players = {}
+
+  def add(self, o, t_recv):
+    buf = self.players.get(o[0], None)
+    if buf is None:
+      buf = SnapshotBuffer(self.delay, self.max_extrap)
+      self.players[o[0]] = buf
+    buf.add(o[T_SENT], state_of(o), t_recv)
+
+  def sample(self, refid, t_local):
+    buf = self.players.get(refid, None)
+    return None if buf is None else buf.sample(t_local)
+
+  def remove(self, refid):
+    self.players.pop(refid, None)
+
+  def stale(self, t_local, limit=STALE):
+    '''refids of the players nothing has arrived for in limit seconds,
+    they have gone or the server has stopped sending them
+    '''
+    return [refid for refid, buf in self.players.items()
+            if buf.last_recv is not None and t_local - buf.last_recv > limit]
+
+  def stats(self):
+    total = {}
+    for buf in self.players.values():
+      for k, v in buf.stats().items():
+        total[k] = total.get(k, 0) + v
+    if self.players:
+      total['jitter'] /= len(self.players)
+      total['interval'] /= len(self.players)
+    return total
+
+def replay(trace, delay=DELAY, fps=60.0, refid=None):
+  '''feed a trace of (t_recv, player list) in order of arrival through a
+  Buffers and sample it at fps. Returns the Buffers and a list of
+  (t_local, t_sent, state) for refid (the first player in the trace if
+  None) where t_sent is the time shown on the sender's clock
+  '''
+  buffers = Buffers(delay)
+  refid = refid or trace[0][1][0]
+  out = []
+  t = trace[0][0]
+  for t_recv, o in trace:
+    while t < t_recv:
+      s = buffers.sample(refid, t)
+      if s is not None:
+        out.append((t, buffers.players[refid].render_sent, s))
+      t += 1.0 / fps
+    buffers.add(o, t_recv)
+  return buffers, out
+
+if __name__ == '__main__':
+  import json, random, sys
+  random.seed(3)
+  CLOCK = 1000.0 # sender's clock is this far ahead
+
+  def truth(t): # circling plane on the sender's clock
+    a = t * 0.2
+    return ('aa:bb', 0.0, t + CLOCK, 500.0 * math.sin(a), 300.0 + 20.0 * math.sin(t),
+            500.0 * math.cos(a) - 500.0, 100.0, 20.0 * math.cos(t), 0.0,
+            math.degrees(a) + 90.0, 30.0, 0.0, 0.2, 0.0, 1000.0, 0.0)
+
+  if len(sys.argv) > 1:
+    with open(sys.argv[1]) as f:
+      trace = [tuple(p) for p in json.load(f)]
+  else: # packets every second, mostly 50 to 400ms latency but with spikes
+    trace = [] # up to 2.5s so some overtake or are late, 5% lost
+    for k in range(300):
+      if random.random() < 0.05:
+        continue
+      t = k * 1.0
+      lag = random.uniform(0.05, 0.4) if random.random() < 0.85 else random.uniform(0.4, 2.5)
+      trace.append((t + lag, truth(t)))
+    trace.sort(key=lambda p: p[0])
+
+  def report(name, samples):
+    err, jump = [], []
+    last = None
+    for t, t_sent, s in samples[600:]: # after the first 10s
+      if len(sys.argv) == 1: # error from the true position at the time shown
+        ref = truth(t_sent - CLOCK)
+        err.append(math.sqrt(sum((s[k] - ref[k + 3]) ** 2 for k in range(3))))
+      if last is not None: # movement beyond that expected in a frame
+        exp = extrapolate(last[1], t - last[0])
+        jump.append(math.sqrt(sum((s[k] - exp[k]) ** 2 for k in range(3))))
+      last = (t, s)
+    err.sort()
+    jump.sort()
+    print('{:24s} error mean {:6.2f} max {:6.2f}  snap p99 {:6.2f} max {:6.2f}'.format(name,
+          sum(err) / max(len(err), 1), err[-1] if err else 0.0,
+          jump[int(len(jump) * 0.99)], jump[-1]))
+
+  # what happens now: extrapolate from the newest packet received
+  newest, samples = None, []
+  t, i = trace[0][0], 0
+  while i < len(trace):
+    while i < len(trace) and trace[i][0] <= t:
+      if newest is None or trace[i][1][2] > newest[2]:
+        newest = trace[i][1]
+      i += 1
+    if newest is not None:
+      samples.append((t, t + CLOCK, extrapolate(state_of(newest), t + CLOCK - newest[2])))
+    t += 1.0 / 60.0
+  report('extrapolate newest', samples)
+  for delay in (1.0, DELAY, 2.0):
+    buffers, samples = replay(trace, delay)
+    report('buffer delay {:.1f}s'.format(delay), samples)
+    print('  ', buffers.stats())
+  # same trace, same answer
+  assert replay(trace)[1] == replay(trace)[1]
+  # a player that stops arriving is stale once STALE has passed
+  buffers = replay(trace)[0]
+  t_last = trace[-1][0]
+  assert buffers.stale(t_last + STALE * 0.5) == []
+  assert buffers.stale(t_last + STALE * 1.5) == ['aa:bb']
@@ -0,0 +1,371 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Network side of DogFight.py, kept out of the main file so that it can be
+used without a display (by bots, servers and tests).
+
+json_load() in DogFight used to start a new thread for every poll and open
+a new connection with urllib each time, so the tcp (and dns) set up cost
+more than the request itself. NetClient keeps one http/1.1 keep-alive
+connection open and uses one thread for the whole game. The main loop
+hands it the parameters with send() and picks up the answer with
+get_reply() so only the main thread ever changes the others dict:
+
+  net = DogFight_net.NetClient()
+  ...
+  reply = net.get_reply()
+  if reply is not None:
+    DogFight_net.apply_reply(a, others, reply, new_plane, buffers)
+  if not net.busy and a.last_pos_time > others["start"] + a.rtime:
+    params = DogFight_net.make_params(a)
+    others["start"] = params["tm"]
+    net.send(params)
+
+buffers is an optional DogFight_interp.Buffers, each player sent is added
+to it so the other planes can be drawn where they were a fixed delay ago
+rather than jumping when a reply is late. The request and reply are
+exactly as before so the same
+DogFight_rpi_json.php works, or DogFight_server.py. python3 DogFight_net.py
+runs a check against DogFight_server on localhost and compares the time
+per poll with opening a new connection each time.
+"""
+import json
+import logging
+import math
+import socket
+import threading
+import time
+
+try:
+  import http.client as http_client
+  from urllib.parse import urlencode, urlsplit
+except ImportError: # python2
+  import httplib as http_client
+  from urllib import urlencode
+  from urlparse import urlsplit
+
+LOGGER = logging.getLogger(__name__)
+
+URL = "http://www.eldwick.org.uk/sharecalc/rpi_json.php"
+TIMEOUT = 5.0 # seconds for connect and for each read
+RETRY_TM = 2.0 # wait after a failed request before trying again
+NR_TM = 1.0 #check much less frequently until something comes back
+FA_TM = 5.0
+NR_DIST = 250
+FA_DIST = 1500
+RADAR_ID = "radar" # first item of the radar summary at the end of a reply
+NEAREST_ID = "nearest" # first item of [NEAREST_ID, refid, distance] after the players
+
+class Avatar(object):
+  def __init__(self, refid):
+    '''the attributes of DogFight.Aeroplane used by make_params() and
+    apply_reply(), for bots and tests that don't draw anything
+    '''
+    self.refid = refid
+    self.x, self.y, self.z = 0.0, 0.0, 0.0
+    self.x_perr, self.y_perr, self.z_perr = 0.0, 0.0, 0.0
+    self.x_ierr, self.y_ierr, self.z_ierr = 0.0, 0.0, 0.0
+    self.d_err = 0.0
+    self.v_speed, self.h_speed = 0.0, 0.0
+    self.rollrate, self.pitchrate, self.yaw = 0.0, 0.0, 0.0
+    self.direction, self.roll, self.pitch = 0.0, 0.0, 0.0
+    self.power_setting = 0.0
+    self.last_time = time.time()
+    self.last_pos_time = self.last_time
+    self.del_time = None
+    self.rtime = 60
+    self.nearest = None
+    self.other_damage = 0.0
+    self.damage = 0.0
+    self.radar = [] # x, z, count of players not sent in full
+
+def make_params(ae, radar=False):
+  '''dict of the query parameters for one poll. Damage done to the nearest
+  plane is passed on and reset. With radar DogFight_server adds a summary
+  of the players it leaves out (the php ignores it)
+  '''
+  tm_now = time.time()
+  jstring = json.dumps([ae.refid, ae.last_time, ae.x, ae.y, ae.z,
+      ae.h_speed, ae.v_speed, ae.pitch, ae.direction, ae.roll,
+      ae.pitchrate, ae.yaw, ae.rollrate, ae.power_setting, ae.damage], separators=(',',':'))
+  if ae.nearest:
+    n_id = ae.nearest.refid
+    n_damage = ae.nearest.other_damage
+    ae.nearest.other_damage = 0.0
+  else:
+    n_id = ""
+    n_damage = 0.0
+  params = {"id":ae.refid, "tm":tm_now, "x":ae.x, "z":ae.z,
+          "json":jstring, "nearest":n_id, "damage":n_damage}
+  if radar:
+    params["radar"] = 1
+  return params
+
+def parse_reply(text):
+  '''list [rel_tm, own_damage, player, player...] from the server text or
+  None if it sent a message such as "nobody near" or "error". The list
+  can be just the radar and nearest entries if no players were due
+  '''
+  try:
+    olist = json.loads(text)
+  except ValueError:
+    return None
+  if isinstance(olist, list) and len(olist) >= 2:
+    return olist
+  return None
+
+def apply_reply(ae, others, reply, new_plane=Avatar, buffers=None):
+  '''update ae and others (keyed by refid) from a reply returned by
+  NetClient.get_reply(). new_plane(refid) is called to make an entry for
+  a player not seen before. If buffers (DogFight_interp.Buffers) is given
+  each player is added to it. Returns True if the server sent a list
+  '''
+  tm_now, status, text = reply
+  if status != 200:
+    print(status if status else "exception: {}".format(text))
+    return False
+  olist = parse_reply(text)
+  if olist is None:
+    print(text)
+    return False
+  apply_list(ae, others, tm_now, olist, new_plane, buffers)
+  return True
+
+def apply_list(ae, others, tm_now, olist, new_plane=Avatar, buffers=None):
+  '''the part of apply_reply() after the text has been parsed, also used
+  with DogFight_wire.to_reply() for binary replies
+  '''
+  #smooth time offset value
+  ae.del_time = ae.del_time * 0.9 + olist[0] * 0.1 if ae.del_time else olist[0]
+  #own damage is cumulative and not reset on server until dead!
+  ae.damage = olist[1]
+  olist = olist[2:]
+  server_nearest = None
+  while olist and olist[-1][0] in (RADAR_ID, NEAREST_ID):
+    entry = olist.pop()
+    if entry[0] == RADAR_ID:
+      ae.radar = entry[1]
+    else: # over all the players, including those not sent this time
+      server_nearest = entry
+  if not olist and server_nearest is None:
+    return # none due this poll, keep the last nearest and rtime
+  """
+  synchronisation system: sends time.time() which is used to calculate
+  an offset on the server and which is inserted as the second term
+  in the json string. When the list of other players comes back from
+  the server it is preceded by the same offset time inserted in this json.
+  This is used to adjust the last_time for all
+  the other avatars.
+  """
+  nearest = None
+  ae.rtime = 60
+  t_recv = time.time()
+  for o in olist:
+    if buffers is not None: # on the sender's clock, related to ours by the buffer
+      buffers.add(o, t_recv)
+    if not(o[0] in others):
+      others[o[0]] = new_plane(o[0])
+    oa = others[o[0]] #oa is other aeroplane, ae is this one!
+    oa.refid = o[0]
+    #exponential smooth time offset values
+    oa.del_time = oa.del_time * 0.9 + o[1] * 0.1 if oa.del_time else o[1]
+    oa.last_time = o[2] + oa.del_time - ae.del_time # o[1] inserted by server code
+    dt = tm_now - oa.last_time
+    if oa.x == 0.0:
+      oa.x, oa.y, oa.z = o[3], o[4], o[5]
+    nx = o[3] + o[6] * math.sin(math.radians(o[9])) * dt
+    ny = o[4] + o[7] * dt
+    nz = o[5] + o[6] * math.cos(math.radians(o[9])) * dt
+    distance = math.hypot(nx - ae.x, nz - ae.z)
+    if not nearest or distance < nearest:
+      nearest = distance
+      ae.nearest = oa
+    oa.x_perr, oa.y_perr, oa.z_perr = oa.x - nx, oa.y - ny, oa.z - nz
+    oa.x_ierr += oa.x_perr
+    oa.y_ierr += oa.y_perr
+    oa.z_ierr += oa.z_perr
+    oa.d_err = ((oa.direction - (o[9] + o[12] * dt) + 180) % 360 - 180) / 2
+    oa.h_speed = o[6]
+    oa.v_speed = o[7]
+    oa.pitch = o[8]
+    oa.roll = o[10]
+    oa.pitchrate = o[11]
+    oa.yaw = o[12]
+    oa.rollrate = o[13]
+    oa.power_setting = o[14]
+    oa.damage = o[15]
+
+  if server_nearest is not None:
+    nearest = server_nearest[2]
+    ae.nearest = others.get(server_nearest[1], ae.nearest)
+  if nearest:
+    ae.rtime = NR_TM + (max(min(nearest, FA_DIST), NR_DIST) - NR_DIST) / \
+            (FA_DIST - NR_DIST) * (FA_TM - NR_TM)
+
+class NetClient(object):
+  def __init__(self, url=URL, timeout=TIMEOUT, retry_time=RETRY_TM):
+    '''one background thread with a persistent connection to url. Only the
+    most recent parameters passed to send() are kept, if the game sends
+    again before the last request has gone the older one is dropped
+    '''
+    parts = urlsplit(url)
+    self.host = parts.hostname
+    self.port = parts.port
+    self.path = parts.path or '/'
+    self.timeout = timeout
+    self.retry_time = retry_time
+    self.conn = None
+    self.lock = threading.Condition()
+    self.pending = None # (params, body) waiting to be sent
+    self.reply = None # (tm, status, text) waiting for get_reply()
+    self.busy = False # True from send() until the reply is ready
+    self.running = True
+    self.requests = 0
+    self.errors = 0
+    self.connects = 0
+    self.latency = 0.0 # seconds for the last request
+    self.thread = threading.Thread(target=self._run)
+    self.thread.daemon = True #allows the program to exit while waiting for the server
+    self.thread.start()
+
+  def send(self, params, body=None):
+    '''GET with params or, if body (bytes) is given, POST it with params in
+    the query. The reply text is then bytes too
+    '''
+    with self.lock:
+      self.pending = (params, body)
+      self.busy = True
+      self.lock.notify()
+
+  def get_reply(self):
+    '''returns (tm, status, text) for the last completed request, or None
+    if nothing new has arrived. tm is the tm parameter sent, status is the
+    http status or None if the request failed, when text is the exception
+    '''
+    with self.lock:
+      reply = self.reply
+      self.reply = None
+    return reply
+
+  def fetch(self, params, body=None):
+    '''do one request on the open connection and return (status, text). A
+    server can close a keep-alive connection whenever it likes so if the
+    old connection fails the request is tried once on a new one
+    '''
+    query = '{}?{}'.format(self.path, urlencode(params))
+    for attempt in (0, 1):
+      fresh = self.conn is None
+      if fresh:
+        self.conn = http_client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.connects += 1
+      try:
+        if self.conn.sock is None:
+          self.conn.connect()
+          # small requests so don't wait to fill a packet
+          self.conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if body is None:
+          self.conn.request('GET', query)
+        else:
+          self.conn.request('POST', query, body,
+                            {'Content-Type': 'application/octet-stream'})
+        r = self.conn.getresponse()
+        text = r.read()
+        if body is None:
+          text = text.decode('utf-8')
+        if r.getheader('connection', '').lower() == 'close':
+          self.close_connection()
+        return r.status, text
+      except (http_client.HTTPException, socket.error) as e:
+        self.close_connection()
+        if fresh or attempt == 1:
+          raise e
+
+  def close_connection(self):
+    if self.conn is not None:
+      self.conn.close()
+      self.conn = None
+
+  def _run(self):
+    while True:
+      with self.lock:
+        while self.pending is None and self.running:
+          self.lock.wait()
+        if not self.running:
+          break
+        params, body = self.pending
+        self.pending = None
+      tm = time.time()
+      try:
+        status, text = self.fetch(params, body)
+      except Exception as e:
+        status, text = None, str(e)
+        self.errors += 1
+        LOGGER.warning('request to %s failed: %s', self.host, e)
+      self.latency = time.time() - tm
+      self.requests += 1
+      with self.lock:
+        self.reply = (params['tm'], status, text)
+        self.busy = self.pending is not None
+      if status is None:
+        time.sleep(self.retry_time)
+    self.close_connection()
+
+  def stats(self):
+    return {'requests': self.requests, 'errors': self.errors,
+            'connects': self.connects, 'latency': self.latency}
+
+  def close(self):
+    with self.lock:
+      self.running = False
+      self.lock.notify()
+    self.thread.join(self.timeout)
+
+if __name__ == '__main__':
+  # check against DogFight_server on localhost
+  try:
+    from urllib.request import urlopen
+  except ImportError: # python2
+    from urllib import urlopen
+  import DogFight_server
+
+  server = DogFight_server.Server(('127.0.0.1', 0))
+  server.start()
+  url = server.url()
+  n = 200
+  try:
+    a, b = Avatar('00:00:00:00:00:0a'), Avatar('00:00:00:00:00:0b')
+    b.x, b.y, b.z, b.h_speed, b.direction = 100.0, 200.0, 300.0, 50.0, 90.0
+    others_a, others_b = {}, {}
+    net_a, net_b = NetClient(url), NetClient(url)
+    tm = time.time()
+    for i in range(n):
+      for ae, others, net in ((a, others_a, net_a), (b, others_b, net_b)):
+        net.send(make_params(ae))
+        while net.busy:
+          time.sleep(0.0001)
+        reply = net.get_reply()
+        if i > 0: # the first of each gets "nobody near"
+          assert apply_reply(ae, others, reply)
+    t_keep = (time.time() - tm) / (2 * n)
+    o = others_a['00:00:00:00:00:0b']
+    assert (o.x, o.y, o.z, o.h_speed) == (100.0, 200.0, 300.0, 50.0)
+    assert set(others_b) == set(['00:00:00:00:00:0a'])
+    # the same reply through a DogFight_interp.Buffers
+    import DogFight_interp
+    buffers = DogFight_interp.Buffers(delay=0.0)
+    net_a.send(make_params(a))
+    while net_a.busy:
+      time.sleep(0.0001)
+    assert apply_reply(a, others_a, net_a.get_reply(), Avatar, buffers)
+    state = buffers.sample('00:00:00:00:00:0b', time.time())
+    assert abs(state[0] - 100.0) < 1.0 and state[1:3] == (200.0, 300.0)
+    print('keep-alive {:.2f}ms per poll {} {}'.format(t_keep * 1000.0, net_a.stats(), net_b.stats()))
+    net_a.close()
+    net_b.close()
+    tm = time.time()
+    for i in range(n):
+      urlopen('{}?{}'.format(url, urlencode(make_params(a)))).read()
+    t_new = (time.time() - tm) / n
+    print('new connection {:.2f}ms per poll'.format(t_new * 1000.0))
+  finally:
+    server.stop()
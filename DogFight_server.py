@@ -0,0 +1,512 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Python stand in for DogFight_rpi_json.php and its MySQL table so that
+DogFight can be played on a local network, or load tested, without a web
+server and database. The players are held in memory and the requests and
+replies are the same as the php version:
+
+  GET ?id=..&tm=..&x=..&z=..&json=[...]&nearest=..&damage=..
+  => [rel_tm,own_damage,[player],[player]...] or "nobody near" or "error"
+
+A POST with a DogFight_wire UPDATE message as the body (and id, tm,
+nearest and damage in the query) gets a binary SNAPSHOT back instead. The
+two kinds of client can see each other.
+
+Each tick (--tick_rate times a second) players not heard from for
+--stale seconds are removed and, if --save is given, the table is written
+to a json file every --save_tm seconds so it survives a restart.
+
+Rather than every player in the FAR box (which is what the php sends) each
+reply only has the nearest --k players within --radius, found using a
+uniform grid. Further ones in that set are sent less often (every 2nd,
+4th poll, see TIERS) and the client extrapolates in between. If the
+request has radar=1 the players left out are added as an entry
+["radar", [x, z, count, x, z, count...]] counted in RADAR_CELL squares,
+followed by ["nearest", refid, distance] for the nearest player whether
+sent this time or not, so the client can pick its poll rate.
+--k 0 gives the php behaviour. python3 DogFight_server.py --benchmark
+compares the grid with checking every player.
+
+  python3 DogFight_server.py --port 8080
+  python3 DogFight.py http://localhost:8080/rpi_json.php
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import parse_qs
+except ImportError: # python2
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urlparse import parse_qs
+
+import DogFight_wire
+from DogFight_net import NEAREST_ID, RADAR_ID
+
+LOGGER = logging.getLogger(__name__)
+
+FAR = 5000 # same box as the php version
+STALE_TM = 60.0 # seconds without a request before a player is removed
+TICK_RATE = 2.0 # housekeeping per second
+SAVE_TM = 10.0
+INTEREST_K = 16 # players sent in full to each client
+RADIUS = 5000.0 # and only if this close
+CELL = 1000.0 # side of the grid squares
+TIERS = ((1000.0, 1), (2500.0, 2), (None, 4)) # (up to distance, send every nth poll)
+RADAR_RANGE = 10000.0 # players further than this aren't counted for the radar
+RADAR_CELL = 1000.0
+
+# characters allowed by the php for each parameter
+CLEAN = {'id': re.compile(r'[^0-9a-f:]'), 'tm': re.compile(r'[^0-9.\-]'),
+         'x': re.compile(r'[^0-9.\-]'), 'z': re.compile(r'[^0-9.\-]'),
+         'json': re.compile(r'[^0-9a-f:.,\-"TrueFals\[\]]'),
+         'damage': re.compile(r'[^0-9.\-]'), 'nearest': re.compile(r'[^0-9a-f:]'),
+         'radar': re.compile(r'[^01]')}
+
+class Player(object):
+  def __init__(self, refid, x, z, state, tm):
+    '''one row of the table. state is the player list with rel_tm
+    inserted, text is the same as json ready to be joined into replies
+    '''
+    self.refid = refid
+    self.damage = 0.0
+    self.cell = None # key in Grid.cells
+    self.index = 0 # order of joining, spreads the tiered updates
+    self.polls = 0
+    self.set_state(x, z, state, tm)
+
+  def set_state(self, x, z, state, tm):
+    self.x, self.z = x, z
+    self.state = state
+    self.text = json.dumps(state, separators=(',', ':'))
+    self.tm = tm
+
+class Grid(object):
+  def __init__(self, cell=CELL):
+    '''uniform grid of squares each holding a set of the Players in it
+    '''
+    self.cell = cell
+    self.cells = {}
+
+  def key(self, x, z):
+    return (int(math.floor(x / self.cell)), int(math.floor(z / self.cell)))
+
+  def add(self, player):
+    player.cell = self.key(player.x, player.z)
+    self.cells.setdefault(player.cell, set()).add(player)
+
+  def remove(self, player):
+    cell = self.cells.get(player.cell, None)
+    if cell is not None:
+      cell.discard(player)
+      if not cell:
+        del self.cells[player.cell]
+    player.cell = None
+
+  def move(self, player):
+    if self.key(player.x, player.z) != player.cell:
+      self.remove(player)
+      self.add(player)
+
+  def query(self, x, z, r):
+    '''Players in the squares overlapping the square of side 2r round x, z
+    '''
+    i0, j0 = self.key(x - r, z - r)
+    i1, j1 = self.key(x + r, z + r)
+    if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells): # quicker to check each cell
+      keys = [k for k in self.cells if i0 <= k[0] <= i1 and j0 <= k[1] <= j1]
+    else:
+      keys = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+    for k in keys:
+      for p in self.cells.get(k, ()):
+        yield p
+
+class GameState(object):
+  def __init__(self, far=FAR, stale_tm=STALE_TM, k=INTEREST_K, radius=RADIUS,
+               tiers=TIERS, cell=CELL):
+    '''the players keyed by refid and the rules for updating them, all
+    methods are safe to call from the request threads. If k is 0 every
+    player in the far box is sent, as the php does
+    '''
+    self.far = far
+    self.stale_tm = stale_tm
+    self.k = k
+    self.radius = radius
+    self.tiers = tiers
+    self.grid = Grid(cell)
+    self.joined = 0
+    self.players = {}
+    self.channels = {} # refid => DogFight_wire.Channel for binary clients
+    self.lock = threading.Lock()
+    self.dirty = False
+    self.requests = 0
+    self.bytes_out = 0
+    self.busy_time = 0.0 # seconds spent inside update()
+
+  def clean(self, query):
+    '''dict of the parameters filtered as the php does, missing ones are ""
+    '''
+    return dict((k, CLEAN[k].sub('', query.get(k, ''))) for k in CLEAN)
+
+  def update(self, query, state=None):
+    '''apply one request. query is a dict of the get parameters. If state
+    (the 15 item list a client sends) is given the json parameter isn't
+    needed. Returns (rel_tm, own_damage, list of Players to send, radar
+    list, (distance, Player) of the nearest or None) or None if the request
+    is incomplete
+    '''
+    q = self.clean(query)
+    if q['id'] == '' or q['tm'] == '' or (state is None and
+              (q['x'] == '' or q['z'] == '' or q['json'] == '')):
+      return None
+    tm_now = time.time()
+    try:
+      rel_tm = tm_now - float(q['tm'])
+      if state is None:
+        state = json.loads(q['json'])
+        x, z = float(q['x']), float(q['z'])
+      else:
+        x, z = state[2], state[4]
+      damage = float(q['damage']) if q['damage'] != '' else 0.0
+    except ValueError:
+      return None
+    if not isinstance(state, list) or len(state) != 15:
+      return None
+    state = [state[0], rel_tm] + state[1:] #insert at location [1]
+    with self.lock:
+      player = self.players.get(q['id'], None)
+      if player is None:
+        own_damage = 0.0
+        player = Player(q['id'], x, z, state, tm_now)
+        self.add(player)
+      else:
+        own_damage = player.damage
+        player.set_state(x, z, state, tm_now)
+        self.grid.move(player)
+      player.polls += 1
+      # update damage of nearest
+      if q['nearest'] != '' and damage != 0:
+        target = self.players.get(q['nearest'], None)
+        if target is not None:
+          target.damage = 0.0 if damage < 0 else target.damage + damage # negative resets
+      near, rest, nearest = self.nearby(player, q['radar'] == '1')
+      radar = self.radar(rest) if q['radar'] == '1' else None
+      self.dirty = True
+    return rel_tm, own_damage, near, radar, nearest
+
+  def add(self, player):
+    player.index = self.joined
+    self.joined += 1
+    self.players[player.refid] = player
+    self.grid.add(player)
+
+  def nearby(self, player, radar=False):
+    '''returns (players to send now, players only for the radar, (distance,
+    Player) of the nearest of all, sent or not, or None). Without k it is
+    the other players in the square of side 2 * far round player
+    '''
+    if not self.k:
+      near = [p for p in self.players.values() if p is not player and
+              abs(p.x - player.x) < self.far and abs(p.z - player.z) < self.far]
+      dists = [(math.hypot(p.x - player.x, p.z - player.z), p.index, p) for p in near]
+      nearest = min(dists) if dists else None
+      return near, [], nearest and (nearest[0], nearest[2])
+    reach = max(self.far, RADAR_RANGE) if radar else self.far
+    r2 = self.radius ** 2
+    found, rest = [], []
+    for p in self.grid.query(player.x, player.z, reach):
+      if p is player:
+        continue
+      dx, dz = abs(p.x - player.x), abs(p.z - player.z)
+      d2 = dx * dx + dz * dz
+      if dx < self.far and dz < self.far and d2 <= r2:
+        found.append((d2, p.index, p))
+      elif radar and dx < reach and dz < reach:
+        rest.append(p)
+    nearest = min(found) if found else None # before the tiers leave any out
+    nearest = nearest and (math.sqrt(nearest[0]), nearest[2])
+    if len(found) > self.k: # only the nearest k, the rest go on the radar
+      found.sort()
+      if radar:
+        rest.extend(f[2] for f in found[self.k:])
+      found = found[:self.k]
+    near = [p for d2, _, p in found # skipped ones still count towards k
+            if (player.polls + p.index) % self.every(math.sqrt(d2)) == 0]
+    return near, rest, nearest
+
+  def every(self, dist):
+    '''number of polls between sending a player this far away
+    '''
+    for limit, n in self.tiers:
+      if limit is None or dist <= limit:
+        return n
+    return 1
+
+  def radar(self, rest):
+    '''flat list of x, z, count for the RADAR_CELL squares with players
+    '''
+    cells = {}
+    for p in rest:
+      k = (int(math.floor(p.x / RADAR_CELL)), int(math.floor(p.z / RADAR_CELL)))
+      c = cells.setdefault(k, [0.0, 0.0, 0])
+      c[0] += p.x
+      c[1] += p.z
+      c[2] += 1
+    summary = []
+    for x, z, n in cells.values():
+      summary.extend([round(x / n), round(z / n), n])
+    return summary
+
+  def reply_json(self, query):
+    '''text the php script would send back
+    '''
+    tm = time.time()
+    result = self.update(query)
+    if result is None:
+      text = 'error'
+    else:
+      rel_tm, own_damage, near, radar, nearest = result
+      entries = [p.text for p in near]
+      if radar:
+        entries.append(json.dumps([RADAR_ID, radar], separators=(',', ':')))
+      if radar is not None and nearest is not None: # only clients asking for radar know it
+        entries.append(json.dumps([NEAREST_ID, nearest[1].refid, round(nearest[0], 1)],
+                                  separators=(',', ':')))
+      if entries:
+        text = '[{},{},{}]'.format(rel_tm, own_damage, ','.join(entries))
+      else:
+        text = 'nobody near'
+    self.count(len(text), tm)
+    return text
+
+  def reply_binary(self, query, body):
+    '''DogFight_wire SNAPSHOT bytes, or None if the request can't be used
+    '''
+    tm = time.time()
+    refid = CLEAN['id'].sub('', query.get('id', ''))
+    with self.lock:
+      chan = self.channels.get(refid, None)
+      if chan is None:
+        chan = DogFight_wire.Channel(DogFight_wire.SNAPSHOT)
+        self.channels[refid] = chan
+    try:
+      msg = chan.decode(body)
+      state = msg['players'][refid]
+    except (DogFight_wire.WireError, KeyError):
+      return None
+    state = state[:1] + state[2:] # rel_tm is worked out here
+    result = self.update(query, state)
+    if result is None:
+      return None
+    rel_tm, own_damage, near, _, _ = result
+    data = chan.encode([p.state for p in near], rel_tm, own_damage)
+    self.count(len(data), tm)
+    return data
+
+  def count(self, nbytes, tm):
+    with self.lock:
+      self.requests += 1
+      self.bytes_out += nbytes
+      self.busy_time += time.time() - tm
+
+  def expire(self, tm_now=None):
+    '''remove players not heard from for stale_tm, returns how many went
+    '''
+    tm_now = tm_now or time.time()
+    with self.lock:
+      old = [k for k, p in self.players.items() if tm_now - p.tm > self.stale_tm]
+      for k in old:
+        self.grid.remove(self.players.pop(k))
+        self.channels.pop(k, None)
+      if old:
+        self.dirty = True
+    return len(old)
+
+  def save(self, path):
+    with self.lock:
+      table = dict((k, {'x': p.x, 'z': p.z, 'tm': p.tm, 'state': p.state,
+                        'damage': p.damage}) for k, p in self.players.items())
+      self.dirty = False
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+      json.dump(table, f)
+    os.replace(tmp, path)
+
+  def load(self, path):
+    try:
+      with open(path, 'r') as f:
+        table = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+      LOGGER.warning('unable to load %s: %s', path, e)
+      return
+    with self.lock:
+      for k, v in table.items():
+        if k in self.players:
+          self.grid.remove(self.players[k])
+        self.add(Player(k, v['x'], v['z'], v['state'], v['tm']))
+        self.players[k].damage = v['damage']
+
+  def stats(self):
+    with self.lock:
+      return {'players': len(self.players), 'requests': self.requests,
+              'bytes_out': self.bytes_out, 'busy_time': self.busy_time}
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1' # keep-alive for DogFight_net.NetClient
+  disable_nagle_algorithm = True
+
+  def query(self):
+    return dict((k, v[0]) for k, v in
+                parse_qs(self.path.split('?', 1)[1] if '?' in self.path else '').items())
+
+  def do_GET(self):
+    self.send_body(self.server.game.reply_json(self.query()).encode('utf-8'),
+                   'text/html; charset=utf-8')
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    data = self.server.game.reply_binary(self.query(), body)
+    if data is None:
+      self.send_body(b'error', 'text/html', 400)
+    else:
+      self.send_body(data, 'application/octet-stream')
+
+  def send_body(self, body, content_type, code=200):
+    self.send_response(code)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, fmt, *args):
+    LOGGER.debug(fmt, *args)
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, address=('', 8080), game=None, tick_rate=TICK_RATE,
+               save=None, save_tm=SAVE_TM):
+    '''http server with a GameState and a thread doing the housekeeping.
+    Call serve_forever() (or start() to run it in another thread)
+    '''
+    HTTPServer.__init__(self, address, Handler)
+    self.game = game or GameState()
+    self.tick_rate = tick_rate
+    self.save = save
+    self.save_tm = save_tm
+    if save and os.path.exists(save):
+      self.game.load(save)
+    self.running = True
+    self.ticker = threading.Thread(target=self._tick)
+    self.ticker.daemon = True
+    self.ticker.start()
+
+  def _tick(self):
+    last_save = time.time()
+    while self.running:
+      time.sleep(1.0 / self.tick_rate)
+      n = self.game.expire()
+      if n:
+        LOGGER.info('removed %d stale players', n)
+      if self.save and self.game.dirty and time.time() > last_save + self.save_tm:
+        self.game.save(self.save)
+        last_save = time.time()
+
+  def url(self):
+    return 'http://{}:{}/rpi_json.php'.format(self.server_address[0] or 'localhost',
+                                              self.server_address[1])
+
+  def start(self):
+    thr = threading.Thread(target=self.serve_forever)
+    thr.daemon = True
+    thr.start()
+    return thr
+
+  def stop(self):
+    self.running = False
+    self.shutdown()
+    self.server_close()
+    if self.save:
+      self.game.save(self.save)
+
+def benchmark(sizes=(10, 30, 100, 300, 1000), polls=2000):
+  '''time per request and size of reply for players spread over an area
+  the size of the DogFight map and crowded into 2km square. k 0 is the
+  php behaviour, r is with the radar summary
+  '''
+  import json as json_
+  random.seed(0)
+  print('{:>8s} {:>5s} {:>4s} {:>10s} {:>8s} {:>10s} {:>8s} {:>6s}'.format('area', 'n',
+        'k', 'us/req', 'sent', 'bytes', 'radar', 'speed'))
+  for side in (20000.0, 2000.0):
+    for n in sizes:
+      base = None
+      for k, radar in ((0, '0'), (INTEREST_K, '0'), (INTEREST_K, '1')):
+        game = GameState(k=k)
+        queries = []
+        for i in range(n):
+          x, z = random.uniform(-side / 2, side / 2), random.uniform(-side / 2, side / 2)
+          refid = '{:012x}'.format(i)
+          queries.append({'id': refid, 'tm': '{}'.format(time.time()), 'x': str(x), 'z': str(z),
+                          'radar': radar, 'json': json_.dumps([refid, 0.0, x, 500.0, z] + [1.0] * 10)})
+        for q in queries:
+          game.reply_json(q)
+        sent = nbytes = contacts = 0
+        tm = time.time()
+        for i in range(polls):
+          q = queries[random.randrange(n)]
+          text = game.reply_json(q)
+          if text.startswith('['):
+            olist = json_.loads(text)[2:]
+            if olist and olist[-1][0] == NEAREST_ID:
+              olist.pop()
+            if olist and olist[-1][0] == RADAR_ID:
+              contacts += sum(olist.pop()[1][2::3]) # players counted
+            sent += len(olist)
+          nbytes += len(text)
+        t = (time.time() - tm) / polls
+        base = base or t
+        print('{:8.0f} {:5d} {:4d}{} {:10.1f} {:8.1f} {:10.1f} {:8.1f} {:5.1f}x'.format(side, n, k,
+              'r' if radar == '1' else ' ', t * 1e6, sent / polls, nbytes / polls, contacts / polls, base / t))
+
+if __name__ == '__main__':
+  parse = argparse.ArgumentParser("in memory server for DogFight.py")
+  parse.add_argument("-a", "--address", default="", help="interface to listen on, all if not given")
+  parse.add_argument("-p", "--port", default=8080, type=int)
+  parse.add_argument("-f", "--far", default=FAR, type=float, help="players further than this in x or z aren't sent")
+  parse.add_argument("-s", "--stale", default=STALE_TM, type=float, help="seconds before a silent player is removed")
+  parse.add_argument("-t", "--tick_rate", default=TICK_RATE, type=float, help="housekeeping ticks per second")
+  parse.add_argument("-w", "--save", default=None, help="json file to keep the players in between runs")
+  parse.add_argument("--save_tm", default=SAVE_TM, type=float, help="seconds between saves")
+  parse.add_argument("-k", "--k", default=INTEREST_K, type=int, help="max players sent to each client, 0 for all in the far box")
+  parse.add_argument("-r", "--radius", default=RADIUS, type=float, help="players further than this only go on the radar")
+  parse.add_argument("--benchmark", action="store_true", help="time the grid against checking every player then exit")
+  args = parse.parse_args()
+  if args.benchmark:
+    benchmark()
+    sys.exit(0)
+  logging.basicConfig(level=logging.INFO)
+  server = Server((args.address, args.port), GameState(args.far, args.stale,
+                  args.k, args.radius), args.tick_rate, args.save, args.save_tm)
+  LOGGER.info('serving on %s', server.url())
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    LOGGER.info('%s', server.game.stats())
+    server.running = False
+    server.server_close()
+    if args.save:
+      server.game.save(args.save)
@@ -0,0 +1,355 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Compact binary alternative to the json lists sent between DogFight
+players and the server. Each player is the same 16 item list that the php
+script returns (refid, rel_tm, last_time, x, y, z, h_speed, v_speed, pitch,
+direction, roll, pitchrate, yaw, rollrate, power_setting, damage) but:
+
+  the refid (mac address) is sent once then referred to by a two byte slot
+  each value is rounded to a fixed step and packed as a fixed size integer
+  (angles 0.0055 degree in two bytes, positions 1/32 unit in four bytes)
+  once the other end has acknowledged a snapshot the next one only holds
+  the players and fields that have changed since then, mostly as two byte
+  differences, and players that dropped out of the list
+
+Both ends hold the rounded values so the differences never drift. A Channel
+is kept for each connection at each end, it encodes outgoing messages
+against the last snapshot the other end said it had received and decodes
+incoming ones:
+
+  chan = DogFight_wire.Channel()
+  data = chan.encode([player_list, ...], rel_tm, own_damage)
+  ...
+  msg = chan.decode(data) # msg['players'] is {refid: player_list}
+
+Message layout, little endian:
+
+  header  b'DF', version uint8, kind uint8, seq uint16, base uint16,
+          ack uint16, rel_tm float64, damage float32, n_removed uint16,
+          n_records uint16
+  removed n_removed * uint16 slots
+  records key frame: slot | 0x8000 uint16, len uint8, refid, all fields
+          delta: slot uint16, changed mask uint16, wide mask uint16, then
+          each changed field as int16 difference or, if in the wide mask,
+          as the full value
+
+python3 DogFight_wire.py checks round trips and compares sizes and times
+with the json.
+"""
+import json
+import struct
+import time
+
+MAGIC = b'DF'
+VERSION = 1
+UPDATE = 0 # kind of message, client sending its own plane
+SNAPSHOT = 1 # server sending the other planes
+NO_SEQ = 0xFFFF # base or ack when there isn't one
+KEY_FLAG = 0x8000
+MAX_SLOT = 0x7FFF
+WINDOW = 32 # snapshots kept waiting to be acknowledged
+
+# (index in the player list, step, struct format of full value, wraps round)
+FIELDS = ((1, 0.001, 'q', False), #rel_tm
+          (2, 0.001, 'q', False), #last_time
+          (3, 1.0 / 32.0, 'i', False), #x
+          (4, 1.0 / 32.0, 'i', False), #y
+          (5, 1.0 / 32.0, 'i', False), #z
+          (6, 1.0 / 256.0, 'h', False), #h_speed
+          (7, 1.0 / 256.0, 'h', False), #v_speed
+          (8, 180.0 / 32768.0, 'h', True), #pitch
+          (9, 180.0 / 32768.0, 'h', True), #direction
+          (10, 180.0 / 32768.0, 'h', True), #roll
+          (11, 1.0 / 16.0, 'h', False), #pitchrate
+          (12, 1.0 / 8192.0, 'h', False), #yaw
+          (13, 1.0 / 16.0, 'h', False), #rollrate
+          (14, 1.0 / 16.0, 'h', False), #power_setting
+          (15, 1.0 / 64.0, 'i', False)) #damage
+N_FIELDS = len(FIELDS)
+LIMITS = {'h': (-0x8000, 0x7FFF), 'i': (-0x80000000, 0x7FFFFFFF),
+          'q': (-0x8000000000000000, 0x7FFFFFFFFFFFFFFF)}
+
+HEADER = struct.Struct('<2sBBHHHdfHH')
+KEY_RECORD = struct.Struct('<' + ''.join(f[2] for f in FIELDS))
+SLOT = struct.Struct('<H')
+MASKS = struct.Struct('<HH')
+
+class WireError(ValueError):
+  pass
+
+def quantise(player):
+  '''tuple of integers for the 15 numeric values of a player list
+  '''
+  q = []
+  for i, step, fmt, wraps in FIELDS:
+    v = int(round(player[i] / step))
+    if wraps:
+      v = (v + 0x8000) % 0x10000 - 0x8000
+    else:
+      lo, hi = LIMITS[fmt]
+      v = min(max(v, lo), hi)
+    q.append(v)
+  return tuple(q)
+
+def dequantise(refid, q):
+  '''player list from refid and the tuple made by quantise()
+  '''
+  player = [refid] + [0.0] * N_FIELDS
+  for (i, step, _, _), v in zip(FIELDS, q):
+    player[i] = v * step
+  return player
+
+def _delta_format(changed, wide):
+  return '<' + ''.join((FIELDS[k][2] if wide & (1 << k) else 'h')
+                       for k in range(N_FIELDS) if changed & (1 << k))
+
+class Encoder(object):
+  def __init__(self, kind=SNAPSHOT, window=WINDOW):
+    '''builds messages for one receiver, remembering what was sent so that
+    later messages can be differences from a snapshot the receiver has
+    acknowledged
+    '''
+    self.kind = kind
+    self.window = window
+    self.seq = 0
+    self.slots = {} # refid => slot
+    self.history = {} # seq => {refid: quantised tuple}
+
+  def encode(self, players, base=NO_SEQ, ack=NO_SEQ, rel_tm=0.0, damage=0.0):
+    '''players is a list of player lists. base is the seq of the last
+    message from here that the receiver has acknowledged, ack is the seq of
+    the last message decoded from the receiver. Returns bytes
+    '''
+    snap = dict((p[0], quantise(p)) for p in players)
+    base_snap = self.history.get(base, None)
+    if base_snap is None:
+      base = NO_SEQ
+      base_snap = {}
+    if len(self.slots) + len(snap) > MAX_SLOT: # start again with new slots
+      self.slots = {}
+      self.history = {}
+      base, base_snap = NO_SEQ, {}
+    removed = [self.slots[r] for r in base_snap if not r in snap]
+    records = []
+    for refid, q in snap.items():
+      b = base_snap.get(refid, None)
+      if b is None:
+        slot = self.slots.get(refid, None)
+        if slot is None:
+          slot = len(self.slots)
+          self.slots[refid] = slot
+        name = refid.encode('utf-8')
+        records.append(struct.pack('<HB', slot | KEY_FLAG, len(name)) + name +
+                       KEY_RECORD.pack(*q))
+        continue
+      changed, wide, values = 0, 0, []
+      for k in range(N_FIELDS):
+        if q[k] == b[k]:
+          continue
+        changed |= 1 << k
+        d = q[k] - b[k]
+        if FIELDS[k][3]:
+          values.append((d + 0x8000) % 0x10000 - 0x8000)
+        elif -0x8000 <= d <= 0x7FFF:
+          values.append(d)
+        else:
+          wide |= 1 << k
+          values.append(q[k])
+      if changed:
+        records.append(SLOT.pack(self.slots[refid]) + MASKS.pack(changed, wide) +
+                       struct.pack(_delta_format(changed, wide), *values))
+    seq = self.seq
+    self.seq = (self.seq + 1) % NO_SEQ
+    self.history[seq] = snap
+    self.history.pop((seq - self.window) % NO_SEQ, None)
+    return b''.join([HEADER.pack(MAGIC, VERSION, self.kind, seq, base, ack,
+                                 rel_tm, damage, len(removed), len(records)),
+                     struct.pack('<{}H'.format(len(removed)), *removed)] + records)
+
+class Decoder(object):
+  def __init__(self, window=WINDOW):
+    '''rebuilds the snapshots from messages made by one Encoder
+    '''
+    self.window = window
+    self.slots = {} # slot => refid
+    self.history = {} # seq => {refid: quantised tuple}
+    self.last_seq = NO_SEQ
+
+  def decode(self, data):
+    '''returns a dict with seq, base, ack, kind, rel_tm, damage and players,
+    which is {refid: player list}. Raises WireError if the message is
+    damaged or needs a snapshot that has been lost
+    '''
+    try:
+      (magic, version, kind, seq, base, ack, rel_tm, damage, n_removed,
+          n_records) = HEADER.unpack_from(data, 0)
+    except struct.error:
+      raise WireError('message too short')
+    if magic != MAGIC or version != VERSION:
+      raise WireError('not a version {} message'.format(VERSION))
+    if base == NO_SEQ:
+      snap = {}
+    elif base in self.history:
+      snap = dict(self.history[base])
+    else:
+      raise WireError('base snapshot {} not available'.format(base))
+    try:
+      pos = HEADER.size
+      for slot in struct.unpack_from('<{}H'.format(n_removed), data, pos):
+        snap.pop(self.slots[slot], None)
+      pos += 2 * n_removed
+      for _ in range(n_records):
+        slot, = SLOT.unpack_from(data, pos)
+        pos += SLOT.size
+        if slot & KEY_FLAG:
+          n = data[pos] if isinstance(data[pos], int) else ord(data[pos])
+          refid = data[pos + 1:pos + 1 + n].decode('utf-8')
+          pos += 1 + n
+          self.slots[slot & MAX_SLOT] = refid
+          snap[refid] = KEY_RECORD.unpack_from(data, pos)
+          pos += KEY_RECORD.size
+          continue
+        refid = self.slots[slot]
+        changed, wide = MASKS.unpack_from(data, pos)
+        pos += MASKS.size
+        fmt = _delta_format(changed, wide)
+        values = iter(struct.unpack_from(fmt, data, pos))
+        pos += struct.calcsize(fmt)
+        q = list(snap[refid])
+        for k in range(N_FIELDS):
+          if changed & (1 << k):
+            v = next(values)
+            if wide & (1 << k):
+              q[k] = v
+            elif FIELDS[k][3]:
+              q[k] = (q[k] + v + 0x8000) % 0x10000 - 0x8000
+            else:
+              q[k] += v
+        snap[refid] = tuple(q)
+    except (struct.error, KeyError, IndexError, UnicodeDecodeError) as e:
+      raise WireError('bad message: {}'.format(e))
+    self.history[seq] = snap
+    self.history.pop((seq - self.window) % NO_SEQ, None)
+    self.last_seq = seq
+    return {'seq': seq, 'base': base, 'ack': ack, 'kind': kind, 'rel_tm': rel_tm,
+            'damage': damage,
+            'players': dict((r, dequantise(r, q)) for r, q in snap.items())}
+
+class Channel(object):
+  def __init__(self, kind=SNAPSHOT, window=WINDOW):
+    '''Encoder and Decoder for one connection, keeping track of the
+    acknowledgements in each direction
+    '''
+    self.encoder = Encoder(kind, window)
+    self.decoder = Decoder(window)
+    self.acked = NO_SEQ # last of our messages the other end has decoded
+
+  def encode(self, players, rel_tm=0.0, damage=0.0):
+    return self.encoder.encode(players, self.acked, self.decoder.last_seq,
+                               rel_tm, damage)
+
+  def decode(self, data):
+    '''as Decoder.decode(). If a message can't be decoded the next one
+    sent will ask for a key frame
+    '''
+    try:
+      msg = self.decoder.decode(data)
+    except WireError:
+      self.decoder.last_seq = NO_SEQ
+      raise
+    self.acked = msg['ack']
+    return msg
+
+def to_reply(msg):
+  '''the decoded message as the list DogFight_net.parse_reply() returns for
+  the json, [rel_tm, own_damage, player, player...]
+  '''
+  return [msg['rel_tm'], msg['damage']] + list(msg['players'].values())
+
+if __name__ == '__main__':
+  import math, random
+  random.seed(1)
+  steps = [f[1] for f in FIELDS]
+
+  def make_players(n):
+    return [['b8:27:eb:{:02x}:{:02x}:{:02x}'.format(i // 65536, (i // 256) % 256, i % 256),
+             random.uniform(-2.0, 2.0), 1.6e9 + random.uniform(0, 100),
+             random.uniform(-5000, 5000), random.uniform(0, 1000), random.uniform(-5000, 5000),
+             random.uniform(20, 120), random.uniform(-20, 20), random.uniform(-30, 30),
+             random.uniform(0, 360), random.uniform(-65, 65), random.uniform(-10, 10),
+             random.uniform(-0.5, 0.5), random.uniform(-10, 10), random.uniform(0, 2000),
+             float(random.randint(0, 10))] for i in range(n)]
+
+  def fly(players, dt):
+    for p in players:
+      if random.random() < 0.2: # some planes don't report every poll
+        continue
+      p[2] += dt
+      p[3] += p[6] * math.sin(math.radians(p[9])) * dt
+      p[4] += p[7] * dt
+      p[5] += p[6] * math.cos(math.radians(p[9])) * dt
+      p[9] = (p[9] + math.degrees(p[12]) * dt) % 360
+      p[10] += random.uniform(-1, 1)
+
+  def check(players, msg):
+    assert set(msg['players']) == set(p[0] for p in players)
+    for p in players:
+      d = msg['players'][p[0]]
+      for (i, step, _, wraps) in FIELDS:
+        err = abs(d[i] - p[i])
+        if wraps:
+          err = abs((err + 180.0) % 360.0 - 180.0)
+        assert err <= step * 0.5 + 1e-9, (i, d[i], p[i])
+
+  for n in (10, 100, 1000):
+    players = make_players(n)
+    server, client = Channel(SNAPSHOT), Channel(UPDATE)
+    n_polls, js_bytes, bin_bytes = 50, 0, 0
+    t_js = t_enc = t_dec = 0.0
+    for poll in range(n_polls):
+      fly(players, 1.0)
+      if poll == 25: # one leaves, one joins
+        players = players[1:] + make_players(n + 1)[n:]
+      tm = time.time()
+      js = json.dumps([0.5, 0.0] + players, separators=(',', ':'))
+      json.loads(js)
+      t_js += time.time() - tm
+      tm = time.time()
+      data = server.encode(players, 0.5, 0.0)
+      t_enc += time.time() - tm
+      tm = time.time()
+      msg = client.decode(data)
+      t_dec += time.time() - tm
+      check(players, msg)
+      server.decode(client.encode([])) # acknowledges msg['seq'] to the server
+      if poll == 0:
+        key_bytes = len(data)
+      else:
+        js_bytes += len(js)
+        bin_bytes += len(data)
+    print('{:5d} players json {:8.0f}B key frame {:7d}B ({:.0%}) delta {:7.0f}B ({:.0%}) '
+          'json {:.2f}ms encode {:.2f}ms decode {:.2f}ms'.format(n, js_bytes / (n_polls - 1),
+          key_bytes, key_bytes / len(js), bin_bytes / (n_polls - 1), bin_bytes / js_bytes,
+          t_js / n_polls * 1000.0, t_enc / n_polls * 1000.0, t_dec / n_polls * 1000.0))
+
+  # lost message: decoder can't use the next delta, asks for a key frame
+  server, client = Channel(SNAPSHOT), Channel(UPDATE)
+  players = make_players(5)
+  server.decode(client.encode([]))
+  client.decode(server.encode(players))
+  server.decode(client.encode([]))
+  fly(players, 1.0)
+  server.encode(players) # lost
+  fly(players, 1.0)
+  client.decode(server.encode(players)) # still based on the acknowledged one
+  check(players, client.decoder.decode(server.encode(players)))
+  client2 = Channel(UPDATE)
+  try:
+    client2.decode(server.encode(players))
+    assert False, 'should need a base snapshot'
+  except WireError:
+    pass
+  server.decode(client2.encode([]))
+  check(players, client2.decode(server.encode(players)))
+  print('round trips ok')
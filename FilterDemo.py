@@ -172,7 +172,7 @@ while DISPLAY.loop_running():
 
   post.draw()
   string.draw()
-  #pi3d.screenshot("/home/annon/pi3d_demos/temppics/pic{:0>5}.jpg".format(frame))
+  #rec.capture("temppics/pic{:0>5}.jpg".format(frame)) # rec = recorder.FrameRecorder(policy=recorder.BLOCK)
   frame += 1
 
   #Press ESCAPE to terminate
@@ -23,6 +23,8 @@ import math,random, time
 
 import demo
 import pi3d
+import recorder
+from cluster_cache import cluster # the trees are kept in clusters/ after the first run
 
 # Setup display and initialise pi3d
 DISPLAY = pi3d.Display.create(x=100, y=100, frames_per_second=30)
@@ -76,17 +78,17 @@ treemodel2.add(treeplane.buf[0], 0,0,0, 0,120,0)
 
 #Scatter them on map using Merge shape's cluster function
 mytrees1 = pi3d.MergeShape(name="trees1")
-mytrees1.cluster(treemodel1.buf[0], mymap,0.0,0.0,200.0,200.0,20,"",8.0,3.0)
+cluster(mytrees1, treemodel1.buf[0], mymap,0.0,0.0,200.0,200.0,20,"",8.0,3.0)
 mytrees1.set_draw_details(flatsh, [tree2img], 0.0, 0.0)
 mytrees1.set_fog(*TFOG)
 
 mytrees2 = pi3d.MergeShape(name="trees2")
-mytrees2.cluster(treemodel2.buf[0], mymap,0.0,0.0,200.0,200.0,20,"",6.0,3.0)
+cluster(mytrees2, treemodel2.buf[0], mymap,0.0,0.0,200.0,200.0,20,"",6.0,3.0)
 mytrees2.set_draw_details(flatsh, [tree1img], 0.0, 0.0)
 mytrees2.set_fog(*TFOG)
 
 mytrees3 = pi3d.MergeShape(name="trees3")
-mytrees3.cluster(treemodel2, mymap,0.0,0.0,300.0,300.0,20,"",4.0,2.0)
+cluster(mytrees3, treemodel2, mymap,0.0,0.0,300.0,300.0,20,"",4.0,2.0)
 mytrees3.set_draw_details(flatsh, [hb2img], 0.0, 0.0)
 mytrees3.set_fog(*TFOG)
 
@@ -101,6 +103,7 @@ monument.rotateToY(-115)
 
 #screenshot number
 scshots = 1
+rec = recorder.FrameRecorder() # encodes screenshots in the background
 
 #avatar camera
 rot = 0.0
@@ -179,7 +182,7 @@ while DISPLAY.loop_running():
       step = [-0.25, 0.0, -0.25]
       crab = True
     elif k == 112:  #key p picture
-      pi3d.screenshot("forestWalk" + str(scshots) + ".jpg")
+      rec.capture("forestWalk" + str(scshots) + ".jpg")
       scshots += 1
     elif k == 10:   #key RETURN
       mc = 0
@@ -187,6 +190,7 @@ while DISPLAY.loop_running():
       mykeys.close()
       mymouse.stop()
       DISPLAY.stop()
+      rec.close()
       break
     elif k == ord('f'):
       roll = 1.0
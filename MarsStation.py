@@ -8,12 +8,14 @@ file and reflection map file, although this is done for the whole model it can
 be used to set them differently for each Buffer, i.e. different parts of the
 Model. 3. level of detail drawing using Utility.draw_level_of_detail() This allows different
 versions of the model to be shown as the viewpoint gets nearer, in this case
-the distant one has the doors and windows closed, the near one open
+the distant one has the doors and windows closed, the near one open. Pieces
+out of view are skipped using frustum.Frustum
 """
 import math, random, time
 
 import demo
 import pi3d
+from frustum import Frustum
 
 rads = 0.017453292512  # degrees to radians
 
@@ -108,8 +110,19 @@ omx, omy = mymouse.position()
 win.update()
 
 CAMERA = pi3d.Camera.instance()
+FRUSTUM = Frustum(CAMERA) # corridor pieces out of view aren't drawn
 #inputs.get_mouse_movement()
 
+def draw_piece(model, x, y, z):
+  model.position(x, y, z)
+  if FRUSTUM.is_visible(model):
+    model.draw()
+
+def draw_cross(x, y, z):
+  #as Utility.draw_level_of_detail() with the open crossing when near enough
+  dist = math.sqrt((x - xm) ** 2 + (y - ym) ** 2 + (z - zm) ** 2)
+  draw_piece(cor_cross if dist <= opendist else cor_cross_doors, x, y, z)
+
 try:
   while DISPLAY.loop_running():
     CAMERA.reset()
@@ -120,34 +133,27 @@ try:
     xoff, yoff, zoff = sf*math.sin(mouserot*rads), abs(1.25*sf*math.sin(tilt*rads)) + 3.0, -sf*math.cos(mouserot*rads)
     CAMERA.rotate(tilt, mouserot, 0)
     CAMERA.position((xm + xoff, ym + yoff +5, zm + zoff))
+    FRUSTUM.update()
 
-    pi3d.Utility.draw_level_of_detail([xm, ym, zm], [0, mody, 0], [[opendist,cor_cross],[1000,cor_cross_doors]])
+    draw_cross(0, mody, 0)
     #90 degree units
     corridor.rotateToY(90)
     cor_win.rotateToY(90)
-    cor_win.position(0, mody, spc*1.5)
-    cor_win.draw()
-    corridor.position(0, mody, spc*2.5)
-    corridor.draw()
-    cor_win.position(0, mody, spc*3.5)
-    cor_win.draw()
-    cor_win.position(0, mody, spc*6.5)
-    cor_win.draw()
+    draw_piece(cor_win, 0, mody, spc*1.5)
+    draw_piece(corridor, 0, mody, spc*2.5)
+    draw_piece(cor_win, 0, mody, spc*3.5)
+    draw_piece(cor_win, 0, mody, spc*6.5)
     #0 degree units
     corridor.rotateToY(0)
     cor_win.rotateToY(0)
-    pi3d.Utility.draw_level_of_detail([xm, ym, zm], [0, mody, spc*5],[[opendist,cor_cross],[1000,cor_cross_doors]])
-    pi3d.Utility.draw_level_of_detail([xm, ym, zm],[0, mody, spc*8], [[opendist,cor_cross],[1000,cor_cross_doors]])
-    cor_win.position(-spc*1.5, mody, spc*5)
-    cor_win.draw()
-    cor_bend.position(-spc*2.5, mody, spc*5)
-    cor_bend.draw()
-    pi3d.Utility.draw_level_of_detail([xm, ym, zm],[-spc*2.6, mody, spc*6.6],[[opendist,cor_cross],[1000,cor_cross_doors]])
-    cor_win.position(spc*1.5, mody, spc*5)
-    cor_win.draw()
-    corridor.position(spc*2.5, mody, spc*5)
-    corridor.draw()
-    pi3d.Utility.draw_level_of_detail([xm, ym, zm],[spc*4, mody, spc*5],[[opendist,cor_cross],[1000,cor_cross_doors]])
+    draw_cross(0, mody, spc*5)
+    draw_cross(0, mody, spc*8)
+    draw_piece(cor_win, -spc*1.5, mody, spc*5)
+    draw_piece(cor_bend, -spc*2.5, mody, spc*5)
+    draw_cross(-spc*2.6, mody, spc*6.6)
+    draw_piece(cor_win, spc*1.5, mody, spc*5)
+    draw_piece(corridor, spc*2.5, mody, spc*5)
+    draw_cross(spc*4, mody, spc*5)
 
     myecube.position(xm, ym, zm)
     myecube.draw()#Draw environment cube
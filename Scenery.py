@@ -11,6 +11,8 @@ import demo
 import pi3d
 import pickle
 import time
+from assets import ASSETS
+from frustum import Frustum
 
 print('''
 Really you should have hall effect sensor connected to pin 4 (5V and 0V
@@ -21,10 +23,11 @@ W key simulates a magnet passing the sensor, if speed drops below a certain
 value the whole thing will start turning one way
 
 A and D also turn and ' and / move the camera up and down
-delete scenery/map00.pkl to re-generate the pickle files
+delete alpine/scenery.p3s to re-generate the scenery cache, tiles whose
+png or obj has changed are re-generated automatically
 Esc to quit
 
-NB THE FIRST TIME THIS RUNS IT WILL RE-GENERATE ALL THE PICKLE FILES
+NB THE FIRST TIME THIS RUNS IT WILL GENERATE ALL THE SCENERY TILES
 WHICH TAKES A COUPLE OF MINUTES ON THE RPi. DON'T START PANICING UNTIL
 IT SEEMS TO HAVE BEEN DEAD FOR TEN MINUTES OR SO!!!
 ''')
@@ -59,18 +62,13 @@ NX = 5
 NZ = 5
     
 # load shaders
-flatsh = pi3d.Shader("uv_flat")
+flatsh = ASSETS.shader("uv_flat")
 
-FOG = ((0.3, 0.3, 0.41, 0.99), 500.0)
 TFOG = ((0.3, 0.3, 0.4, 0.95), 300.0)
 
 from alpine import *
 
-try:
-  f = open(sc.path + '/map00.pkl', 'r') #do this once to create the pickled objects
-  f.close()
-except IOError:
-  sc.do_pickle(FOG)
+sc.build() #with alpine.FOG, only does anything the first time or if the sources change
 
 #myecube = pi3d.EnvironmentCube(900.0,"HALFCROSS")
 ectex = pi3d.loadECfiles("textures/ecubes","sbox")
@@ -83,11 +81,12 @@ skidoo = pi3d.Model(file_string=sc.path + '/skidoo.obj')
 skidoo.set_shader(shader)
 
 coin = pi3d.Model(file_string=sc.path + '/coin.obj')
-refltex = pi3d.Texture(sc.path + '/stars3.png')
+refltex = ASSETS.texture(sc.path + '/stars3.png')
 coin.set_draw_details(matsh, [coin.buf[0].textures[0], refltex], 1.0, 0.6)
 
 #time checking
 chktm = 1.0
+scenetm = 0.0 # check_scenery every frame so the streaming can follow the speed and spread the uploads
 lastchk = time.time()
 cleartm = 10.0
 lastclear = lastchk
@@ -131,6 +130,7 @@ cmap = None
 mykeys = pi3d.Keyboard()
 
 CAMERA = pi3d.Camera(lens=(1.0, 10000.0, 55.0, 1.6))
+FRUSTUM = Frustum(CAMERA) # tiles and clusters behind the camera aren't drawn
 ####################
 #this block added for fast text changing
 CAMERA2D = pi3d.Camera(is_3d=False)
@@ -154,7 +154,7 @@ while DISPLAY.loop_running():
   ####################
   tm = time.time()
   #################### scenery loading
-  if tm > (lastchk + chktm):
+  if tm > (lastchk + scenetm):
     xm, zm, cmap = sc.check_scenery(xm, zm)
     fmap = sc.scenery_list['rock_elev{}{}'.format(int(xm/MSIZE), int(zm/MSIZE))].shape
     lastchk = tm
@@ -167,11 +167,14 @@ while DISPLAY.loop_running():
   CAMERA.rotate(tilt, rot, 0)
   CAMERA.position((xm, ym, zm))
   myecube.position(xm, ym, zm)
+  FRUSTUM.update()
 
   s_flg = True
-  for s in sc.draw_list: ###### draw scenery
-    s.shape.draw()
-    s.last_drawn = tm
+  shown = FRUSTUM.test([s.shape for s in sc.draw_list])
+  for s, v in zip(sc.draw_list, shown): ###### draw scenery
+    if v:
+      s.shape.draw()
+    s.last_drawn = tm # still wanted even if behind
     s_flg = False
   if s_flg: ################### intro screen
     skidoo.position(xm + dx * 15, ym, zm + dz * 15)
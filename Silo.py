@@ -13,6 +13,7 @@ import math
 
 import demo
 import pi3d
+from frustum import Frustum
 
 # Setup display and initialise pi3d
 DISPLAY = pi3d.Display.create(x=150, y=150,
@@ -112,16 +113,18 @@ mouseOn = True
 frame = 400
 record = False
 CAMERA = pi3d.Camera.instance()
+FRUSTUM = Frustum(CAMERA) # corridor walls and building parts out of view aren't drawn
 while DISPLAY.loop_running() and not inputs.key_state("KEY_ESC"):
   CAMERA.reset()
   CAMERA.rotate(tilt, rot, 0)
   CAMERA.position((man.x(), man.y(), man.z() - aveyeleveladjust))
+  FRUSTUM.update()
 
   myecube.position(man.x(), man.y(), man.z() - aveyeleveladjust)
 
-  pi3d.SolidObject.drawall()
-
-  building.drawAll()
+  #as SolidObject.drawall() and building.drawAll() but culled
+  FRUSTUM.draw([o.model for o in pi3d.SolidObject.objectlist if o.model])
+  FRUSTUM.draw(building.model)
 
   mymap.draw()
   myecube.draw()
@@ -25,6 +25,7 @@ import numpy as np
 import demo
 import pi3d
 import time
+from spatial_hash import SpatialHash
 
 MAX_BALLS = 200
 MIN_BALL_SIZE = 15 # z value is used to determine point size
@@ -54,8 +55,8 @@ vel = np.random.uniform(-MAX_BALL_VELOCITY, MAX_BALL_VELOCITY, (MAX_BALLS, 2))
 dia = (MIN_BALL_SIZE + (max_dist - loc[:,2]) /
                 (max_dist - min_dist) * (MAX_BALL_SIZE - MIN_BALL_SIZE))
 mass = dia * dia
-# reshape to column and transpose to make add.outer() (not yet in pypy numpy)
-radii = (dia.reshape(1,-1).T + dia) / 3.0 # should be / 2.0 this will make bugs 'touch' when nearer
+rads = dia / 3.0 # should be / 2.0 this will make bugs 'touch' when nearer
+grid = SpatialHash(2.0 * rads.max()) # only balls in neighbouring cells can touch
 
 color = np.floor(np.random.uniform(0.0, 2.99999, (MAX_BALLS, 3))) 
 
@@ -84,15 +85,16 @@ while DISPLAY.loop_running():
 
   temperature = temperature * 0.99 + 0.009 # exp smooth towards 0.9
 
-  ##### bounce off each other. Work increases as square of N
+  ##### bounce off each other. Work increases roughly as N
   if interact:
-    d1 = (loc[np.newaxis,:,0].T - loc[:,0]) # array of all the x diffs
-    d2 = (loc[np.newaxis,:,1].T - loc[:,1]) # array of all the y diffs
-    ix = np.where(((d1 ** 2 + d2 ** 2) ** 0.5 - radii) < 0.0) # index of all overlaps
-    non_dup = np.where(ix[0] > ix[1]) # remove double count and 'self' overlaps
-    ix = (ix[0][non_dup], ix[1][non_dup]) # remake slimmed down index
-    dx = d1[ix[0], ix[1]] # separation x component
-    dy = d2[ix[0], ix[1]] # sep y
+    grid.build(loc[:,0:2])
+    i, j = grid.pairs() # each pair of balls in neighbouring cells once, i < j
+    d1 = loc[j,0] - loc[i,0] # x diffs
+    d2 = loc[j,1] - loc[i,1] # y diffs
+    near = np.where(((d1 ** 2 + d2 ** 2) ** 0.5 - rads[i] - rads[j]) < 0.0)[0] # overlaps
+    ix = (j[near], i[near]) # index of all overlaps
+    dx = d1[near] # separation x component
+    dy = d2[near] # sep y
     D = dx / dy # component ratio
     R = mass[ix[1]] / mass[ix[0]] # mass ratio
     # minor fudge factor to stop them sticking to each other if dx or dy == 0
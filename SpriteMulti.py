@@ -42,6 +42,7 @@ import random
 
 import demo
 import pi3d
+from spatial_hash import SpatialHash
 
 MAX_BUGS = 100
 MIN_BUG_SIZE = 40.0 # z value is used to determine point size
@@ -73,8 +74,8 @@ vel = np.random.uniform(-MAX_BUG_VELOCITY, MAX_BUG_VELOCITY, (MAX_BUGS, 2))
 
 dia = (loc[:,2] % 1.0) * MAX_BUG_SIZE
 mass = dia * dia
-# reshape to column and transpose to make add.outer() (not yet in pypy numpy)
-radii = (dia.reshape(1,-1).T + dia) / 7.0 # should be / 2.0 this will make bugs 'touch' when nearer
+rads = dia / 7.0 # should be / 2.0 this will make bugs 'touch' when nearer
+grid = SpatialHash(2.0 * rads.max()) # only bugs in neighbouring cells can touch
 
 rot = np.zeros((MAX_BUGS, 3)) # :,0 for rotation
 rot[:,1] = 999.999 # :,1 R, G
@@ -122,15 +123,16 @@ while DISPLAY.loop_running():
   temperature = temperature * 0.99 + 0.009 # exp smooth towards 0.9
 
 
-  ##### bounce off each other. Work increases as square of N
+  ##### bounce off each other. Work increases roughly as N
   if interact:
-    d1 = (loc[np.newaxis,:,0].T - loc[:,0]) # array of all the x diffs
-    d2 = (loc[np.newaxis,:,1].T - loc[:,1]) # array of all the y diffs
-    ix = np.where(((d1 ** 2 + d2 ** 2) ** 0.5 - radii) < 0.0) # index of all overlaps
-    non_dup = np.where(ix[0] < ix[1])[0] # remove double count and 'self' overlaps
-    ix = (ix[0][non_dup], ix[1][non_dup]) # remake slimmed down index
-    dx = d1[ix[0], ix[1]] # separation x component
-    dy = d2[ix[0], ix[1]] # sep y
+    grid.build(loc[:,0:2])
+    i, j = grid.pairs() # each pair of bugs in neighbouring cells once, i < j
+    d1 = loc[i,0] - loc[j,0] # x diffs
+    d2 = loc[i,1] - loc[j,1] # y diffs
+    near = np.where(((d1 ** 2 + d2 ** 2) ** 0.5 - rads[i] - rads[j]) < 0.0)[0] # overlaps
+    ix = (i[near], j[near]) # index of all overlaps
+    dx = d1[near] # separation x component
+    dy = d2[near] # sep y
     D = dx / dy # component ratio
     R = mass[ix[1]] / mass[ix[0]] # mass ratio
     # minor fudge factor to stop them sticking to each other if dx or dy == 0
@@ -142,6 +142,5 @@ while DISPLAY.loop_running():
       label.set_alpha(1.5)
       orion_line.set_alpha(0.5)
       ursamajor_line.set_alpha(0.5)
-  #if rec:
-  #  pi3d.screenshot('/home/patrick/Downloads/scr_caps_pi3d/scr_caps/f{:05d}.jpg'.format(fr))
-  #  fr += 1
+  #if rec: # with frames = recorder.FrameRecorder(pattern='scr_caps/f{:05d}.jpg', policy=recorder.BLOCK)
+  #  frames.capture() # or FrameRecorder(movie='starfield.mp4', fps=20) to pipe into ffmpeg
@@ -46,6 +46,8 @@ import math, random, time, traceback
 
 import demo
 import pi3d
+import meshlod
+from frustum import Frustum
 
 LOGGER = pi3d.Log(__name__, level='INFO')
 
@@ -60,6 +62,7 @@ DISPLAY = pi3d.Display.create(tk=True, window_title='Tiger Tank demo in Pi3D',
 #inputs = InputEvents()
 #inputs.get_mouse_movement()
 CAMERA = pi3d.Camera()
+FRUSTUM = Frustum(CAMERA) # to skip missiles and buildings out of view
 CAM2D = pi3d.Camera(is_3d=False)
 pi3d.Light(lightpos=(-1, -1, 1), lightcol =(0.8, 0.8, 0.8), lightamb=(0.30, 0.30, 0.32))
 
@@ -164,7 +167,7 @@ for t in tanks:
 x, z = 20, -320
 y = mymap.calcHeight(x,z)
 
-church = pi3d.Model(file_string='models/AllSaints/AllSaints.obj',
+church = meshlod.load_lod_chain('models/AllSaints/AllSaints.obj', # fewer vertices when distant
           sx=0.1, sy=0.1, sz=0.1, x=x, y=y, z=z)
 church.set_shader(shader)
 church.set_fog(FOG, 800.0)
@@ -259,6 +262,7 @@ while DISPLAY.loop_running():
       #adjust CAMERA position in and out so we can see our tank
       CAMERA.rotate(tilt, mouserot, 0)
       CAMERA.position((xm + xoff, ym + yoff + 5.0, zm + zoff))
+      FRUSTUM.update()
       oxm, ozm = xm, zm
 
       mymap.draw() # Draw the landscape first as tank wheels have transparency
@@ -318,14 +322,16 @@ while DISPLAY.loop_running():
             m.expl = 50 + m.expl * 0.5 # explode fast then slow 
             m.sxsysz = (m.expl, m.expl, m.expl)
             m.set_point_size(500.0) # draw vertices as points (size at one unit of distance from camera)
-            m.draw()
+            if FRUSTUM.is_visible(m):
+              m.draw()
         else:
           m.y_vel -= 0.03 # downward acc gravity
           # the missile created by Lathe is pointing upwards so use up vector
           # also have to reverse x, not sure why
           m.rotate_to_direction([-m.x_vel, m.y_vel, m.z_vel], [0.0, 1.0, 0.0])
           m.xyz = (m_x + m.x_vel, m_y + m.y_vel, m_z + m.z_vel)
-          m.draw()
+          if FRUSTUM.is_visible(m):
+            m.draw()
           # approx hit detection
           for j, t in enumerate(tanks):
             if i != j:
@@ -336,9 +342,8 @@ while DISPLAY.loop_running():
                 print('tank #{} hit tank #{} at a range of {:5.1f}'.format(i, j, dist))
                 m.xyz = m_x, terrain_ht - 0.1, m_z # stop multiple hits!
 
-      #Draw buildings
-      church.draw()
-      cottages.draw()
+      #Draw buildings, if in view
+      FRUSTUM.draw([church, cottages])
 
       myecube.xyz = (xm, ym, zm)
       myecube.draw()  #Draw environment cube
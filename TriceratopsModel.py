@@ -7,6 +7,7 @@ with normal mapping for the details of the model.
 """
 import demo
 import pi3d
+import meshcache # parsed models are cached as name.egg.p3m
 
 # Setup display and initialise pi3d
 DISPLAY = pi3d.Display.create(x=50, y=50, w=-100, h=-100,
@@ -16,7 +17,7 @@ shader = pi3d.Shader('uv_light')
 #========================================
 
 # load model_loadmodel
-mymodel = pi3d.Model(file_string='models/Triceratops/Triceratops.egg',
+mymodel = meshcache.load_model('models/Triceratops/Triceratops.egg',
                 name='Triceratops', x=0, y=-1, z=40,
                 sx=0.005, sy=0.005, sz=0.005)
 mymodel.set_shader(shader)
@@ -27,6 +27,7 @@ import math, random, time, glob
 
 import demo
 import pi3d
+import recorder
 
 print("=====================================================")
 print("press escape to escape")
@@ -89,6 +90,7 @@ do = -0.001 # uv increment
 
 # Fetch key presses.
 mykeys = pi3d.Keyboard()
+rec = recorder.FrameRecorder(workers=1) # p key screenshot saved in the background
 fr = 0
 # Display scene and rotate shape
 while DISPLAY.loop_running():
@@ -124,10 +126,11 @@ while DISPLAY.loop_running():
 
   k = mykeys.read()
   if k==112:
-    pi3d.screenshot("water1.jpg")
+    rec.capture("water1.jpg")
   elif k==27:
     mykeys.close()
     DISPLAY.destroy()
+    rec.close()
     break
 
 quit()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Shared registry for Textures, Shaders and Models. Many of the demos
+create the same image or shader several times over (uv_flat and uv_bump for
+every scenery item, a fresh biplane.obj for every other player in DogFight)
+and each copy takes its own memory in python and on the GPU.
+
+Asking the registry instead returns the same instance for the same
+(path, options) key and counts how many users it has. When the count drops
+back to zero with release() the entry is forgotten and the opengl resources
+are freed as soon as the last python reference goes. Models are handed out
+as clones that share the Buffers of one master copy so each user can have
+its own position and rotation.
+
+  import assets
+  tex = assets.ASSETS.texture("textures/stars.jpg")
+  plane = assets.ASSETS.model("models/biplane.obj", camera=CAMERA)
+  ...
+  assets.ASSETS.release(plane)
+  print(assets.ASSETS.report())
+"""
+import logging
+
+import pi3d
+
+LOGGER = logging.getLogger(__name__)
+
+TEXTURE = 'texture'
+SHADER = 'shader'
+MODEL = 'model'
+
+class AssetItem(object):
+  def __init__(self, kind, key, asset):
+    '''very simple class to hold the shared object in AssetRegistry.items
+    along with the number of users and an estimate of its memory use
+    '''
+    self.kind = kind
+    self.key = key
+    self.asset = asset
+    self.refs = 0
+    self.nbytes = asset_nbytes(kind, asset)
+
+class AssetRegistry(object):
+  def __init__(self):
+    '''class for sharing pi3d objects that are loaded from file. Each
+    item is keyed by (kind, path, options) so a Texture with mipmap=False
+    is kept separate from the same image with mipmap=True
+    '''
+    self.items = {}
+    self.users = {} # id(shared object) => key of the AssetItem, the items keep
+                    # them alive so the ids can't be reused. Model clones carry
+                    # their key as _asset_key instead
+
+  def _get(self, kind, key, loader):
+    item = self.items.get(key, None)
+    if item is None:
+      LOGGER.debug('loading %s %s', kind, key)
+      item = AssetItem(kind, key, loader())
+      self.items[key] = item
+    item.refs += 1
+    return item
+
+  def texture(self, file_string, **kwargs):
+    '''returns a shared pi3d.Texture, kwargs are passed on to the Texture
+    constructor the first time this combination is asked for
+    '''
+    key = (TEXTURE, file_string, tuple(sorted(kwargs.items())))
+    item = self._get(TEXTURE, key, lambda: pi3d.Texture(file_string, **kwargs))
+    self.users[id(item.asset)] = key
+    return item.asset
+
+  def shader(self, shfile):
+    '''returns a shared pi3d.Shader
+    '''
+    key = (SHADER, shfile, ())
+    item = self._get(SHADER, key, lambda: pi3d.Shader(shfile))
+    self.users[id(item.asset)] = key
+    return item.asset
+
+  def model(self, file_string, camera=None, light=None, **kwargs):
+    '''returns a new pi3d.Model that shares its Buffers (vertices, textures
+    and so on) with every other Model loaded from the same file. kwargs
+    are for the master copy so must be the same for all users, camera
+    and light are set on the clone. The master is loaded using the mesh
+    cache, see meshcache.load_model()
+    '''
+    from meshcache import load_model # meshcache uses ASSETS for its textures
+    key = (MODEL, file_string, tuple(sorted(kwargs.items())))
+    item = self._get(MODEL, key, lambda: load_model(file_string, **kwargs))
+    model = item.asset.clone()
+    model._camera = camera # Model.clone() doesn't pass these on
+    if light is not None:
+      model.set_light(light)
+    model._asset_key = key
+    return model
+
+  def release(self, asset):
+    '''reduce the count for this object. When nothing else is using it
+    the registry drops its reference so it can be garbage collected.
+    Returns the number of users left
+    '''
+    key = getattr(asset, '_asset_key', None) or self.users.get(id(asset), None)
+    if key is None or not key in self.items:
+      LOGGER.warning('release() called for unregistered %s', asset)
+      return 0
+    item = self.items[key]
+    item.refs -= 1
+    if item.asset is not asset: # a Model clone only has one user
+      asset._asset_key = None
+    if item.refs <= 0:
+      LOGGER.debug('releasing %s %s', item.kind, key)
+      del self.items[key]
+      self.users.pop(id(item.asset), None)
+      if item.kind == TEXTURE:
+        item.asset.unload_opengl(False) # only succeeds on the display thread
+      return 0
+    return item.refs
+
+  def nbytes(self):
+    '''total estimated memory in bytes of everything held
+    '''
+    return sum(item.nbytes for item in self.items.values())
+
+  def report(self):
+    '''string with one line per asset: kind, users, kB and the path
+    '''
+    lines = ['{:8s} {:>4s} {:>9s}  {}'.format('kind', 'refs', 'kB', 'file')]
+    for item in sorted(self.items.values(), key=lambda i: -i.nbytes):
+      options = ''.join(', {}={}'.format(k, v) for k, v in item.key[2])
+      lines.append('{:8s} {:4d} {:9.1f}  {}{}'.format(item.kind, item.refs,
+                          item.nbytes / 1024.0, item.key[1], options))
+    lines.append('total {:.1f}kB in {} assets'.format(self.nbytes() / 1024.0,
+                          len(self.items)))
+    return '\n'.join(lines)
+
+def asset_nbytes(kind, asset):
+  '''approximate memory used by a Texture (pixels as loaded or as RGBA on
+  the GPU if the image has been freed) or by the Buffers of a Model
+  '''
+  if kind == TEXTURE:
+    image = getattr(asset, 'image', None)
+    if image is not None and hasattr(image, 'nbytes'):
+      return image.nbytes
+    return getattr(asset, 'ix', 0) * getattr(asset, 'iy', 0) * 4
+  if kind == MODEL:
+    return sum(b.array_buffer.nbytes + b.element_array_buffer.nbytes
+               for b in asset.buf)
+  return 0
+
+ASSETS = AssetRegistry() # default instance for the demos to share
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Turning a forest of merged sprites to face the camera, faster than
+MergeShape.billboard(). That works out the direction to the camera for
+every vertex rather than every sprite, so four square roots and divides
+per tree, and builds a dozen temporary arrays the size of the Buffer
+(in float64) each time the camera moves.
+
+BillboardBatch reads the billboard_array of a MergeShape once, after it's
+been filled by cluster(..., billboard=True) or merge(), and splits it into
+the centre of each sprite and the corner offsets and normals relative to
+the centre, as float32 arrays shaped (sprites, corners). billboard() then
+finds the sine and cosine for each sprite and turns all the corners with
+one set of numpy expressions written straight into the array_buffer,
+followed by a single re_init() for each Buffer:
+
+  trees = pi3d.MergeShape()
+  cluster(trees, tree_sprite, mymap, 0.0, 0.0, 300.0, 600.0, 1000, "", 4.0, 2.0,
+          billboard=True)
+  batch = BillboardBatch(trees)
+  ...
+  batch.billboard([xm, ym, zm]) # instead of trees.billboard()
+
+The vertices are the same as MergeShape.billboard() gives (to float32
+rounding). The normals are turned about y as the vertices are, where
+MergeShape.billboard() writes the new z into the y column. If the
+MergeShape is merged into again make a new BillboardBatch.
+
+python3 billboard_batch.py compares the two for 1k, 10k and 100k sprites
+without a Display.
+"""
+import logging
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+class BillboardBatch(object):
+  def __init__(self, shape):
+    '''sprites of the MergeShape shape, each a run of vertices in its
+    billboard_array with the same centre
+    '''
+    self.shape = shape
+    self.groups = [] # (Buffer, centres, sprite index or None, ox, oz, nx, nz, x, z, nrmx, nrmz)
+    self.sprites = 0
+    for b, ba in zip(shape.buf, shape.billboard_array):
+      n = len(ba)
+      if n == 0:
+        continue
+      change = np.any(ba[1:, 0:2] != ba[:-1, 0:2], axis=1)
+      starts = np.concatenate([[0], np.nonzero(change)[0] + 1])
+      lengths = np.diff(np.append(starts, n))
+      centres = ba[starts, 0:2].astype(np.float64)
+      ab = b.array_buffer
+      if np.all(lengths == lengths[0]): # all the same, i.e. all Sprites
+        shp = (len(starts), int(lengths[0]))
+        index = None
+      else: # a mixture, each vertex looks up its sprite
+        shp = (n,)
+        index = np.repeat(np.arange(len(starts)), lengths)
+      offsets = [np.ascontiguousarray(ba[:, j], dtype=np.float32).reshape(shp)
+                 for j in range(2, 6)]
+      columns = [ab[:, j].reshape(shp) for j in (0, 2, 3, 5)] # views of the Buffer
+      self.groups.append([b, centres, index] + offsets + columns)
+      self.sprites += len(starts)
+
+  def billboard(self, cam_location):
+    '''turn all the sprites to face cam_location (x, y, z) and re_init()
+    their Buffers
+    '''
+    u = self.shape.unif
+    for b, centres, index, ox, oz, nx, nz, x, z, nrmx, nrmz in self.groups:
+      # direction to the camera for each sprite
+      dx = centres[:, 0] + (u[0] - cam_location[0])
+      dz = centres[:, 1] + (u[2] - cam_location[2])
+      inv_len = 1.0 / np.maximum(np.sqrt(dx * dx + dz * dz), 1e-9)
+      s = (dx * inv_len).astype(np.float32)
+      c = (-dz * inv_len).astype(np.float32) # z reversed as MergeShape.billboard()
+      cx = centres[:, 0].astype(np.float32)
+      cz = centres[:, 1].astype(np.float32)
+      if index is None:
+        s, c = s[:, np.newaxis], c[:, np.newaxis]
+        cx, cz = cx[:, np.newaxis], cz[:, np.newaxis]
+      else:
+        s, c, cx, cz = s[index], c[index], cx[index], cz[index]
+      x[...] = cx + ox * c - oz * s
+      z[...] = cz + ox * s + oz * c
+      nrmx[...] = nx * c - nz * s
+      nrmz[...] = nx * s + nz * c
+      b.re_init()
+
+if __name__ == '__main__':
+  import time
+  import pi3d
+  from terrain_query import cluster
+
+  MAX_SPRITES = 8000 # per Buffer, short indices only go to 32767 vertices
+
+  def forest(count, seed=3):
+    '''MergeShape of count sprites as cluster(.., billboard=True) makes
+    them, but with the arrays put together directly so 100k doesn't take
+    all day in merge()
+    '''
+    sprite = pi3d.Sprite(w=2.0, h=3.0)
+    sb = sprite.buf[0]
+    nv = len(sb.array_buffer)
+    rng = np.random.RandomState(seed)
+    trees = pi3d.MergeShape()
+    trees.buf = []
+    trees.billboard_array = []
+    for start in range(0, count, MAX_SPRITES):
+      n = min(MAX_SPRITES, count - start)
+      pos = rng.uniform(-500.0, 500.0, (n, 3))
+      scl = rng.uniform(2.0, 6.0, n)
+      v = sb.array_buffer[:, 0:3] * [-1.0, 1.0, -1.0] # turned 180 about y
+      verts = (v[np.newaxis] * scl[:, np.newaxis, np.newaxis] + pos[:, np.newaxis]).reshape(-1, 3)
+      norms = np.tile(sb.array_buffer[:, 3:6] * [-1.0, 1.0, -1.0], (n, 1))
+      tex = np.tile(sb.array_buffer[:, 6:8], (n, 1))
+      faces = (sb.element_array_buffer[np.newaxis] + (np.arange(n) * nv)[:, np.newaxis, np.newaxis]).reshape(-1, 3)
+      trees.buf.append(pi3d.Buffer(trees, verts, tex, faces, norms))
+      ba = np.zeros((n * nv, 6), dtype='float32') # as merge()
+      ba[:, 0:2] = np.repeat(pos[:, ::2], nv, axis=0)
+      ba[:, 2:4] = verts[:, ::2] - ba[:, 0:2]
+      ba[:, 4:6] = norms[:, ::2]
+      trees.billboard_array.append(ba)
+    return trees
+
+  cam = [37.0, 10.0, -112.0]
+  # the trees of Billboard.py, from cluster() and merge(), with some other models mixed in
+  mymap = pi3d.ElevationMap("textures/mountainsHgt.png", name="map", width=1000.0,
+                            depth=1000.0, height=80.0, divx=32, divy=32)
+  trees = pi3d.MergeShape()
+  cluster(trees, pi3d.Sprite(w=2.0, h=3.0), mymap, 0.0, 0.0, 300.0, 600.0, 1000, "", 4.0, 2.0,
+          billboard=True)
+  trees.merge([[pi3d.Cuboid(w=1.0, h=2.0, d=3.0), 10.0, 2.0, 30.0, 0.0, 30.0, 0.0, 1.0, 1.0, 1.0, 0],
+               [pi3d.Sprite(w=2.0, h=2.0), -50.0, 2.0, 80.0, 0.0, 180.0, 0.0, 1.0, 1.0, 1.0, 0]])
+  batch = BillboardBatch(trees)
+  trees.billboard(cam)
+  old = trees.buf[0].array_buffer.copy()
+  trees.buf[0].array_buffer[:, [0, 2, 3, 5]] = 0.0
+  batch.billboard(cam)
+  new = trees.buf[0].array_buffer
+  print('{} sprites from cluster() and merge(): max vertex difference {:.1e}, normal x '
+        'difference {:.1e}'.format(batch.sprites, np.abs(old[:, 0:3] - new[:, 0:3]).max(),
+        np.abs(old[:, 3] - new[:, 3]).max()))
+  for count in (1000, 10000, 100000):
+    trees = forest(count)
+    batch = BillboardBatch(trees)
+    path = [(100.0 * np.cos(a), 5.0, 100.0 * np.sin(a)) for a in np.linspace(0.0, 6.0, 20)]
+    times = []
+    results = []
+    for f in (trees.billboard, batch.billboard):
+      tm = time.time()
+      for p in path:
+        f(p)
+      times.append((time.time() - tm) / len(path))
+      results.append(np.concatenate([b.array_buffer[:, 0:3] for b in trees.buf]).copy())
+    print('{:6d} sprites: MergeShape.billboard {:7.2f}ms, BillboardBatch {:6.2f}ms {:4.1f}x, '
+          'max vertex difference {:.1e}'.format(count, times[0] * 1000.0, times[1] * 1000.0,
+          times[0] / max(times[1], 1e-9), np.abs(results[0] - results[1]).max()))
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Procedural terrain that goes on in every direction. ProceduralTerrain.py
+used to scroll one buffer a row at a time, working out calc_normals() for
+the whole mesh every step, and the noise repeated every PSIZE.
+
+ChunkWorld keeps the square of chunks round the camera, each a Shape with
+CHUNK x CHUNK squares and its own Buffer. Heights and normals for new
+chunks are made from Noise3D by a background thread, nearest first, and
+turned into Buffers on the main thread a few (max_new) each frame, so the
+work each frame doesn't grow with the size of the world or how far you've
+gone. The normals of a chunk come from its own heights plus one row of
+noise round the outside, so they match those of its neighbours along the
+seams without touching them. Chunks that go out of range are kept, the
+least recently used thrown away once there are more than cache_size, so
+going back is free:
+
+  world = ChunkWorld(Noise3D(None, 1.0 / 32.0, 5), spacing=0.16, height=4.0)
+  world.set_shader(shader)
+  ...
+  world.update(x, z)
+  world.draw()
+
+The vertices of each chunk are relative to its own position so they don't
+lose precision far from the origin. With Noise3D(None, ..) the landscape
+repeats every 256 / freq vertices.
+
+python3 chunk_terrain.py walks a long way in a straight line without a
+Display and prints the time update() takes over each stretch, which should
+stay the same.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import pi3d
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNK = 32 # squares along a chunk side
+RADIUS = 3 # chunks out from the one under the camera
+PREFETCH = 1 # more chunks out made before they come into range
+CACHE = 2 # times the chunks in range kept when out of range
+MAX_NEW = 1 # Buffers made each frame
+
+def chunk_faces(n):
+  '''triangles for a chunk of (n + 1) x (n + 1) vertices, as ElevationMap
+  '''
+  i = (np.arange(n)[:, np.newaxis] * (n + 1) + np.arange(n)).ravel()
+  return np.concatenate([np.stack([i, i + n + 1, i + n + 2], axis=1),
+                         np.stack([i + n + 2, i + 1, i], axis=1)])
+
+def make_chunk(noise, cx, cz, chunk=CHUNK, spacing=1.0, height=1.0):
+  '''(vertices, normals, tex_coords) arrays for chunk cx, cz relative to
+  its corner. Nothing to do with OpenGL so can be run in any thread
+  '''
+  n = chunk
+  gz, gx = np.mgrid[(cz * n - 1):(cz * n + n + 2), (cx * n - 1):(cx * n + n + 2)]
+  h = noise.generate(np.stack([gx, gz], axis=2)) * height # one extra all round
+  zs, xs = np.mgrid[0:(n + 1), 0:(n + 1)]
+  verts = np.stack([xs * spacing, h[1:-1, 1:-1], zs * spacing], axis=2)
+  dx = (h[1:-1, 2:] - h[1:-1, :-2]) / (2.0 * spacing)
+  dz = (h[2:, 1:-1] - h[:-2, 1:-1]) / (2.0 * spacing)
+  norms = np.stack([-dx, np.ones_like(dx), -dz], axis=2)
+  norms /= np.linalg.norm(norms, axis=2)[:, :, np.newaxis]
+  tex = np.stack([(gx[1:-1, 1:-1]) / n, (gz[1:-1, 1:-1]) / n], axis=2)
+  return verts.reshape(-1, 3), norms.reshape(-1, 3), tex.reshape(-1, 2)
+
+class ChunkWorld(object):
+  def __init__(self, noise, spacing=1.0, height=1.0, chunk=CHUNK, radius=RADIUS,
+               cache_size=None, max_new=MAX_NEW, prefetch=PREFETCH):
+    '''terrain of chunk x chunk squares spacing apart, heights from
+    noise.generate() times height, out to radius chunks from the camera
+    and made prefetch chunks further out. cache_size defaults to CACHE
+    times the chunks in range and prefetched
+    '''
+    self.noise = noise
+    self.spacing = spacing
+    self.height = height
+    self.chunk = chunk
+    self.radius = radius
+    self.prefetch = prefetch
+    self.cache_size = cache_size or CACHE * (2 * (radius + prefetch) + 1) ** 2
+    self.max_new = max_new
+    self.faces = chunk_faces(chunk)
+    self.shader = None
+    self.material = None
+    self.cache = OrderedDict() # (cx, cz): Shape, least recently used first
+    self.visible = []
+    self.centre = None
+    self.lock = threading.Condition()
+    self.order = [] # chunks to make, nearest first
+    self.ready = {} # (cx, cz): arrays made but not yet a Buffer
+    self.making = None
+    self.reset_stats()
+    self.worker = threading.Thread(target=self._make_chunks)
+    self.worker.daemon = True
+    self.worker.start()
+
+  def reset_stats(self):
+    self.made = 0 # chunks made by the worker
+    self.built = 0 # turned into Shapes
+    self.hits = 0 # back in range and still in the cache
+    self.missing = 0 # chunk frames in range but not there
+    self.frames = 0
+
+  def stats(self):
+    return {'frames': self.frames, 'made': self.made, 'built': self.built,
+            'hits': self.hits, 'missing': self.missing, 'cached': len(self.cache)}
+
+  def set_shader(self, shader):
+    self.shader = shader
+    for s in self.cache.values():
+      s.set_shader(shader)
+
+  def set_material(self, material):
+    self.material = material
+    for s in self.cache.values():
+      s.set_material(material)
+
+  def chunk_at(self, x, z):
+    size = self.chunk * self.spacing
+    return int(math.floor(x / size)), int(math.floor(z / size))
+
+  def _build(self, key, arrays):
+    '''Shape for chunk key, main thread
+    '''
+    verts, norms, tex = arrays
+    size = self.chunk * self.spacing
+    shape = pi3d.Shape(None, None, 'chunk{}_{}'.format(*key), key[0] * size, 0.0,
+                       key[1] * size, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0)
+    shape.buf = [pi3d.Buffer(shape, verts, tex, self.faces, norms)]
+    if self.material is not None:
+      shape.set_material(self.material)
+    if self.shader is not None:
+      shape.set_shader(self.shader)
+    self.built += 1
+    return shape
+
+  def update(self, x, z):
+    '''bring the chunks round x, z up to date, called each frame. Returns
+    the number of chunks in range not there yet
+    '''
+    self.frames += 1
+    ccx, ccz = self.chunk_at(x, z)
+    r = self.radius + self.prefetch
+    wanted = sorted(((cx, cz) for cx in range(ccx - r, ccx + r + 1)
+                              for cz in range(ccz - r, ccz + r + 1)),
+                    key=lambda k: (k[0] - ccx) ** 2 + (k[1] - ccz) ** 2)
+    in_range = [k for k in wanted if max(abs(k[0] - ccx), abs(k[1] - ccz)) <= self.radius]
+    wanted_set = set(wanted)
+    if (ccx, ccz) != self.centre: # only changes when crossing into another chunk
+      old = set(k for k in self.cache if self.centre is not None and
+                max(abs(k[0] - self.centre[0]), abs(k[1] - self.centre[1])) <= r)
+      self.centre = (ccx, ccz)
+      with self.lock:
+        self.order = []
+        for k in list(self.ready): # passed by before being needed
+          if not k in wanted_set:
+            del self.ready[k]
+        for k in wanted:
+          if k in self.cache:
+            self.cache[k] = self.cache.pop(k) # most recently used
+            if not k in old:
+              self.hits += 1
+          elif not k in self.ready and k != self.making:
+            self.order.append(k)
+        if self.order:
+          self.lock.notify()
+    with self.lock:
+      new = [k for k in wanted if k in self.ready][:self.max_new]
+      arrays = [(k, self.ready.pop(k)) for k in new]
+    for k, a in arrays:
+      self.cache[k] = self._build(k, a)
+    while len(self.cache) > self.cache_size:
+      k = next(iter(self.cache))
+      if k in wanted_set: # all the rest are wanted too
+        break
+      del self.cache[k]
+    self.visible = [self.cache[k] for k in in_range if k in self.cache]
+    missing = len(in_range) - len(self.visible)
+    self.missing += missing
+    return missing
+
+  def fill(self, x, z, timeout=60.0):
+    '''wait until all the chunks round x, z are there, i.e. at the start
+    '''
+    end = time.time() + timeout
+    max_new, self.max_new = self.max_new, (2 * (self.radius + self.prefetch) + 1) ** 2
+    try:
+      while self.update(x, z) > 0 and time.time() < end:
+        time.sleep(0.01)
+    finally:
+      self.max_new = max_new
+
+  def draw(self):
+    for s in self.visible:
+      s.draw()
+
+  def _make_chunks(self):
+    while True:
+      with self.lock:
+        while not self.order:
+          self.lock.wait()
+        key = self.order.pop(0)
+        self.making = key
+      try:
+        arrays = make_chunk(self.noise, key[0], key[1], self.chunk, self.spacing, self.height)
+      except Exception as e:
+        LOGGER.error('unable to make chunk %s: %s', key, e)
+        arrays = None
+      with self.lock:
+        self.making = None
+        if arrays is not None:
+          self.ready[key] = arrays
+          self.made += 1
+
+if __name__ == '__main__':
+  from noise3d import Noise3D
+  SPACING = 10.0 / 63.0 # as ProceduralTerrain.py
+  SPEED = 2.0 # chunks a second
+  FPS = 20.0
+  STRETCH = 8 # chunks between reports
+  world = ChunkWorld(Noise3D(None, 1.0 / 32.0, 5), spacing=SPACING, height=4.0)
+  size = world.chunk * world.spacing
+  x, z = 0.0, 0.0
+  tm = time.time()
+  world.fill(x, z)
+  print('{} chunks round the start in {:.2f}s'.format(len(world.visible), time.time() - tm))
+  # seams: the edge vertices and normals of neighbours are the same
+  a = make_chunk(world.noise, 0, 0, world.chunk, SPACING, 4.0)
+  b = make_chunk(world.noise, 1, 0, world.chunk, SPACING, 4.0)
+  n = world.chunk + 1
+  print('seam height difference {:.1e}, normal difference {:.1e}'.format(
+        np.abs(a[0].reshape(n, n, 3)[:, -1, 1] - b[0].reshape(n, n, 3)[:, 0, 1]).max(),
+        np.abs(a[1].reshape(n, n, 3)[:, -1] - b[1].reshape(n, n, 3)[:, 0]).max()))
+  # as ProceduralTerrain.py used to, for the same area in one Buffer
+  n = (2 * world.radius + 1) * world.chunk + 1
+  v, nm, tx = make_chunk(world.noise, 0, 0, n - 1, SPACING, 4.0)
+  buf = pi3d.Buffer(None, v, tx, chunk_faces(n - 1), nm)
+  t = time.time()
+  buf.calc_normals()
+  print('calc_normals() for one {}x{} buffer each step: {:.2f}ms'.format(n, n,
+        (time.time() - t) * 1000.0))
+  world.reset_stats()
+  for stretch in range(5):
+    t_update = []
+    t0 = time.time()
+    while x < (stretch + 1) * STRETCH * size:
+      t = time.time()
+      world.update(x, z)
+      t_update.append(time.time() - t)
+      x += SPEED * size / FPS
+      time.sleep(max(0.0, t + 1.0 / FPS - time.time()))
+    t_update = np.array(t_update) * 1000.0
+    print('chunks {:3d}-{:3d}: update() mean {:.2f}ms max {:.2f}ms over {} frames'.format(
+          stretch * STRETCH, (stretch + 1) * STRETCH, t_update.mean(), t_update.max(),
+          len(t_update)))
+  for _ in range(int(FPS * 2)): # and back a bit, from the cache
+    world.update(x, z)
+    x -= SPEED * size / FPS
+    time.sleep(1.0 / FPS)
+  print(world.stats())
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" MergeShape.cluster() results kept on disk. Scattering a forest over an
+ElevationMap, as Billboard.py and ForestWalk.py do, picks random positions,
+finds the height of each and merges a copy of the tree into the MergeShape
+one at a time every time the demo starts, and gives a different forest
+each time.
+
+cluster() here takes the same arguments plus a seed. The first time, the
+trees are placed (with terrain_query.cluster() using a random.Random of
+that seed) and the merged Buffer arrays written to a pack file in the
+meshcache format, named by a hash of everything the result depends on:
+the vertices of the source shape and of the map, the position of the
+map and the MergeShape, the area, count, scales and seed, and whatever is
+already in the MergeShape. After that the arrays are memory mapped back
+from the one file so start up takes the same time however many trees
+there are:
+
+  trees = pi3d.MergeShape()
+  cluster_cache.cluster(trees, tree_sprite, mymap, 0.0, 0.0, 300.0, 600.0, 1000,
+                        "", 4.0, 2.0, billboard=True)
+
+Without a seed one is made from the hash, so the layout is the same from
+run to run but different for different arguments. Delete the clusters
+directory to start again.
+
+python3 cluster_cache.py compares building and reloading clusters of a
+few sizes, without a Display.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+
+import numpy as np
+
+import pi3d
+from meshcache import make_buffers, pack_buffers, read_pack, write_pack
+import terrain_query
+
+LOGGER = logging.getLogger(__name__)
+
+CLUSTER_VERSION = 1 # increment if the meta or arrays written by cluster() change
+CACHE_DIR = 'clusters'
+CLUSTER_EXT = '.p3c'
+
+def source_buffer(bufr):
+  '''the Buffer MergeShape.merge() would use for bufr
+  '''
+  return bufr if isinstance(bufr, pi3d.Buffer) else bufr.buf[0]
+
+def cluster_hash(shape, bufr, elevmap, args):
+  '''sha1 object of the json-able args and the vertices of the source
+  Buffer, the map and the Buffers already in shape
+  '''
+  h = hashlib.sha1()
+  h.update(json.dumps([CLUSTER_VERSION, list(args), list(shape.unif[0:3]),
+                       list(elevmap.unif[0:3])]).encode('utf-8'))
+  src = source_buffer(bufr)
+  arrays = [src.array_buffer, src.element_array_buffer, elevmap.buf[0].array_buffer]
+  for b in shape.buf:
+    arrays.extend([b.array_buffer, b.element_array_buffer])
+  arrays.extend(getattr(shape, 'billboard_array', []))
+  for a in arrays:
+    a = np.ascontiguousarray(a)
+    h.update(str((a.dtype.str, a.shape)).encode('utf-8'))
+    h.update(a.tobytes())
+  return h
+
+def cluster(shape, bufr, elevmap, xpos, zpos, w, d, count, options, minscl, maxscl,
+            bufnum=0, billboard=False, seed=None, cache_dir=CACHE_DIR):
+  '''shape.cluster() with the result kept in cache_dir, the arguments as
+  MergeShape.cluster(). seed defaults to one made from all the rest
+  '''
+  args = [xpos, zpos, w, d, count, minscl, maxscl, bufnum, billboard, seed]
+  h = cluster_hash(shape, bufr, elevmap, args)
+  key = h.hexdigest()
+  if seed is None:
+    seed = int(key[:8], 16)
+  path = os.path.join(cache_dir, key + CLUSTER_EXT)
+  src = source_buffer(bufr)
+  pack = read_pack(path)
+  if pack is not None and pack[0].get('version') == CLUSTER_VERSION:
+    meta, arrays = pack
+    old = shape.buf
+    shape.buf = make_buffers(meta, arrays)
+    # draw details as merge() leaves them
+    for i, b in enumerate(shape.buf):
+      from_b = src if i == bufnum else (old[i] if i < len(old) else None)
+      if from_b is None:
+        continue
+      b.shader = from_b.shader
+      b.material = from_b.material[:]
+      b.textures = from_b.textures[:]
+      b.draw_method = from_b.draw_method
+      b.unib[:] = from_b.unib[:]
+    shape.billboard_array = [arrays['billboard_array{}'.format(i)]
+                             for i in range(len(shape.buf))]
+    LOGGER.debug('cluster %s loaded from %s', shape.name, path)
+    return
+  terrain_query.cluster(shape, bufr, elevmap, xpos, zpos, w, d, count, options,
+                        minscl, maxscl, bufnum, billboard, rng=random.Random(seed))
+  arrays = {}
+  meta = {'version': CLUSTER_VERSION, 'seed': seed,
+          'buffers': pack_buffers(shape, arrays, '', textures=False)}
+  for i, ba in enumerate(shape.billboard_array):
+    arrays['billboard_array{}'.format(i)] = ba
+  try:
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    write_pack(path, arrays, meta)
+  except (IOError, OSError) as e:
+    LOGGER.warning('unable to write cluster cache %s: %s', path, e)
+
+if __name__ == '__main__':
+  import shutil
+  import tempfile
+  import time
+  mymap = pi3d.ElevationMap("textures/mountainsHgt.png", name="map", width=1000.0,
+                            depth=1000.0, height=80.0, divx=32, divy=32)
+  tree_sprite = pi3d.Sprite(w=2.0, h=3.0)
+  treemodel = pi3d.MergeShape(name="bushytree") # as ForestWalk.py
+  treeplane = pi3d.Plane(w=4.0, h=5.0)
+  for ry in (0, 60, 120):
+    treemodel.add(treeplane.buf[0], 0, 0, 0, 0, ry, 0)
+  tmp = tempfile.mkdtemp()
+  try:
+    for count in (100, 1000, 5000):
+      for name, model, bb in (('sprites', tree_sprite, True), ('models', treemodel, False)):
+        count = min(count, 32767 // len(model.buf[0].array_buffer)) # short indices
+        times = []
+        results = []
+        for _ in range(2): # cold then warm
+          trees = pi3d.MergeShape()
+          tm = time.time()
+          cluster(trees, model, mymap, 0.0, 0.0, 300.0, 600.0, count, "", 4.0, 2.0,
+                  billboard=bb, cache_dir=tmp)
+          times.append(time.time() - tm)
+          results.append((trees.buf[0].array_buffer, trees.buf[0].element_array_buffer,
+                          trees.billboard_array[0]))
+        random.seed(1) # and the original for comparison
+        trees = pi3d.MergeShape()
+        tm = time.time()
+        trees.cluster(model, mymap, 0.0, 0.0, 300.0, 600.0, count, "", 4.0, 2.0, billboard=bb)
+        t_orig = time.time() - tm
+        same = all(np.array_equal(a, b) for a, b in zip(*results))
+        print('{:5d} {}: MergeShape.cluster {:8.1f}ms, first {:7.1f}ms, cached {:5.2f}ms, '
+              'same arrays {}'.format(count, name, t_orig * 1000.0, times[0] * 1000.0,
+              times[1] * 1000.0, same))
+    print('{} files, {:.0f}kB'.format(len(os.listdir(tmp)), sum(os.path.getsize(os.path.join(tmp, f))
+          for f in os.listdir(tmp)) / 1024.0))
+  finally:
+    shutil.rmtree(tmp)
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Skip drawing Shapes that are outside the view. Shape.draw() sends every
+Buffer to the GPU even when the Shape is behind the camera, so a scene of
+many objects costs the same whichever way you look.
+
+Frustum finds the six planes bounding the view from Camera.mtrx each
+frame. The bounding sphere of each Shape is worked out from its Buffer
+vertices the first time it's tested and kept, then moved and scaled by the
+Shape's matrix (as Shape.draw() makes it) and tested against the planes
+for all the Shapes at once. Spheres are cheap and never cull anything
+that can be seen, only a few things just outside the edge are drawn that
+needn't be. Shapes with children include them wherever they are rotated
+to:
+
+  FRUSTUM = Frustum()
+  ...
+  CAMERA.position((xm, ym, zm))
+  FRUSTUM.update(CAMERA)
+  FRUSTUM.draw(shapes) # or if FRUSTUM.is_visible(shape): shape.draw()
+  print(FRUSTUM.stats()) # tested, culled and drawn
+
+If the vertices of a Shape are changed call forget(shape).
+
+python3 frustum.py turns a camera round inside a field of objects and
+compares the number drawn with all of them, checking nothing that had a
+vertex in view was culled.
+"""
+import logging
+import weakref
+
+import numpy as np
+
+import pi3d
+
+LOGGER = logging.getLogger(__name__)
+
+_BOUNDS = weakref.WeakKeyDictionary() # Shape: (centre, radius) in its own coordinates
+
+def local_bounds(shape):
+  '''(centre, radius) of a sphere round the vertices of shape, and any
+  children however they're turned, in the Shape's own coordinates
+  '''
+  b = _BOUNDS.get(shape)
+  if b is None:
+    verts = [buf.array_buffer[:, 0:3] for buf in shape.buf if len(buf.array_buffer) > 0]
+    if verts:
+      v = np.concatenate(verts).astype(np.float64)
+      lo, hi = v.min(axis=0), v.max(axis=0)
+      centre = (lo + hi) * 0.5
+      radius = np.sqrt(((v - centre) ** 2).sum(axis=1).max())
+    else:
+      centre, radius = np.zeros(3), 0.0
+    for c in shape.children: # a sphere round the parent origin holding the child
+      cc, cr = local_bounds(c)
+      reach = (np.linalg.norm(c.unif[0:3]) + np.linalg.norm(c.unif[9:12]) +
+               (np.linalg.norm(cc) + cr) * np.abs(c.unif[6:9]).max())
+      radius = max(radius + np.linalg.norm(centre), reach)
+      centre = np.zeros(3)
+    b = _BOUNDS[shape] = (centre, radius)
+  return b
+
+def forget(shape):
+  '''work out the bounds of shape again next time, after its vertices move
+  '''
+  _BOUNDS.pop(shape, None)
+
+def model_matrix(shape):
+  '''the matrix Shape.draw() will use for shape (top level only)
+  '''
+  if not shape.MFlg and hasattr(shape, 'MRaw') and not shape.children:
+    return shape.MRaw
+  m = shape.tr1
+  if shape.rozflg:
+    m = np.dot(shape.roz, m)
+  if shape.roxflg:
+    m = np.dot(shape.rox, m)
+  if shape.royflg:
+    m = np.dot(shape.roy, m)
+  if shape.sclflg:
+    m = np.dot(shape.scl, m)
+  if shape.tr2flg:
+    m = np.dot(shape.tr2, m)
+  return m
+
+class Frustum(object):
+  def __init__(self, camera=None, pad=0.0):
+    '''planes of the view of camera (default the Camera instance) with
+    spheres grown by pad before testing
+    '''
+    self.camera = camera
+    self.pad = pad
+    self.planes = None
+    self.reset_stats()
+
+  def reset_stats(self):
+    self.frames = 0
+    self.tested = 0
+    self.culled = 0
+    self.drawn = 0
+
+  def stats(self):
+    return {'frames': self.frames, 'tested': self.tested, 'culled': self.culled,
+            'drawn': self.drawn}
+
+  def update(self, camera=None):
+    '''find the planes for this frame, after the camera has been moved
+    '''
+    camera = camera or self.camera or pi3d.Camera.instance()
+    if not camera.mtrx_made:
+      camera.make_mtrx()
+    m = np.array(camera.mtrx, dtype=np.float64)
+    # clip = (x, y, z, 1).mtrx and -w <= x, y, z <= w inside
+    w = m[:, 3]
+    planes = np.array([w + m[:, 0], w - m[:, 0], w + m[:, 1], w - m[:, 1],
+                       w + m[:, 2], w - m[:, 2]])
+    planes /= np.linalg.norm(planes[:, 0:3], axis=1).reshape(-1, 1)
+    self.planes = planes
+    self.frames += 1
+
+  def test_spheres(self, centres, radii):
+    '''bool array, True for spheres (centres (n, 3), radii (n,)) at least
+    partly inside
+    '''
+    if self.planes is None:
+      self.update()
+    d = np.dot(centres, self.planes[:, 0:3].T) + self.planes[:, 3] # (n, 6)
+    return np.all(d >= -(np.asarray(radii) + self.pad).reshape(-1, 1), axis=1)
+
+  def test(self, shapes):
+    '''bool array, True for the shapes that might be seen, counted in the
+    stats
+    '''
+    n = len(shapes)
+    centres = np.empty((n, 3))
+    radii = np.empty(n)
+    for i, s in enumerate(shapes):
+      c, r = local_bounds(s)
+      m = model_matrix(s)
+      centres[i] = np.dot(np.append(c, 1.0), m)[0:3]
+      radii[i] = r * np.sqrt((np.asarray(m)[0:3, 0:3] ** 2).sum(axis=1).max())
+    shown = self.test_spheres(centres, radii) if n else np.zeros(0, dtype=bool)
+    self.tested += n
+    self.culled += n - int(shown.sum())
+    return shown
+
+  def is_visible(self, shape):
+    return bool(self.test([shape])[0])
+
+  def visible(self, shapes):
+    '''list of the shapes that might be seen
+    '''
+    return [s for s, v in zip(shapes, self.test(shapes)) if v]
+
+  def draw(self, shapes, *args, **kwargs):
+    '''draw() the shapes that might be seen, with args as Shape.draw().
+    Returns how many
+    '''
+    shown = self.visible(shapes)
+    for s in shown:
+      s.draw(*args, **kwargs)
+    self.drawn += len(shown)
+    return len(shown)
+
+if __name__ == '__main__':
+  import math, random, time
+  N = 500
+  random.seed(3)
+  CAMERA = pi3d.Camera(lens=(1.0, 1000.0, 45.0, 1.6))
+  protos = [pi3d.Sphere(radius=2.0), pi3d.Cuboid(w=3.0, h=6.0, d=2.0),
+            pi3d.Cylinder(radius=1.0, height=8.0)]
+  shapes = []
+  for i in range(N): # a field of objects round the camera
+    s = protos[i % len(protos)].shallow_clone()
+    s.position(random.uniform(-300.0, 300.0), random.uniform(-5.0, 20.0), random.uniform(-300.0, 300.0))
+    s.rotateToY(random.uniform(0.0, 360.0))
+    sc = random.uniform(0.5, 3.0)
+    s.scale(sc, sc, sc)
+    shapes.append(s)
+  tank = pi3d.Cuboid(w=4.0, h=2.0, d=6.0, x=20.0, z=40.0) # with a child pointing out a long way
+  gun = pi3d.Cylinder(radius=0.2, height=20.0, y=1.0, rx=90.0)
+  tank.children = [gun]
+  shapes.append(tank)
+  FRUSTUM = Frustum(CAMERA)
+  false_culls = 0
+  t_test = 0.0
+  for frame in range(120): # turn round and look about
+    CAMERA.reset()
+    CAMERA.rotate(10.0 * math.sin(frame * 0.1), frame * 3.0, 0.0)
+    CAMERA.position((0.0, 5.0, 0.0))
+    tm = time.time()
+    FRUSTUM.update(CAMERA)
+    shown = FRUSTUM.test(shapes)
+    t_test += time.time() - tm
+    FRUSTUM.drawn += int(shown.sum())
+    for s, v in zip(shapes[::10] + [tank], np.append(shown[::10], shown[-1])):
+      if v:
+        continue
+      m = model_matrix(s)
+      verts = np.concatenate([b.array_buffer[:, 0:3] for b in s.buf])
+      if s is tank: # the gun, turned as it would be drawn
+        gverts = np.concatenate([b.array_buffer[:, 0:3] for b in gun.buf])
+        verts = np.concatenate([verts, np.dot(np.c_[gverts, np.ones(len(gverts))],
+                                              model_matrix(gun))[:, 0:3]])
+      clip = np.dot(np.dot(np.c_[verts, np.ones(len(verts))], m), CAMERA.mtrx)
+      w = clip[:, 3:4]
+      false_culls += np.any(np.all((np.abs(clip[:, 0:3]) <= w) & (w > 0.0), axis=1))
+  s = FRUSTUM.stats()
+  print('{} frames of {} shapes: tested {} culled {} drawn {} ({:.1f}% drawn), '
+        '{:.2f}ms a frame to test'.format(s['frames'], len(shapes), s['tested'], s['culled'],
+        s['drawn'], 100.0 * s['drawn'] / s['tested'], 1000.0 * t_test / s['frames']))
+  print('{} culled shapes had vertices in view'.format(false_culls))
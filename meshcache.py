@@ -0,0 +1,262 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Compiled binary cache for obj and egg models. Parsing the text files is
+what takes most of the start up time in TriceratopsModel, ConferenceHall
+and BuckfastAbbey. Pickling the Model (see LoadModelPickle.py) is faster to
+load but drags the texture images along with it and only works with the
+same version of python and pi3d.
+
+Here the first load_model() of a file parses it as normal then writes a
+pack file alongside it (teapot.obj => teapot.obj.p3m) holding, for each
+Buffer, the interleaved array_buffer (vertices, normals, uvs), the indices
+and the material settings, plus the names of the texture files. Later loads
+check the mtime and size of the source then memory map the arrays straight
+into the Buffers.
+
+The pack file is a small json header followed by raw arrays so it can be
+used for other caches (see scenery_cache.py):
+
+  MAGIC 8 bytes, version uint32, header length uint32, json header, arrays
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+import pi3d
+from assets import ASSETS
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'PI3DPACK'
+PACK_VERSION = 1
+MESH_VERSION = 1 # increment if the meta layout written by save_model() changes
+CACHE_EXT = '.p3m'
+ALIGN = 16
+MMAP_ACCESS = {'r': mmap.ACCESS_READ, 'c': mmap.ACCESS_COPY, 'r+': mmap.ACCESS_WRITE}
+
+def write_pack(path, arrays, meta):
+  '''write a dict of numpy arrays and a json-able meta dict to path. The
+  file is written to a temporary name then moved so a half written pack
+  is never seen by another process
+  '''
+  entries = {}
+  offset = 0
+  names = sorted(arrays)
+  for name in names:
+    a = np.ascontiguousarray(arrays[name])
+    arrays[name] = a
+    entries[name] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+    offset += -(-a.nbytes // ALIGN) * ALIGN
+  header = json.dumps({'meta': meta, 'arrays': entries}, separators=(',', ':')).encode('utf-8')
+  start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+  header += b' ' * (start - len(MAGIC) - 8 - len(header)) # pad so arrays are aligned
+  tmp = '{}.{}.tmp'.format(path, os.getpid())
+  with open(tmp, 'wb') as f:
+    f.write(MAGIC)
+    f.write(struct.pack('<II', PACK_VERSION, len(header)))
+    f.write(header)
+    for name in names:
+      f.seek(start + entries[name]['offset'])
+      f.write(arrays[name].tobytes())
+  os.replace(tmp, path)
+
+def read_pack(path, mmap_mode='c'):
+  '''returns (meta, arrays) from a file written by write_pack() or None
+  if the file is missing, truncated or not a compatible pack. The arrays
+  are views of one memory map of the file unless mmap_mode is None. The
+  default copy-on-write mode allows Buffer.re_init() to alter them without
+  touching the file
+  '''
+  try:
+    with open(path, 'rb') as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        return None
+      version, hlen = struct.unpack('<II', f.read(8))
+      if version != PACK_VERSION:
+        return None
+      header = json.loads(f.read(hlen).decode('utf-8'))
+  except (IOError, OSError, ValueError, struct.error):
+    return None
+  start = -(-(len(MAGIC) + 8 + hlen) // ALIGN) * ALIGN
+  try:
+    with open(path, 'rb') as f:
+      if mmap_mode is None:
+        data = bytearray(f.read())
+      else: # map the file once, the arrays are views of it
+        data = mmap.mmap(f.fileno(), 0, access=MMAP_ACCESS[mmap_mode])
+  except (IOError, OSError, ValueError) as e: # ValueError for an empty file
+    LOGGER.warning('unable to read pack %s: %s', path, e)
+    return None
+  arrays = {}
+  try:
+    for name, e in header['arrays'].items():
+      dtype = np.dtype(e['dtype'])
+      shape = tuple(int(n) for n in e['shape'])
+      count = 1
+      for n in shape:
+        count *= n
+      offset = start + int(e['offset'])
+      if count < 0 or offset < start or offset + count * dtype.itemsize > len(data):
+        raise ValueError('{} runs past the end of the file'.format(name))
+      arrays[name] = np.frombuffer(data, dtype=dtype, count=count,
+                                   offset=offset).reshape(shape)
+    return header['meta'], arrays
+  except (KeyError, TypeError, ValueError, AttributeError) as e: # truncated or corrupt
+    LOGGER.warning('ignoring damaged pack %s: %s', path, e)
+    return None
+
+def source_stamp(file_string):
+  '''mtime and size of the source file used to decide if a cache is stale
+  '''
+  st = os.stat(file_string)
+  return [st.st_mtime, st.st_size]
+
+def cache_path(file_string):
+  return file_string + CACHE_EXT
+
+def pack_buffers(shape, arrays, base, prefix='', textures=True):
+  '''add the arrays of each Buffer of shape to the dict arrays, with names
+  starting prefix, and return the list of their settings for the meta.
+  Texture files are recorded relative to the directory base unless
+  textures is False. Raises ValueError if a texture wasn't loaded from a
+  file, leaving it out would move the rest to the wrong sampler
+  '''
+  buffers = []
+  for i, b in enumerate(shape.buf):
+    refs = [texture_ref(t, base) for t in b.textures] if textures else []
+    if None in refs:
+      raise ValueError('texture {} of buffer {} is not from a file'.format(refs.index(None), i))
+    arrays['{}array_buffer{}'.format(prefix, i)] = b.array_buffer
+    arrays['{}element_array_buffer{}'.format(prefix, i)] = b.element_array_buffer
+    if b.element_normals is not None:
+      arrays['{}element_normals{}'.format(prefix, i)] = b.element_normals
+    buffers.append({
+          'unib': list(b.unib),
+          'material': list(b.material),
+          'draw_method': int(b.draw_method),
+          'N_BYTES': b.N_BYTES,
+          'textures': refs})
+  return buffers
+
+def save_model(model, path, source=None):
+  '''write the Buffers of a Model (or any Shape) to path. If source is
+  given its mtime and size are recorded so that load_cached() can tell
+  when the original file has been edited. Raises ValueError if a texture
+  can't be recorded, see pack_buffers()
+  '''
+  arrays = {}
+  buffers = pack_buffers(model, arrays, os.path.dirname(path))
+  meta = {'version': MESH_VERSION, 'buffers': buffers,
+          'source': None if source is None else source_stamp(source)}
+  write_pack(path, arrays, meta)
+
+def texture_ref(tex, base):
+  '''the file name (relative to the directory base holding the cache) and
+  options needed to recreate a Texture, but none of its pixels. Textures
+  made from images or arrays can't be referenced so None is returned
+  '''
+  if not isinstance(tex.file_string, str):
+    return None
+  return {'file_string': os.path.relpath(tex.file_string, os.path.abspath(base)),
+          'blend': tex.blend, 'flip': tex.flip, 'mipmap': tex.mipmap}
+
+def make_buffers(meta, arrays, base='', prefix=''):
+  '''recreate the list of Buffers from the meta and arrays of a pack
+  without copying the (memory mapped) arrays. Texture files are relative
+  to the directory base, array names start with prefix
+  '''
+  bufs = []
+  for i, bd in enumerate(meta['buffers']):
+    b = pi3d.Buffer.__new__(pi3d.Buffer)
+    eab = arrays['{}element_array_buffer{}'.format(prefix, i)]
+    b.__setstate__({
+          'unib': bd['unib'],
+          'array_buffer': arrays['{}array_buffer{}'.format(prefix, i)],
+          'element_array_buffer': eab,
+          'element_normals': arrays.get('{}element_normals{}'.format(prefix, i), None),
+          'material': tuple(bd['material']),
+          'textures': [ASSETS.texture(os.path.normpath(os.path.join(base, t['file_string'])),
+                              blend=t['blend'],
+                              flip=t['flip'], mipmap=t['mipmap'])
+                       for t in bd['textures']],
+          'draw_method': bd['draw_method'],
+          'ntris': len(eab),
+          'N_BYTES': bd['N_BYTES']})
+    b.shader = None
+    bufs.append(b)
+  return bufs
+
+def load_cached(path, source=None):
+  '''returns a list of Buffers from the pack file at path or None if it
+  doesn't exist, was written by a different version or is older than source
+  '''
+  pack = read_pack(path)
+  if pack is None:
+    return None
+  meta, arrays = pack
+  if meta.get('version') != MESH_VERSION:
+    return None
+  if source is not None and meta.get('source') != source_stamp(source):
+    LOGGER.debug('%s is stale', path)
+    return None
+  if any(t is None for bd in meta['buffers'] for t in bd['textures']):
+    return None # written before such models were refused, the slots are wrong
+  return make_buffers(meta, arrays, os.path.dirname(path))
+
+def load_model(file_string, cache=True, **kwargs):
+  '''drop in replacement for pi3d.Model(file_string=..., **kwargs) that
+  uses or builds the cache file. If cache is a string it is used as the
+  path of the cache file. Failing to write the cache (read only
+  directory for instance) just logs a warning
+  '''
+  path = cache if isinstance(cache, str) else cache_path(file_string)
+  bufs = load_cached(path, file_string) if cache else None
+  if bufs is not None:
+    LOGGER.debug('loading %s from %s', file_string, path)
+    model = pi3d.Model(file_string='__clone__', **kwargs)
+    model.buf = bufs
+    model.vGroup = dict((i, i) for i in range(len(bufs)))
+    return model
+  model = pi3d.Model(file_string=file_string, **kwargs)
+  if cache:
+    try:
+      save_model(model, path, file_string)
+    except (IOError, OSError) as e:
+      LOGGER.warning('unable to write mesh cache %s: %s', path, e)
+    except ValueError as e:
+      LOGGER.info('not caching %s: %s', file_string, e)
+  return model
+
+if __name__ == '__main__':
+  # rough timing of parsing v. cached loading: python3 meshcache.py models/teapot.obj
+  import sys, time
+  for f in sys.argv[1:] or ['models/teapot.obj']:
+    tm = time.time()
+    m = pi3d.Model(file_string=f)
+    t_parse = time.time() - tm
+    save_model(m, cache_path(f), f)
+    tm = time.time()
+    m2 = load_model(f)
+    t_cache = time.time() - tm
+    print('{}: parse {:.3f}s cache {:.4f}s ({:.1f}x) {:.1f}kB'.format(f, t_parse,
+          t_cache, t_parse / max(t_cache, 1e-6), os.path.getsize(cache_path(f)) / 1024.0))
+    # a cut short copy is ignored rather than raising
+    with open(cache_path(f), 'rb') as src:
+      data = src.read()
+    for cut in (4, len(data) // 2, len(data) - 1):
+      with open(cache_path(f) + '.cut', 'wb') as dst:
+        dst.write(data[:cut])
+      assert read_pack(cache_path(f) + '.cut') is None, cut
+    os.remove(cache_path(f) + '.cut')
+    # a texture made from an array can't be recorded so the model isn't cached
+    m.buf[0].textures = [pi3d.Texture(np.zeros((4, 4, 3), dtype=np.uint8))] + m.buf[0].textures
+    try:
+      save_model(m, cache_path(f) + '.tex', f)
+      raise AssertionError('model with an array texture was cached')
+    except ValueError:
+      pass
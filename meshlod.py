@@ -0,0 +1,290 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Level of detail chains for large models. MarsStation shows
+Utility.draw_level_of_detail() switching between hand made versions of a
+model; this makes the reduced versions automatically.
+
+simplify_buffer() uses quadric error metric edge collapse (Garland and
+Heckbert) moving one point onto the other end of the edge so the uv and
+normal of the surviving vertex stay valid. Where the uv or normal is
+discontinuous (texture seams and hard edges) the Buffer has several
+vertices at the same point; these can only be moved along the seam, with
+each copy landing on the copy on its own side, and extra quadrics stop
+seams and open edges from changing shape.
+
+load_lod_chain() returns a LodModel that builds the reduced levels the
+first time, saves them in the mesh cache alongside the full version (see
+meshcache.py) and picks which one to draw from the size of the model on
+the screen:
+
+  church = meshlod.load_lod_chain('models/AllSaints/AllSaints.obj', sx=0.1, sy=0.1, sz=0.1)
+  church.set_shader(shader)
+  ...
+  church.draw()
+
+python3 meshlod.py models/Tiger/body.obj will build the chain offline and
+print the triangle counts and times.
+"""
+import heapq
+import logging
+import math
+
+import numpy as np
+
+import pi3d
+import meshcache
+
+LOGGER = logging.getLogger(__name__)
+
+RATIOS = (0.5, 0.25, 0.1) # proportion of triangles kept for each level
+PIXELS = (160.0, 80.0, 40.0) # switch to next level when smaller than this on screen
+
+SEAM_WEIGHT = 10.0 # multiplier for the quadrics holding open edges and seams in place
+
+def simplify_buffer(buf, ratio):
+  '''returns a new Buffer with approximately ratio * the number of
+  triangles in buf. Shader, textures and material are shared with buf
+  '''
+  ab = np.array(buf.array_buffer, dtype=np.float64)
+  wfaces = np.array(buf.element_array_buffer).astype(np.uint16).astype(np.int64)
+  nf = len(wfaces)
+  target = max(int(nf * ratio), 1)
+  # the Buffer has a vertex (wedge) for each different uv or normal at a
+  # point so weld these to work out the connectivity of the surface
+  pos, pid = np.unique(np.round(ab[:,0:3], 6), axis=0, return_inverse=True)
+  pid = pid.ravel()
+  np_ = len(pos)
+  faces = pid[wfaces]
+
+  # plane quadric of each face weighted by area, summed at each point
+  nrm = np.cross(pos[faces[:,1]] - pos[faces[:,0]], pos[faces[:,2]] - pos[faces[:,0]])
+  area2 = np.linalg.norm(nrm, axis=1)
+  plane = np.zeros((nf, 4))
+  ok = area2 > 1e-12
+  plane[ok,0:3] = nrm[ok] / area2[ok,np.newaxis]
+  plane[:,3] = -(plane[:,0:3] * pos[faces[:,0]]).sum(axis=1)
+  kp = plane[:,:,np.newaxis] * plane[:,np.newaxis,:] * (0.5 * area2)[:,np.newaxis,np.newaxis]
+  quad = np.zeros((np_, 4, 4))
+  for k in range(3):
+    np.add.at(quad, faces[:,k], kp)
+
+  # open edges and uv or normal seams only appear once as a pair of wedges
+  # add quadrics for planes at right angles to the face through these edges
+  wedges = np.concatenate([wfaces[:,[0,1]], wfaces[:,[1,2]], wfaces[:,[2,0]]])
+  owner = np.tile(np.arange(nf), 3)
+  _, inv, count = np.unique(np.sort(wedges, axis=1), axis=0, return_inverse=True,
+                            return_counts=True)
+  seam = count[inv.ravel()] == 1
+  p0, p1 = pos[pid[wedges[seam,0]]], pos[pid[wedges[seam,1]]]
+  side = np.cross(p1 - p0, plane[owner[seam],0:3])
+  slen = np.linalg.norm(side, axis=1)
+  ok = slen > 1e-12
+  sp = np.zeros((len(side), 4))
+  sp[ok,0:3] = side[ok] / slen[ok,np.newaxis]
+  sp[:,3] = -(sp[:,0:3] * p0).sum(axis=1)
+  ks = sp[:,:,np.newaxis] * sp[:,np.newaxis,:] * (SEAM_WEIGHT * slen ** 2)[:,np.newaxis,np.newaxis]
+  np.add.at(quad, pid[wedges[seam,0]], ks)
+  np.add.at(quad, pid[wedges[seam,1]], ks)
+
+  vfaces = [set() for _ in range(np_)]
+  for i, f in enumerate(faces):
+    for w in f:
+      vfaces[w].add(i)
+  alive = np.ones(nf, dtype=bool)
+  stamp = np.zeros(np_, dtype=np.int64) # bumped when a point's quadric changes
+  hpos = np.ones((np_, 4))
+  hpos[:,0:3] = pos
+  edges = np.unique(np.sort(np.concatenate([faces[:,[0,1]], faces[:,[1,2]],
+                                            faces[:,[2,0]]]), axis=1), axis=0)
+
+  def entry(u, v): # cost of moving u to v
+    return (hpos[v].dot(quad[u] + quad[v]).dot(hpos[v]), stamp[u], stamp[v], u, v)
+
+  heap = [entry(a, b) for a, b in edges] + [entry(b, a) for a, b in edges]
+  heapq.heapify(heap)
+
+  def neighbours(w):
+    return set(faces[list(vfaces[w])].ravel()) - set((w,))
+
+  n_alive = nf
+  while n_alive > target and heap:
+    _, su, sv, u, v = heapq.heappop(heap)
+    if stamp[u] != su or stamp[v] != sv or not vfaces[u]:
+      continue
+    shared = vfaces[u] & vfaces[v]
+    if not shared or not (vfaces[v] - shared): # i.e. last faces of a part would vanish
+      continue
+    # link condition, otherwise the collapse makes the mesh non-manifold
+    opposite = set(faces[list(shared)].ravel()) - set((u, v))
+    if (neighbours(u) & neighbours(v)) != opposite:
+      continue
+    # each wedge of u left in use has to slide along an edge onto a wedge
+    # of v, if not the uv or normal would be broken across a seam
+    remap = {}
+    for i in vfaces[u]:
+      wf = wfaces[i]
+      wu = wf[faces[i] == u][0]
+      if v in faces[i]:
+        remap[wu] = wf[faces[i] == v][0]
+    remain = vfaces[u] - shared
+    if any(not wfaces[i][faces[i] == u][0] in remap for i in remain):
+      continue
+    # don't allow any remaining face round u to flip over
+    flipped = False
+    for i in remain:
+      p = pos[faces[i]]
+      n0 = np.cross(p[1] - p[0], p[2] - p[0])
+      p = p.copy()
+      p[faces[i] == u] = pos[v]
+      if np.dot(n0, np.cross(p[1] - p[0], p[2] - p[0])) <= 0.0:
+        flipped = True
+        break
+    if flipped:
+      continue
+    for i in shared:
+      alive[i] = False
+      for w in faces[i]:
+        vfaces[w].discard(i)
+      n_alive -= 1
+    for i in remain:
+      k = faces[i] == u
+      wfaces[i][k] = remap[wfaces[i][k][0]]
+      faces[i][k] = v
+      vfaces[v].add(i)
+    vfaces[u] = set()
+    quad[v] += quad[u]
+    stamp[v] += 1
+    for w in neighbours(v):
+      heapq.heappush(heap, entry(w, v))
+      heapq.heappush(heap, entry(v, w))
+
+  used, wfaces = np.unique(wfaces[alive], return_inverse=True)
+  wfaces = wfaces.reshape(-1, 3)
+  bufw = ab.shape[1]
+  new_buf = pi3d.Buffer(None, ab[used,0:3], ab[used,6:8] if bufw == 8 else [],
+                        wfaces, ab[used,3:6] if bufw > 3 else None)
+  new_buf.shader = buf.shader
+  new_buf.material = buf.material
+  new_buf.textures = buf.textures
+  new_buf.draw_method = buf.draw_method
+  new_buf.unib[:] = buf.unib[:]
+  return new_buf
+
+def simplify_model(model, ratio):
+  '''list of simplified Buffers one for each Buffer in model
+  '''
+  return [simplify_buffer(b, ratio) for b in model.buf]
+
+def lod_path(file_string, ratio):
+  return '{}.lod{:03d}{}'.format(file_string, int(round(ratio * 1000)), meshcache.CACHE_EXT)
+
+def build_lod_chain(file_string, ratios=RATIOS, model=None):
+  '''offline step: writes a cache file for each ratio, returns a list of
+  the lists of Buffers
+  '''
+  if model is None:
+    model = meshcache.load_model(file_string)
+  levels = []
+  for r in ratios:
+    holder = pi3d.Model(file_string='__clone__')
+    holder.buf = simplify_model(model, r)
+    try:
+      meshcache.save_model(holder, lod_path(file_string, r), file_string)
+    except (IOError, OSError, ValueError) as e: # still usable, just built again next time
+      LOGGER.warning('unable to write %s: %s', lod_path(file_string, r), e)
+    levels.append(holder.buf)
+  return levels
+
+def load_lod_chain(file_string, ratios=RATIOS, pixels=PIXELS, **kwargs):
+  '''returns a LodModel for file_string, kwargs are as for pi3d.Model.
+  Levels missing from the cache or older than the source are rebuilt
+  '''
+  model = meshcache.load_model(file_string, **kwargs)
+  levels = [model.buf]
+  for r in ratios:
+    bufs = meshcache.load_cached(lod_path(file_string, r), file_string)
+    if bufs is None:
+      LOGGER.info('building %s at %.3f', file_string, r)
+      bufs = build_lod_chain(file_string, (r,), model)[0]
+    levels.append(bufs)
+  return LodModel(model, levels, pixels)
+
+def bounding_radius(bufs):
+  '''radius of a sphere centred on the origin of the model enclosing all
+  the vertices in the list of Buffers
+  '''
+  return max(np.sqrt((b.array_buffer[:,0:3] ** 2).sum(axis=1)).max()
+             for b in bufs if len(b.array_buffer) > 0)
+
+class LodModel(object):
+  def __init__(self, model, levels, pixels=PIXELS):
+    '''wraps a pi3d.Model and swaps its Buffers for the level that suits
+    the screen size of the model when draw() is called. Anything else
+    (position, rotate, set_shader etc) is passed on to the Model, methods
+    that set values in the Buffers are applied to every level.
+
+      *levels*
+        list of lists of Buffers, full detail first
+      *pixels*
+        list of screen heights, in pixels, of the bounding sphere below
+        which the next level is used
+    '''
+    self.model = model
+    self.levels = levels
+    self.pixels = pixels
+    self.radius = bounding_radius(levels[0])
+    self.level = 0
+    self.counts = [0] * len(levels) # number of draws at each level
+
+  def __getattr__(self, name):
+    attr = getattr(self.model, name)
+    if name.startswith('set_') and callable(attr):
+      def for_all_levels(*args, **kwargs):
+        for bufs in self.levels:
+          self.model.buf = bufs
+          result = attr(*args, **kwargs)
+        self.model.buf = self.levels[self.level]
+        return result
+      return for_all_levels
+    return attr
+
+  def screen_size(self, camera=None, screen_height=None):
+    '''diameter in pixels of the bounding sphere seen from camera
+    '''
+    camera = camera or self.model._camera or pi3d.Camera.instance()
+    if screen_height is None:
+      screen_height = pi3d.Display.Display.INSTANCE.height
+    scale = max(self.model.unif[6:9])
+    dist = math.sqrt(sum((self.model.unif[i] - camera.eye[i]) ** 2 for i in range(3)))
+    rad = self.radius * scale
+    if dist <= rad:
+      return float(screen_height)
+    return rad / (dist * math.tan(math.radians(camera.lens[2]) * 0.5)) * screen_height
+
+  def select(self, camera=None, screen_height=None):
+    '''choose the level for this camera position and return it
+    '''
+    size = self.screen_size(camera, screen_height)
+    level = 0
+    while level < len(self.levels) - 1 and level < len(self.pixels) and size < self.pixels[level]:
+      level += 1
+    self.level = level
+    self.model.buf = self.levels[level]
+    self.counts[level] += 1
+    return level
+
+  def draw(self, shader=None, txtrs=None, ntl=None, shny=None, camera=None):
+    self.select(camera)
+    self.model.draw(shader, txtrs, ntl, shny, camera)
+
+if __name__ == '__main__':
+  import sys, time
+  for f in sys.argv[1:] or ['models/Tiger/body.obj']:
+    m = pi3d.Model(file_string=f)
+    print('{} {} triangles'.format(f, sum(b.ntris for b in m.buf)))
+    for r in RATIOS:
+      tm = time.time()
+      bufs = build_lod_chain(f, (r,), m)[0]
+      print('  {:.3f} {:6d} triangles {:.2f}s'.format(r, sum(b.ntris for b in bufs),
+                                                     time.time() - tm))
@@ -0,0 +1,369 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Screenshots and frame sequences without stalling the render loop.
+pi3d.screenshot() reads the pixels back (which has to happen on the display
+thread) then jpeg encodes and saves them before returning, which takes much
+longer than the read. Recording every frame that way drops the frame rate
+to a few fps.
+
+FrameRecorder only does the glReadPixels part in capture() then hands the
+array to a bounded FrameQueue. Either a pool of worker processes encode each
+frame to its own image file or, if an output movie is given, one thread
+writes the raw rgb frames into the stdin of an ffmpeg subprocess. The
+FrameQueue stays on the render side (a thread passes the frames on to the
+processes one at a time) so the frames waiting in it can still be dropped. Nothing
+is started until the first frame so a demo that never takes a picture
+doesn't pay for it. The workers are forked, as the demos have no
+if __name__ == '__main__' guard and a spawned process would run the demo
+(and open a Display) again, where fork isn't available threads are used.
+
+When the queue is full (encoding can't keep up) the policy decides what
+happens:
+
+  DROP_OLDEST  throw away the frame waiting longest, keep the newest
+  DROP_NEWEST  throw away the frame just captured
+  BLOCK        wait for space, frame rate drops but nothing is lost. Use
+               this for making movies where every frame is needed
+
+  rec = recorder.FrameRecorder()
+  ...
+  if k == 112: #key p
+    rec.capture("forestWalk{:04d}.jpg".format(scshots))
+  ...
+  rec.close() # waits for the queue to empty
+
+or for a movie
+
+  rec = recorder.FrameRecorder(movie='flight.mp4', fps=30, policy=recorder.BLOCK)
+  while DISPLAY.loop_running():
+    ...
+    rec.capture()
+"""
+import collections
+import logging
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+import pi3d
+
+LOGGER = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+MAXSIZE = 8 # frames held waiting to be encoded, each is w * h * 3 bytes
+QUALITY = 90 # jpeg quality, same as pi3d.screenshot()
+FFMPEG_ARGS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-preset', 'veryfast']
+
+def save_image(img, filestring, quality=QUALITY):
+  '''encode and save an (h, w, 3) uint8 array as pi3d.screenshot() would
+  '''
+  try:
+    from PIL import Image
+  except ImportError: # no PIL so same fallback as pi3d.screenshot()
+    np.savez_compressed(filestring, img)
+    return
+  Image.fromarray(img).save(filestring, quality=quality)
+
+def _fork_context():
+  '''multiprocessing context that forks, or None if there isn't one
+  '''
+  if not hasattr(multiprocessing, 'get_context'): # python2 always forks on posix
+    return multiprocessing if os.name == 'posix' else None
+  if 'fork' in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context('fork')
+  return None
+
+class FrameQueue(object):
+  def __init__(self, maxsize):
+    '''frames waiting to be encoded. A multiprocessing.Queue can't give
+    back a frame once it has been put, this can, for DROP_OLDEST
+    '''
+    self.maxsize = maxsize
+    self.items = collections.deque()
+    self.lock = threading.Condition()
+
+  def put(self, item, policy=BLOCK):
+    '''add item, if full the policy decides what happens. Returns False if
+    a frame was dropped. None (to stop a consumer) always goes in
+    '''
+    with self.lock:
+      full = item is not None and len(self.items) >= self.maxsize
+      if full and policy == DROP_NEWEST:
+        return False
+      if full and policy == DROP_OLDEST:
+        self.items.popleft()
+      while item is not None and len(self.items) >= self.maxsize: # BLOCK
+        self.lock.wait()
+      self.items.append(item)
+      self.lock.notify_all()
+      return not full or policy == BLOCK
+
+  def get(self):
+    '''the oldest item, waits until there is one
+    '''
+    with self.lock:
+      while not self.items:
+        self.lock.wait()
+      item = self.items.popleft()
+      self.lock.notify_all()
+      return item
+
+  def clear(self):
+    with self.lock:
+      self.items.clear()
+      self.lock.notify_all()
+
+  def qsize(self):
+    return len(self.items)
+
+def _encode_worker(frames, written, quality):
+  '''run in each worker until it gets None from frames, a FrameQueue for
+  threads or the multiprocessing.Queue fed from it for processes
+  '''
+  while True:
+    item = frames.get()
+    if item is None:
+      break
+    img, filestring = item
+    try:
+      save_image(img, filestring, quality)
+      with written.get_lock():
+        written.value += 1
+    except Exception as e:
+      LOGGER.error('failed to save %s: %s', filestring, e)
+
+class FrameRecorder(object):
+  def __init__(self, pattern='frame{:05d}.jpg', movie=None, fps=25, workers=2,
+               maxsize=MAXSIZE, policy=DROP_OLDEST, quality=QUALITY,
+               ffmpeg='ffmpeg', ffmpeg_args=FFMPEG_ARGS):
+    '''
+      *pattern*
+        format string used for the file name when capture() is called
+        without one, it is given the frame number
+      *movie*
+        if set, frames are piped to ffmpeg to make this file rather than
+        saved as separate images. All frames must be the same size
+      *fps*
+        frame rate of the movie
+      *workers*
+        number of encoding processes (threads if fork isn't available),
+        ignored for movies
+      *maxsize*
+        number of frames that can be waiting to be encoded
+      *policy*
+        DROP_OLDEST, DROP_NEWEST or BLOCK, what to do if the queue is full
+    '''
+    if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+      raise ValueError('unknown policy {}'.format(policy))
+    self.pattern = pattern
+    self.movie = movie
+    self.fps = fps
+    self.policy = policy
+    self.quality = quality
+    self.ffmpeg = ffmpeg
+    self.ffmpeg_args = list(ffmpeg_args)
+    self.frame = 0
+    self.captured = 0
+    self.dropped = 0
+    self.max_depth = 0
+    self.blocked_time = 0.0 # seconds capture() spent waiting with BLOCK
+    self.capture_time = 0.0 # seconds spent in glReadPixels
+    self.closed = False
+    self.pipe = None
+    self.n_workers = max(1, workers)
+    self.maxsize = maxsize
+    self.workers = [] # started by the first put()
+    self.consumers = []
+    self.frames = None
+    self.written = multiprocessing.Value('l', 0)
+
+  def _start(self):
+    '''make the queue and start the workers. self.consumers are what
+    take frames from the FrameQueue, each needs a None to stop it
+    '''
+    ctx = _fork_context() if self.movie is None else None
+    self.frames = FrameQueue(self.maxsize)
+    if self.movie is not None:
+      self.consumers = [threading.Thread(target=self._pipe_writer)]
+      self.workers = self.consumers
+    elif ctx is not None:
+      handoff = ctx.Queue(1) # a worker has to take each frame before the next goes
+      self.written = ctx.Value('l', 0)
+      self.consumers = [threading.Thread(target=self._feed, args=(handoff,))]
+      self.workers = self.consumers + [ctx.Process(target=_encode_worker,
+                            args=(handoff, self.written, self.quality))
+                      for _ in range(self.n_workers)]
+    else: # PIL releases the GIL while encoding so threads still help
+      self.consumers = [threading.Thread(target=_encode_worker,
+                            args=(self.frames, self.written, self.quality))
+                      for _ in range(self.n_workers)]
+      self.workers = self.consumers
+    for w in self.workers:
+      w.daemon = True
+      w.start()
+
+  def _feed(self, handoff):
+    '''thread passing frames from the FrameQueue to the worker processes
+    '''
+    while True:
+      item = self.frames.get()
+      if item is None:
+        for _ in range(self.n_workers):
+          handoff.put(None)
+        break
+      handoff.put(item)
+
+  def capture(self, filestring=None, x=0, y=0, w=None, h=None):
+    '''read the screen (or part of it) and queue it for saving. Must be
+    called from the display thread after drawing. Returns False if a frame
+    was dropped
+    '''
+    if w is None or h is None:
+      disp = pi3d.Display.Display.INSTANCE
+      w, h = disp.width, disp.height
+    tm = time.time()
+    img = pi3d.masked_screenshot(x, y, w, h)
+    self.capture_time += time.time() - tm
+    return self.put(img, filestring)
+
+  def put(self, img, filestring=None):
+    '''queue an (h, w, 3) uint8 array. filestring is ignored for movies
+    '''
+    if self.closed:
+      raise ValueError('FrameRecorder has been closed')
+    if not self.workers:
+      self._start()
+    if filestring is None:
+      filestring = self.pattern.format(self.frame)
+    self.frame += 1
+    self.captured += 1
+    tm = time.time()
+    ok = self.frames.put((img, filestring), self.policy)
+    if self.policy == BLOCK:
+      self.blocked_time += time.time() - tm
+    if not ok:
+      self.dropped += 1
+    self.max_depth = max(self.max_depth, self.frames.qsize())
+    return ok
+
+  def _pipe_writer(self):
+    '''thread feeding the ffmpeg subprocess, started on the first frame so
+    the size is known
+    '''
+    while True:
+      item = self.frames.get()
+      if item is None:
+        break
+      img = item[0]
+      if self.pipe is None:
+        h, w = img.shape[0:2]
+        cmd = [self.ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo',
+               '-pix_fmt', 'rgb24', '-s', '{}x{}'.format(w, h),
+               '-r', str(self.fps), '-i', '-'] + self.ffmpeg_args + [self.movie]
+        try:
+          self.pipe = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        except OSError as e:
+          LOGGER.error('unable to run %s: %s', self.ffmpeg, e)
+          self._drain() # keep emptying the queue so capture() never blocks
+          return
+      try:
+        self.pipe.stdin.write(np.ascontiguousarray(img).tobytes())
+        with self.written.get_lock():
+          self.written.value += 1
+      except (IOError, OSError) as e: # ffmpeg died
+        LOGGER.error('ffmpeg pipe closed: %s', e)
+        self._drain()
+        return
+
+  def _drain(self):
+    while self.frames.get() is not None:
+      pass
+
+  def stats(self):
+    '''dict of counters. written is only up to date once close() has run
+    if some frames are still being encoded
+    '''
+    return {'captured': self.captured, 'written': self.written.value,
+            'dropped': self.dropped, 'max_depth': self.max_depth,
+            'blocked_time': self.blocked_time, 'capture_time': self.capture_time}
+
+  def close(self, wait=True):
+    '''stop accepting frames. With wait the frames already queued are
+    finished first, otherwise they are thrown away
+    '''
+    if self.closed:
+      return
+    self.closed = True
+    if not self.workers: # never used
+      return
+    if not wait:
+      self.frames.clear()
+    for _ in self.consumers:
+      self.frames.put(None)
+    for w in self.workers:
+      w.join()
+    if self.pipe is not None:
+      self.pipe.stdin.close()
+      self.pipe.wait()
+    LOGGER.info('%s', self.stats())
+
+if __name__ == '__main__':
+  # compare saving in the loop with the recorder, no display needed
+  import shutil, sys, tempfile
+  w, h, n = 1280, 720, 60
+  img = (np.random.random((h, w, 3)) * 255).astype(np.uint8)
+  tmp = tempfile.mkdtemp()
+  try:
+    tm = time.time()
+    for i in range(n // 4):
+      save_image(img, os.path.join(tmp, 's{:05d}.jpg'.format(i)))
+    t_sync = (time.time() - tm) / (n // 4)
+    print('synchronous {:.1f}ms per frame'.format(t_sync * 1000.0))
+    for policy in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+      rec = FrameRecorder(pattern=os.path.join(tmp, policy + '{:05d}.jpg'), policy=policy)
+      tm = time.time()
+      for i in range(n):
+        rec.put(img)
+        time.sleep(1.0 / 60.0) # pretend to draw at 60fps
+      t_loop = (time.time() - tm) / n - 1.0 / 60.0
+      rec.close()
+      print('{:12s} {:.1f}ms per frame in loop {}'.format(policy, t_loop * 1000.0, rec.stats()))
+    # a burst much faster than one worker can encode, so the queue fills
+    big = (np.random.random((1080, 1920, 3)) * 255).astype(np.uint8)
+    burst, maxsize = 30, 2
+    for policy in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+      stem = 'b' + policy
+      rec = FrameRecorder(pattern=os.path.join(tmp, stem + '{:05d}.jpg'), policy=policy,
+                          workers=1, maxsize=maxsize)
+      for i in range(burst):
+        rec.put(big)
+      rec.close()
+      done = sorted(int(f[len(stem):-4]) for f in os.listdir(tmp) if f.startswith(stem))
+      st = rec.stats()
+      assert st['written'] == len(done) and st['written'] + st['dropped'] == burst, (policy, st)
+      # at most maxsize waiting, one in the hand over, one being encoded and
+      # one held by the feeder thread, the rest are dropped
+      if policy == DROP_OLDEST: # the newest are kept
+        assert done[-maxsize:] == list(range(burst - maxsize, burst)), (policy, done)
+        assert len(done) <= maxsize + 3, (policy, done)
+      elif policy == DROP_NEWEST: # the first are kept
+        assert done == list(range(len(done))) and len(done) <= maxsize + 3, (policy, done)
+      else:
+        assert done == list(range(burst)), (policy, done)
+      print('burst of {} {:12s} wrote {}'.format(burst, policy, done))
+    if len(sys.argv) > 1: # python3 recorder.py test.mp4 to try the ffmpeg pipe
+      rec = FrameRecorder(movie=sys.argv[1], fps=60, policy=BLOCK)
+      for i in range(n):
+        rec.put(np.roll(img, i * 8, axis=1))
+      rec.close()
+      print('movie', rec.stats())
+  finally:
+    shutil.rmtree(tmp)
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Particles kept in fixed size arrays used as a ring. Particles.py moves
+every spark along the arrays each frame to age them, works on the moving
+ones through np.where() index arrays and re_init()s the whole Buffer, so
+the cost of a frame is that of all N sparks however many are alive.
+
+ParticleSystem allocates the positions, velocities, ages, lifetimes,
+normals and texture coordinates once, capacity long, as separate arrays.
+New particles are written at the head of the ring, overwriting the oldest
+if it's full, and as they usually die in the order they were made the
+dead are dropped by moving the tail on. Any that die out of turn are
+squeezed out of the live range, which keeps it in one or two slices so
+the gravity, drag and jitter are done on views without index arrays:
+
+  sparks = ParticleSystem(10000, gravity=(0.0, -0.5, 0.0), drag=0.1)
+  sparks.set_draw_details(shader, [tex])
+  ...
+  sparks.spawn(pos, vel, life) # arrays (n, 3), (n, 3) and (n,) or a number
+  sparks.update(dt)
+  sparks.draw()
+
+update() copies the live particles to the front of the Buffer and sends
+just those bytes to the GPU, with the draw count cut to match. The points
+go in one Buffer up to MAX_POINTS (the most GL_UNSIGNED_SHORT indices can
+reach) and more Buffers of the same Shape beyond that. As in Points, the
+normals are passed through for shaders that use them for colour.
+
+python3 ring_particles.py runs fountains of 1k to 100k particles without a
+Display and compares the time with the Particles.py way of doing it.
+"""
+import ctypes
+import logging
+
+import numpy as np
+
+import pi3d
+from pi3d.constants import opengles, GL_ARRAY_BUFFER, GLfloat, GLintptr
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_POINTS = 65535 # per Buffer, indices are unsigned short
+POINT_SIZE = 5.0
+
+class ParticleSystem(pi3d.Shape):
+  def __init__(self, capacity, gravity=(0.0, -1.0, 0.0), drag=0.0, jitter=0.0,
+               age_tex=False, point_size=POINT_SIZE, camera=None, light=None,
+               name="", x=0.0, y=0.0, z=0.0, drag2=0.0, floor=None):
+    '''up to capacity particles accelerated by gravity (x, y, z), slowed by
+    drag (fraction of the velocity lost per second) and drag2 (the same
+    times the speed, i.e. air resistance) and pushed about at random by up
+    to jitter per second squared. If floor is given particles stop moving
+    once they get down to that y and lie there until their life is up. If
+    age_tex the u texture coordinate is set to age / life, for a texture
+    going along with age
+    '''
+    super(ParticleSystem, self).__init__(camera, light, name, x, y, z, 0.0, 0.0, 0.0,
+                                         1.0, 1.0, 1.0, 0.0, 0.0, 0.0)
+    self.capacity = capacity
+    self.gravity = np.array(gravity, dtype=np.float32)
+    self.drag = drag
+    self.drag2 = drag2
+    self.floor = floor
+    self.jitter = jitter
+    self.age_tex = age_tex
+    self.pos = np.zeros((capacity, 3), dtype=np.float32)
+    self.vel = np.zeros((capacity, 3), dtype=np.float32)
+    self.age = np.zeros(capacity, dtype=np.float32)
+    self.life = np.ones(capacity, dtype=np.float32)
+    self.norms = np.zeros((capacity, 3), dtype=np.float32)
+    self.texs = np.zeros((capacity, 2), dtype=np.float32)
+    self.head = 0 # next slot to write
+    self.count = 0 # live particles, ending at head
+    self.buf = []
+    for start in range(0, capacity, MAX_POINTS):
+      n = min(MAX_POINTS, capacity - start)
+      faces = np.arange(-(-n // 3) * 3).reshape(-1, 3)
+      faces[faces >= n] = n - 1
+      self.buf.append(pi3d.Buffer(self, np.zeros((n, 3)), np.zeros((n, 2)), faces,
+                                  np.zeros((n, 3)), smooth=False))
+    self.set_point_size(point_size)
+    for b in self.buf:
+      b.ntris = 0
+    self.reset_stats()
+
+  def reset_stats(self):
+    self.spawned = 0
+    self.killed = 0 # died, or overwritten by spawn()
+    self.squeezed = 0 # times dead particles had to be squeezed out of the live range
+    self.uploaded = 0 # bytes sent to the GPU
+
+  def stats(self):
+    return {'live': self.count, 'spawned': self.spawned, 'killed': self.killed,
+            'squeezed': self.squeezed, 'uploaded': self.uploaded}
+
+  def _slices(self):
+    '''the live range as one or two slices of the arrays, oldest first
+    '''
+    tail = (self.head - self.count) % self.capacity
+    end = tail + self.count
+    if end <= self.capacity:
+      return [slice(tail, end)]
+    return [slice(tail, self.capacity), slice(0, end - self.capacity)]
+
+  def spawn(self, pos, vel, life, normals=None, tex_coords=None):
+    '''add particles at pos (n, 3) with velocity vel (n, 3) living life
+    seconds (n,) or the same for all. normals and tex_coords, if given, are
+    (n, 3) and (n, 2). The oldest go if there isn't room
+    '''
+    pos = np.asarray(pos, dtype=np.float32).reshape(-1, 3)
+    n = len(pos)
+    skip = max(0, n - self.capacity) # more than will fit, only the last are kept
+    ix = (self.head + np.arange(skip, n)) % self.capacity
+    self.pos[ix] = pos[skip:]
+    self.vel[ix] = np.broadcast_to(np.asarray(vel, dtype=np.float32), (n, 3))[skip:]
+    self.life[ix] = np.broadcast_to(np.asarray(life, dtype=np.float32), (n,))[skip:]
+    self.age[ix] = 0.0
+    if normals is not None:
+      self.norms[ix] = np.broadcast_to(np.asarray(normals, dtype=np.float32), (n, 3))[skip:]
+    if tex_coords is not None:
+      self.texs[ix] = np.broadcast_to(np.asarray(tex_coords, dtype=np.float32), (n, 2))[skip:]
+    self.head = (self.head + n) % self.capacity
+    over = max(0, self.count + n - self.capacity)
+    self.count = min(self.capacity, self.count + n)
+    self.spawned += n
+    self.killed += over
+    return n - skip
+
+  def update(self, dt):
+    '''move the live particles on dt seconds, drop those past their life
+    and send the rest to the Buffers
+    '''
+    damp = max(0.0, 1.0 - self.drag * dt)
+    for sl in self._slices():
+      vel = self.vel[sl]
+      if self.floor is not None:
+        down = self.pos[sl][:, 1] <= self.floor # before they move, as Particles.py did
+      if self.jitter:
+        vel += (np.random.random(vel.shape).astype(np.float32) - 0.5) * (self.jitter * dt)
+      vel += self.gravity * dt
+      if damp != 1.0:
+        vel *= damp
+      if self.drag2:
+        vel -= vel * np.abs(vel) * (self.drag2 * dt)
+      if self.floor is not None:
+        vel[down] = 0.0
+      self.pos[sl] += vel * dt
+      self.age[sl] += dt
+    self._kill()
+    self._upload()
+
+  def _kill(self):
+    dead = np.concatenate([self.age[sl] >= self.life[sl] for sl in self._slices()])
+    ndead = int(dead.sum())
+    if ndead == 0:
+      return
+    lead = int(np.argmin(dead)) if not dead.all() else len(dead) # dead in a row at the tail
+    self.count -= lead
+    self.killed += ndead
+    if lead == ndead:
+      return
+    # some died out of turn, squeeze them out towards the head
+    tail = (self.head - self.count) % self.capacity
+    ix = (tail + np.arange(self.count)) % self.capacity
+    keep = ix[~dead[lead:]]
+    self.count = len(keep)
+    dest = (self.head - self.count + np.arange(self.count)) % self.capacity
+    for a in (self.pos, self.vel, self.age, self.life, self.norms, self.texs):
+      a[dest] = a[keep]
+    self.squeezed += 1
+
+  def _upload(self):
+    '''live particles to the front of the Buffers, in order, and only those
+    sent to the GPU
+    '''
+    filled = [0] * len(self.buf)
+    done = 0
+    for sl in self._slices():
+      start, stop = sl.start, sl.stop
+      while start < stop:
+        i, slot = divmod(done, MAX_POINTS)
+        n = min(stop - start, MAX_POINTS - slot)
+        ab = self.buf[i].array_buffer
+        ab[slot:(slot + n), 0:3] = self.pos[start:(start + n)]
+        ab[slot:(slot + n), 3:6] = self.norms[start:(start + n)]
+        if self.age_tex:
+          ab[slot:(slot + n), 6] = self.age[start:(start + n)] / self.life[start:(start + n)]
+          ab[slot:(slot + n), 7] = self.texs[start:(start + n), 1]
+        else:
+          ab[slot:(slot + n), 6:8] = self.texs[start:(start + n)]
+        filled[i] = slot + n
+        done += n
+        start += n
+    for b, n in zip(self.buf, filled):
+      b.ntris = -(-n // 3)
+      if n % 3: # last indices point at the last live particle
+        b.array_buffer[n:min(b.ntris * 3, len(b.array_buffer))] = b.array_buffer[n - 1]
+      nbytes = min(b.ntris * 3, len(b.array_buffer)) * b.N_BYTES
+      self.uploaded += nbytes
+      if b.disp is None or nbytes == 0: # as Buffer.re_init(), nothing to send it to yet
+        continue
+      if not hasattr(b, 'vbuf'):
+        b.load_opengl()
+      b._select()
+      opengles.glBufferSubData(GL_ARRAY_BUFFER, GLintptr(0), nbytes,
+                               b.array_buffer.ctypes.data_as(ctypes.POINTER(GLfloat)))
+
+  def live(self):
+    '''(pos, age, life) copies of the live particles, oldest first
+    '''
+    sls = self._slices()
+    return tuple(np.concatenate([a[sl] for sl in sls]) for a in (self.pos, self.age, self.life))
+
+if __name__ == '__main__':
+  import time
+  FPS = 25.0
+  DT = 1.0 / FPS
+  LIFE = 4.0 # seconds, so capacity / (LIFE * FPS) new each frame
+
+  def shift_update(verts, vel, n_new):
+    '''the Particles.py Sparks.update() way, without the GL
+    '''
+    vel[n_new:] = vel[:-n_new]
+    verts[n_new:] = verts[:-n_new]
+    verts[0:n_new] = 0.0
+    vel[0:n_new] = np.random.random((n_new, 3)) * DT
+    ix = np.where(verts[:, 1] > -1.0)[0]
+    vel[ix] += ((np.random.random((len(ix), 3)) - 0.5) * 0.2 - vel[ix] * vel[ix] * 0.01) * DT
+    vel[ix, 1] -= 0.05 * DT
+    verts[ix] += vel[ix]
+    full = np.zeros((len(verts), 8), dtype=np.float32) # re_init() copies the lot
+    full[:, 0:3] = verts
+
+  rng = np.random.RandomState(4)
+  # the ring against a plain list of what should be alive, with lives out of order
+  ps = ParticleSystem(1000, gravity=(0.0, -1.0, 0.0), drag=0.1)
+  expect = []
+  for frame in range(300):
+    n = rng.randint(0, 20)
+    life = rng.uniform(0.5, 2.0, n)
+    ps.spawn(rng.uniform(-1.0, 1.0, (n, 3)), rng.uniform(-1.0, 1.0, (n, 3)), life)
+    expect = [[a, l] for a, l in expect + [[0.0, l] for l in life]][-ps.capacity:]
+    ps.update(DT)
+    expect = [[a + DT, l] for a, l in expect if a + DT < l]
+    pos, age, life = ps.live()
+    b = ps.buf[0]
+    assert len(expect) == ps.count, (len(expect), ps.count)
+    assert np.allclose(life, [l for a, l in expect]) and np.all(age < life)
+    assert np.array_equal(b.array_buffer[:ps.count, 0:3], pos)
+  print('ring matches a list of the live particles over 300 frames: {}'.format(ps.stats()))
+  # thrown up, slowed by the air and left lying on the floor
+  ps = ParticleSystem(100, gravity=(0.0, -1.0, 0.0), drag2=0.5, floor=-1.0)
+  free = ParticleSystem(100, gravity=(0.0, -1.0, 0.0), floor=-1.0)
+  top, free_top = 0.0, 0.0
+  for p in (ps, free):
+    p.spawn(np.zeros((100, 3)), [0.0, 2.0, 0.0], 100.0)
+  for frame in range(int(FPS * 10)):
+    ps.update(DT)
+    free.update(DT)
+    top, free_top = max(top, ps.pos[:, 1].max()), max(free_top, free.pos[:, 1].max())
+  assert top < 0.8 * free_top, (top, free_top)
+  pos = ps.pos.copy()
+  ps.update(DT)
+  assert ps.count == 100 and np.all(pos[:, 1] <= -1.0) and np.array_equal(pos, ps.pos)
+  print('drag2 kept the particles to {:.2f} high ({:.2f} without) and they stay on the floor'.format(top, free_top))
+  for capacity in (1000, 10000, 100000):
+    new = int(capacity / (LIFE * FPS))
+    ps = ParticleSystem(capacity, gravity=(0.0, -1.0, 0.0), drag=0.1, jitter=0.2, age_tex=True)
+    times = []
+    for frame in range(int(LIFE * FPS * 3)):
+      tm = time.time()
+      ps.spawn(np.zeros((new, 3)), rng.uniform(-1.0, 1.0, (new, 3)), LIFE)
+      ps.update(DT)
+      times.append(time.time() - tm)
+    verts = np.zeros((capacity, 3), dtype=np.float32)
+    vel = np.zeros((capacity, 3), dtype=np.float32)
+    shift = []
+    for frame in range(int(LIFE * FPS)):
+      tm = time.time()
+      shift_update(verts, vel, new)
+      shift.append(time.time() - tm)
+    t_ring = np.mean(times[-int(LIFE * FPS):]) * 1000.0 # once it's full
+    t_shift = np.mean(shift) * 1000.0
+    s = ps.stats()
+    print('{:6d} particles ({} buffers, {} live): ring {:6.2f}ms a frame, shifting arrays '
+          '{:6.2f}ms {:4.1f}x, {:.0f}kB a frame uploaded'.format(capacity, len(ps.buf), s['live'],
+          t_ring, t_shift, t_shift / max(t_ring, 1e-9), s['uploaded'] / len(times) / 1024.0))
@@ -0,0 +1,433 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Binary cache for the scenery tiles of pi3d.util.Scenery, replacing the
+map00.pkl etc. files written by Scene.do_pickle(). The pickles carry the
+texture images with them, only work with the python and pi3d versions that
+wrote them and all have to be made again when anything changes. Loading
+them takes about the same time as the pack once the files are in the page
+cache.
+
+Here every tile (the ElevationMaps and the MergeShape clusters put on them)
+goes into one pack file in the meshcache format, scenery.p3s in the scenery
+directory, holding the Buffer arrays, the Shape settings and, for maps, the
+grid of heights. The pack is memory mapped and each tile is only made into a
+Shape when it is needed, so opening it costs next to nothing and a tile
+never used is never read from disk.
+
+Each tile records a hash of everything it was made from (the png or obj
+file and the SceneryItem settings, and for clusters the map they sit on) so
+build() only regenerates the tiles whose sources have changed. CachedScene
+is a drop in replacement for Scene that builds and loads from the pack:
+
+  from scenery_cache import CachedScene as Scene
+  sc = Scene('alpine', MSIZE, NX, NZ)
+  ... fill in sc.scenery_list as before
+  sc.build(FOG) # quick if nothing has changed
+
+python3 scenery_cache.py compares the load time, with the files in the page
+cache and not, and the size with the pickles.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+  import queue
+except ImportError: # python2
+  import Queue as queue
+
+import numpy as np
+
+import pi3d
+from pi3d.util.Scenery import Scene
+from assets import ASSETS
+from meshcache import make_buffers, pack_buffers, read_pack, write_pack
+from terrain_query import cluster
+
+LOGGER = logging.getLogger(__name__)
+
+SCENERY_VERSION = 1 # increment if the tile meta written by build() changes
+CACHE_FILE = 'scenery.p3s'
+DIVISIONS = 32 # as Scene.do_pickle()
+FOG = ((0.3, 0.3, 0.4, 0.95), 450.0)
+MAP_STATE = ('width', 'height', 'depth', 'ix', 'iy', 'wh', 'hh', 'ws', 'hs')
+
+def file_hash(file_string, h=None):
+  '''sha1 of the contents of a file, added to h if given
+  '''
+  h = h or hashlib.sha1()
+  with open(file_string, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 16), b''):
+      h.update(block)
+  return h
+
+def tile_hash(scene, key, fog, hashes):
+  '''hex digest of everything the tile key is made from. hashes is a dict
+  of the digests already worked out, clusters include that of their map
+  '''
+  s_item = scene.scenery_list[key]
+  settings = [SCENERY_VERSION, key, scene.msize, getattr(scene, 'divisions', DIVISIONS), s_item.x, s_item.y,
+              s_item.z, s_item.height, s_item.alpha, fog, s_item.put_on,
+              s_item.model_details]
+  if s_item.put_on is None:
+    source = '{}/{}.png'.format(scene.path, key)
+  else:
+    source = '{}/{}.obj'.format(scene.path, s_item.model_details['model'])
+    settings.append(hashes[s_item.put_on])
+  h = file_hash(source)
+  h.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+  return h.hexdigest()
+
+class SceneryCache(object):
+  def __init__(self, path):
+    '''the tiles in the pack file at path. Nothing is read apart from the
+    header until load() is called. If the file is missing or from another
+    version the cache is empty
+    '''
+    self.path = path
+    self.tiles = {}
+    self.arrays = {}
+    pack = read_pack(path)
+    if pack is not None and pack[0].get('version') == SCENERY_VERSION:
+      self.tiles = pack[0]['tiles']
+      self.arrays = pack[1]
+
+  def __contains__(self, key):
+    return key in self.tiles
+
+  def hash(self, key):
+    return self.tiles[key]['hash'] if key in self.tiles else None
+
+  def grid(self, key):
+    '''heights of the map key as a (iy, ix) array, row 0 at the -z edge
+    '''
+    return self.arrays['{}/grid'.format(key)]
+
+  def load(self, key):
+    '''a new ElevationMap or MergeShape for the tile key using the memory
+    mapped arrays, with no textures or shader set
+    '''
+    t = self.tiles[key]
+    state = {'unif': t['unif'], 'children': [], 'name': key, 'textures': [],
+             'shader': None,
+             'buf': make_buffers(t, self.arrays, prefix='{}/'.format(key))}
+    if t['kind'] == 'map':
+      shape = pi3d.ElevationMap.__new__(pi3d.ElevationMap)
+      state.update(t['map'])
+      shape.__setstate__(state)
+      # dropOn() uses the pixels, which the pickles left out
+      shape.ht = shape.height / 255.0
+      shape.pixels = self.grid(key).T / shape.ht
+    else:
+      shape = pi3d.MergeShape.__new__(pi3d.MergeShape)
+      shape.__setstate__(state)
+    return shape
+
+  def arrays_for(self, key):
+    '''copies of the arrays of tile key, for writing into a new pack after
+    this one has been closed
+    '''
+    prefix = '{}/'.format(key)
+    return dict((k, np.array(v)) for k, v in self.arrays.items() if k.startswith(prefix))
+
+  def close(self):
+    '''forget the arrays so the file is unmapped (once any Shapes made by
+    load() have gone too) and can be replaced
+    '''
+    self.tiles = {}
+    self.arrays = {}
+
+def pack_tile(shape, kind, tile_hash, arrays):
+  '''add the arrays of shape to arrays and return its entry for the tiles
+  in the meta
+  '''
+  key = shape.name
+  t = {'kind': kind, 'hash': tile_hash, 'unif': list(shape.unif),
+       'buffers': pack_buffers(shape, arrays, '', '{}/'.format(key), False)}
+  if kind == 'map':
+    t['map'] = dict((k, getattr(shape, k)) for k in MAP_STATE)
+    v = shape.buf[0].array_buffer
+    arrays['{}/grid'.format(key)] = v[:, 1].reshape(shape.iy, shape.ix).astype(np.float32)
+  return t
+
+def tile_hashes(scene, fog):
+  '''dict of tile_hash() for every tile, maps first then clusters (the
+  order they have to be built in)
+  '''
+  hashes = OrderedDict()
+  for cluster in (False, True):
+    for key, s_item in scene.scenery_list.items():
+      if (s_item.put_on is not None) == cluster:
+        hashes[key] = tile_hash(scene, key, fog, hashes)
+  return hashes
+
+def make_tile(scene, key, fog, tile_hash, get_map, models):
+  '''build tile key, returns (shape, tile entry, arrays). get_map(key) has
+  to return the ElevationMap a cluster is put on, models is a dict of the
+  Models already loaded
+  '''
+  s_item = scene.scenery_list[key]
+  arrays = {}
+  if s_item.put_on is None:
+    div = getattr(scene, 'divisions', DIVISIONS)
+    shape = pi3d.ElevationMap(mapfile='{}/{}.png'.format(scene.path, key), name=key,
+                   width=(scene.msize + 0.001), depth=(scene.msize + 0.001),
+                   height=s_item.height, x=s_item.x, y=s_item.y, z=s_item.z,
+                   divx=div, divy=div)
+    shape.set_fog(*fog)
+    shape.set_alpha(s_item.alpha)
+    return shape, pack_tile(shape, 'map', tile_hash, arrays), arrays
+  md = s_item.model_details
+  if not md['model'] in models:
+    models[md['model']] = pi3d.Model(file_string='{}/{}.obj'.format(scene.path, md['model']))
+  shape = pi3d.MergeShape(name=key, x=s_item.x, z=s_item.z)
+  cluster(shape, models[md['model']], get_map(s_item.put_on), 0.0, 0.0,
+          md['w'], md['d'], md['n'], key, md['maxs'], md['mins'])
+  shape.set_fog(*fog)
+  return shape, pack_tile(shape, 'cluster', tile_hash, arrays), arrays
+
+def write(path, tiles, arrays):
+  write_pack(path, arrays, {'version': SCENERY_VERSION, 'tiles': tiles})
+
+def build(scene, fog=FOG, path=None, force=False):
+  '''bring the pack for scene up to date, as Scene.do_pickle() but only
+  the tiles whose sources have changed (or all of them if force) are
+  regenerated. Returns the list of keys rebuilt. scenery_prebuild.py does
+  the same using several processes
+  '''
+  path = path or os.path.join(scene.path, CACHE_FILE)
+  old = SceneryCache(path)
+  hashes = tile_hashes(scene, fog)
+  built = [key for key, h in hashes.items() if force or old.hash(key) != h]
+  if not built and set(old.tiles) == set(hashes):
+    return built
+  tiles, arrays, shapes, models = {}, {}, {}, {}
+  get_map = lambda k: shapes[k] if k in shapes else old.load(k)
+  for key, h in hashes.items():
+    if key not in built:
+      tiles[key] = old.tiles[key]
+      arrays.update(old.arrays_for(key))
+      continue
+    LOGGER.debug('building %s', key)
+    shape, tiles[key], a = make_tile(scene, key, fog, h, get_map, models)
+    arrays.update(a)
+    if scene.scenery_list[key].put_on is None:
+      shapes[key] = shape
+  old.close() # nothing still mapped when the new file replaces it
+  write(path, tiles, arrays)
+  return built
+
+class CachedScene(Scene):
+  map_key = 'map{}{}' # format()ed with the tile i, j to give the map under the camera
+  divisions = DIVISIONS # of each map, tiles from tile_pyramid.py have their own
+
+  def __init__(self, path, msize=1000.0, nx=5, nz=5, cache_file=None, fog=FOG):
+    '''Scene loading its tiles from a SceneryCache in a background thread
+    instead of the pickle files. Call build() once scenery_list is filled,
+    fog is used for tiles built without one being given
+    '''
+    super(CachedScene, self).__init__(path, msize, nx, nz)
+    self.fog = fog
+    self.cache_file = cache_file or os.path.join(path, CACHE_FILE)
+    self.cache = None
+    self.jobs = queue.Queue()
+    self.loader = threading.Thread(target=self._load_tiles)
+    self.loader.daemon = True
+    self.loader.start()
+
+  def build(self, fog=None, force=False):
+    '''make or update the pack then open it
+    '''
+    if self.cache is not None:
+      self.cache.close()
+      self.cache = None
+    built = build(self, fog or self.fog, self.cache_file, force)
+    if built:
+      LOGGER.info('rebuilt %d scenery tiles', len(built))
+    self.cache = SceneryCache(self.cache_file)
+    return built
+
+  def do_pickle(self, fog=None):
+    self.build(fog, force=True)
+
+  def check_scenery(self, xm, zm):
+    '''as Scene.check_scenery() but the tiles that come into range are
+    queued for this object's loader rather than the pickle one
+    '''
+    if self.cache is None:
+      self.build()
+    xsize = self.msize * self.nx
+    zsize = self.msize * self.nz
+    xm %= xsize
+    zm %= zsize
+    cmap_id = self.map_key.format(int(xm / self.msize), int(zm / self.msize))
+    self.draw_list = []
+    for key, s_item in self.scenery_list.items():
+      dx = s_item.x - xm
+      offsetx = -xsize if dx > xsize / 2.0 else xsize if dx < -xsize / 2.0 else 0.0
+      dz = s_item.z - zm
+      offsetz = -zsize if dz > zsize / 2.0 else zsize if dz < -zsize / 2.0 else 0.0
+      dx += offsetx
+      dz += offsetz
+      if (dx * dx + dz * dz) < s_item.threshold_sq:
+        if s_item.status == 0:
+          s_item.status = 1
+          self.jobs.put((key, offsetx, offsetz))
+        elif s_item.status == 2:
+          s_item.shape.position(s_item.x + offsetx, s_item.y, s_item.z + offsetz)
+          s_item.last_drawn = time.time()
+          self.draw_list.append(s_item)
+    self.draw_list = sorted(self.draw_list, key=self._key_draw_list)
+    cmap = self.scenery_list[cmap_id].shape
+    return xm, zm, cmap
+
+  def load_tile(self, key):
+    '''the Shape for key from the cache with its textures and shader set,
+    called on the loader thread so nothing is sent to the GPU yet
+    '''
+    s_item = self.scenery_list[key]
+    shape = self.cache.load(key)
+    t_list = [ASSETS.texture('{}/{}.png'.format(self.path, t), flip=s_item.texture_flip,
+                             mipmap=s_item.texture_mipmap) for t in s_item.textures]
+    if t_list:
+      shape.set_draw_details(s_item.shader, t_list, s_item.bump, s_item.shine)
+    else:
+      shape.set_shader(s_item.shader)
+    return shape
+
+  def _load_tiles(self):
+    while True:
+      key, offsetx, offsetz = self.jobs.get()
+      s_item = self.scenery_list[key]
+      shape = self.load_tile(key)
+      shape.position(s_item.x + offsetx, s_item.y, s_item.z + offsetz)
+      s_item.shape = shape
+      s_item.last_drawn = time.time()
+      s_item.status = 2
+
+if __name__ == '__main__':
+  # build the alpine tiles both ways then time loading them
+  import pickle, shutil, sys, tempfile
+  from pi3d.util.Scenery import SceneryItem
+  src = sys.argv[1] if len(sys.argv) > 1 else 'alpine'
+  tmp = tempfile.mkdtemp()
+  try:
+    for f in os.listdir(src):
+      if f.endswith('.png') or f.endswith('.obj') or f.endswith('.mtl'):
+        shutil.copy(os.path.join(src, f), tmp)
+    sc = Scene(tmp, 1000.0, 5, 5) # the maps and some of the clusters of alpine.py
+    for i in range(5):
+      for j in range(5):
+        for stem, y in (('rock_elev', 45.0), ('map', 0.0)):
+          sc.scenery_list['{}{}{}'.format(stem, i, j)] = SceneryItem((0.5 + i) * 1000.0, y,
+                (0.5 + j) * 1000.0, [], None, height=500.0, alpha=0.99)
+    for key, model, put_on, n in (('tree03', 'tree', 'map34', 40), ('barn06', 'barn2', 'map00', 16),
+                                  ('tree05', 'tree', 'map12', 40)):
+      s_item = sc.scenery_list[put_on]
+      sc.scenery_list[key] = SceneryItem(s_item.x, 0, s_item.z, [], None, put_on=put_on,
+              model_details={'model':model, 'w':400, 'd':400, 'n':n, 'maxs':5.0, 'mins':3.0})
+    keys = list(sc.scenery_list)
+    tm = time.time()
+    sc.do_pickle(FOG)
+    t_pickle = time.time() - tm
+    tm = time.time()
+    built = build(sc, FOG)
+    t_build = time.time() - tm
+    assert sorted(built) == sorted(keys)
+    tm = time.time()
+    assert build(sc, FOG) == [] # nothing changed
+    t_check = time.time() - tm
+    with open(os.path.join(tmp, 'map34.png'), 'ab') as f: # change one source
+      f.write(b'\0')
+    if os.path.isdir('/proc/self'): # the old pack isn't mapped when it's replaced
+      def unmapped_write(path, tiles, arrays, write=write):
+        with open('/proc/self/maps') as f:
+          assert not [m for m in f if path in m], 'old pack still mapped'
+        write(path, tiles, arrays)
+      write = unmapped_write
+    assert build(sc, FOG) == ['map34', 'tree03'] # and the cluster on it
+
+    def evict(paths):
+      '''ask the os to drop paths from the page cache so the next read
+      comes from the disk, returns False if it can't
+      '''
+      if not hasattr(os, 'posix_fadvise'):
+        return False
+      for p in paths:
+        fd = os.open(p, os.O_RDONLY)
+        try:
+          os.fsync(fd) # only clean pages are dropped
+          os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+          os.close(fd)
+      return True
+
+    def touch(shapes):
+      '''read every array, as uploading them for the first draw would, so
+      the lazy memory map isn't timed as free
+      '''
+      return sum(float(b.array_buffer.sum()) + float(b.element_array_buffer.sum())
+                 for shape in shapes.values() for b in shape.buf)
+
+    def load_pickles():
+      pickled = {}
+      for k in keys:
+        with open(os.path.join(tmp, '{}.pkl'.format(k)), 'rb') as f:
+          pickled[k] = pickle.load(f)
+      touch(pickled)
+      return pickled
+
+    def load_pack():
+      cache = SceneryCache(os.path.join(tmp, CACHE_FILE))
+      loaded = dict((k, cache.load(k)) for k in keys)
+      touch(loaded)
+      return loaded
+
+    pkl_files = [os.path.join(tmp, '{}.pkl'.format(k)) for k in keys]
+    pack_files = [os.path.join(tmp, CACHE_FILE)]
+    n = 10
+    times = {}
+    for temp in ('warm', 'cold'):
+      for name, load, files in (('pickle', load_pickles, pkl_files), ('pack', load_pack, pack_files)):
+        total = 0.0
+        for i in range(n):
+          if temp == 'cold' and not evict(files):
+            break
+          tm = time.time()
+          result = load()
+          total += time.time() - tm
+        else:
+          times[(temp, name)] = total / n
+        if temp == 'warm' and name == 'pickle':
+          pickled = result
+        elif temp == 'warm':
+          loaded = result
+    tm = time.time()
+    for i in range(n):
+      cache = SceneryCache(os.path.join(tmp, CACHE_FILE))
+    t_open = (time.time() - tm) / n
+    for k in keys:
+      a, b = pickled[k].buf[0].array_buffer, loaded[k].buf[0].array_buffer
+      if sc.scenery_list[k].put_on is None: # clusters are random each time
+        assert np.allclose(a, b)
+        for x, z in ((510.0, 430.0), (250.0, 900.0)):
+          x += pickled[k].unif[0] - 500.0
+          z += pickled[k].unif[2] - 500.0
+          assert abs(pickled[k].calcHeight(x, z) - loaded[k].calcHeight(x, z)) < 1e-4
+    size_pkl = sum(os.path.getsize(os.path.join(tmp, '{}.pkl'.format(k))) for k in keys)
+    size_pack = os.path.getsize(os.path.join(tmp, CACHE_FILE))
+    print('generate {:.2f}s pickling, {:.2f}s pack, {:.4f}s to check nothing changed'.format(
+          t_pickle, t_build, t_check))
+    print('open pack {:.5f}s, load {} tiles and read their arrays:'.format(t_open, len(keys)))
+    for temp in ('warm', 'cold'):
+      if (temp, 'pack') in times:
+        print('  {} page cache: pickle {:.4f}s, pack {:.4f}s'.format(temp,
+              times[(temp, 'pickle')], times[(temp, 'pack')]))
+    print('size: pickle {:.1f}kB, pack {:.1f}kB'.format(size_pkl / 1024.0, size_pack / 1024.0))
+  finally:
+    shutil.rmtree(tmp)
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Build the whole scenery cache (see scenery_cache.py) before the first
+run of a demo, using a pool of processes, so that nothing has to be
+generated while walking about. It doesn't need a display so can be run as
+part of installing, over ssh or on a faster machine (the pack file is the
+same on any platform):
+
+  python3 scenery_prebuild.py alpine
+  python3 scenery_prebuild.py alpine:make_scene --processes 4 --force
+
+The argument is module:function where function returns the Scene (default
+make_scene) and is called with no arguments. Tiles that are already up to
+date are left alone so running it again does nothing. The maps are built
+first, in parallel, and written to the pack so that the workers building
+the clusters can put them on the maps. The time for each tile is printed,
+slowest first.
+"""
+import argparse
+import importlib
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from scenery_cache import (CACHE_FILE, SceneryCache, make_tile, tile_hashes,
+                           write)
+
+LOGGER = logging.getLogger(__name__)
+
+SCENE_FUNCTION = 'make_scene'
+
+_WORKER = {} # scene, fog and models for each worker process
+
+def load_scene(spec):
+  '''call module:function from spec and return the Scene. A relative
+  Scene.path is taken as relative to the module file
+  '''
+  module, _, function = spec.partition(':')
+  mod = importlib.import_module(module)
+  scene = getattr(mod, function or SCENE_FUNCTION)()
+  if not os.path.isabs(scene.path):
+    scene.path = os.path.join(os.path.dirname(os.path.abspath(mod.__file__)), scene.path)
+  return scene
+
+def _init_worker(spec, fog):
+  _WORKER['scene'] = load_scene(spec)
+  _WORKER['fog'] = fog
+  _WORKER['models'] = {}
+
+def _build_tile(job):
+  '''run in a worker, returns (key, tile entry, arrays, seconds)
+  '''
+  key, tile_hash, path = job
+  tm = time.time()
+  cache = SceneryCache(path) # maps built so far, for clusters
+  _, tile, arrays = make_tile(_WORKER['scene'], key, _WORKER['fog'], tile_hash,
+                              cache.load, _WORKER['models'])
+  return key, tile, arrays, time.time() - tm
+
+def prebuild(spec, path=None, fog=None, processes=None, force=False):
+  '''bring the cache for the scene from spec up to date. Returns a dict of
+  the seconds taken to build each tile that needed it
+  '''
+  scene = load_scene(spec)
+  fog = fog or getattr(scene, 'fog', None)
+  path = path or os.path.join(scene.path, CACHE_FILE)
+  hashes = tile_hashes(scene, fog)
+  old = SceneryCache(path)
+  tiles, arrays = {}, {}
+  maps, clusters, kept = [], [], []
+  for key, h in hashes.items():
+    if not force and old.hash(key) == h:
+      kept.append(key)
+    elif scene.scenery_list[key].put_on is None:
+      maps.append(key)
+    else:
+      clusters.append(key)
+  if not (maps or clusters) and set(old.tiles) == set(kept):
+    return {}
+  for key in kept:
+    tiles[key] = old.tiles[key]
+    arrays.update(old.arrays_for(key))
+  old.close() # nothing still mapped when write() replaces the file
+  times = {}
+  if maps or clusters:
+    pool = multiprocessing.Pool(processes, _init_worker, (spec, fog))
+    try:
+      for phase in (maps, clusters):
+        jobs = [(key, hashes[key], path) for key in phase]
+        for key, tile, a, seconds in pool.imap_unordered(_build_tile, jobs):
+          tiles[key] = tile
+          arrays.update(a)
+          times[key] = seconds
+          LOGGER.info('%s %.2fs', key, seconds)
+        if phase:
+          write(path, tiles, arrays) # so the clusters can use the maps
+    finally:
+      pool.close()
+      pool.join()
+  else: # only removals
+    write(path, tiles, arrays)
+  return times
+
+if __name__ == '__main__':
+  parse = argparse.ArgumentParser(description="build the scenery cache ahead of time")
+  parse.add_argument("scene", help="module:function returning the Scene, function defaults to make_scene")
+  parse.add_argument("-o", "--output", default=None, help="pack file, defaults to scenery.p3s in the scenery directory")
+  parse.add_argument("-p", "--processes", default=None, type=int, help="worker processes, defaults to the number of cpus")
+  parse.add_argument("-f", "--force", action="store_true", help="rebuild every tile")
+  parse.add_argument("-v", "--verbose", action="store_true")
+  args = parse.parse_args()
+  logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+  sys.path.insert(0, os.getcwd())
+  tm = time.time()
+  times = prebuild(args.scene, args.output, processes=args.processes, force=args.force)
+  wall = time.time() - tm
+  if not times:
+    print('all tiles up to date ({:.2f}s to check)'.format(wall))
+  else:
+    for key in sorted(times, key=times.get, reverse=True):
+      print('  {:16s} {:7.3f}s'.format(key, times[key]))
+    total = sum(times.values())
+    print('built {} tiles in {:.2f}s using {} processes, {:.2f}s of work ({:.1f}x)'.format(
+          len(times), wall, args.processes or multiprocessing.cpu_count(), total,
+          total / max(wall, 1e-6)))
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Predictive loading for scenery tiles. Scene.check_scenery() only starts
+loading a tile once the camera is inside its threshold, so moving quickly
+the tile isn't there when it should be drawn (pop-in) and the first draw of
+it sends everything to the GPU in the middle of a frame.
+
+StreamingScene estimates the camera velocity from the positions passed to
+check_scenery() and works out, for each tile, how long it will be before
+the camera is inside its threshold: along the current heading, or by
+turning round (TURN_TM) if that is sooner. Tiles due within LOOKAHEAD
+seconds are loaded in that order by the background thread, which only
+reads the cache and image files. The main thread then uploads at most
+max_uploads of the loaded tiles to the GPU each frame, soonest first, so
+the cost is spread out. Tiles that are inside their threshold but not yet
+drawable are counted as pop-in events along with how long they were
+missing, see stats():
+
+  from scenery_stream import StreamingScene as Scene
+
+python3 scenery_stream.py walks a fast straight and turning path over a
+5x5 tile scene with a slow loader and compares the pop-in with loading
+only on entry (lookahead 0).
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+from scenery_cache import CachedScene, FOG
+
+LOGGER = logging.getLogger(__name__)
+
+LOOKAHEAD = 5.0 # seconds ahead to load tiles
+TURN_TM = 3.0 # seconds allowed for turning round to head towards a tile
+MAX_UPLOADS = 1 # tiles sent to the GPU each frame
+MIN_SPEED = 1.0 # units per second, below this the camera counts as still
+SMOOTH = 0.3 # weight of the newest velocity estimate
+MAX_STEP = 2.0 # seconds between calls over which velocity isn't estimated
+
+def time_to_enter(dx, dz, vx, vz, radius):
+  '''seconds until a point moving at vx, vz comes within radius of points
+  dx, dz away (arrays), 0.0 if already there and inf if the straight line
+  misses
+  '''
+  d2 = dx * dx + dz * dz
+  r2 = radius * radius
+  a = vx * vx + vz * vz
+  b = vx * dx + vz * dz # > 0 if heading towards
+  disc = b * b - a * (d2 - r2)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    t = np.where((disc >= 0.0) & (b > 0.0) & (a > 0.0),
+                 (b - np.sqrt(np.maximum(disc, 0.0))) / a, np.inf)
+  return np.where(d2 <= r2, 0.0, t)
+
+def upload(shape):
+  '''send the Buffers and textures of shape to the GPU, main thread only
+  '''
+  for b in shape.buf:
+    b.load_opengl()
+    for t in b.textures:
+      t.load_opengl()
+
+class StreamingScene(CachedScene):
+  def __init__(self, path, msize=1000.0, nx=5, nz=5, cache_file=None, fog=FOG,
+               lookahead=LOOKAHEAD, max_uploads=MAX_UPLOADS, upload=upload):
+    '''CachedScene that loads tiles before they are needed. upload(shape)
+    is called on the main thread before a tile is first drawn
+    '''
+    self.lookahead = lookahead
+    self.max_uploads = max_uploads
+    self.upload = upload
+    self.lock = threading.Condition()
+    self.order = [] # keys to load, soonest first
+    self.ready = {} # key: shape loaded but not uploaded
+    self.loading = None
+    self.missing = {} # key: time it should have been drawn from
+    self.vx, self.vz = 0.0, 0.0
+    self.last = None # (x, z, tm) of the last check
+    self.keys = None # arrays of the tiles, made on the first check
+    self.reset_stats()
+    super(StreamingScene, self).__init__(path, msize, nx, nz, cache_file, fog)
+
+  def reset_stats(self):
+    self.popins = 0 # tiles that were late
+    self.popin_time = 0.0 # total seconds they were late
+    self.popin_max = 0.0
+    self.loads = 0
+    self.uploads = 0
+    self.upload_time = 0.0
+    self.upload_max = 0.0 # longest time in one frame
+    self.frames = 0
+
+  def stats(self):
+    return {'frames': self.frames, 'loads': self.loads, 'uploads': self.uploads,
+            'popins': self.popins, 'popin_time': self.popin_time,
+            'popin_max': self.popin_max, 'upload_time': self.upload_time,
+            'upload_max': self.upload_max}
+
+  def _tile_arrays(self):
+    self.keys = list(self.scenery_list)
+    self.index = dict((k, i) for i, k in enumerate(self.keys))
+    items = [self.scenery_list[k] for k in self.keys]
+    self.tx = np.array([s.x for s in items], dtype=float)
+    self.tz = np.array([s.z for s in items], dtype=float)
+    self.radius = np.array([s.threshold for s in items], dtype=float)
+
+  def _velocity(self, xm, zm, tm, xsize, zsize):
+    if self.last is not None:
+      dt = tm - self.last[2]
+      if 0.0 < dt < MAX_STEP:
+        dx = (xm - self.last[0] + xsize / 2.0) % xsize - xsize / 2.0 # across the wrap
+        dz = (zm - self.last[1] + zsize / 2.0) % zsize - zsize / 2.0
+        self.vx += (dx / dt - self.vx) * SMOOTH
+        self.vz += (dz / dt - self.vz) * SMOOTH
+      elif dt >= MAX_STEP:
+        self.vx, self.vz = 0.0, 0.0
+    self.last = (xm, zm, tm)
+
+  def eta(self, xm, zm):
+    '''(seconds until each tile is needed, x offset, z offset) as arrays in
+    the order of self.keys. The offsets are for tiles seen across the wrap
+    '''
+    xsize = self.msize * self.nx
+    zsize = self.msize * self.nz
+    dx = self.tx - xm
+    offsetx = np.where(dx > xsize / 2.0, -xsize, np.where(dx < -xsize / 2.0, xsize, 0.0))
+    dz = self.tz - zm
+    offsetz = np.where(dz > zsize / 2.0, -zsize, np.where(dz < -zsize / 2.0, zsize, 0.0))
+    dx += offsetx
+    dz += offsetz
+    eta = time_to_enter(dx, dz, self.vx, self.vz, self.radius)
+    speed = max(np.hypot(self.vx, self.vz), MIN_SPEED)
+    turn = (np.hypot(dx, dz) - self.radius) / speed + TURN_TM
+    return np.minimum(eta, turn), offsetx, offsetz
+
+  def check_scenery(self, xm, zm, tm=None):
+    '''as Scene.check_scenery(), called each frame
+    '''
+    tm = tm or time.time()
+    if self.cache is None:
+      self.build()
+    if self.keys is None:
+      self._tile_arrays()
+    xsize = self.msize * self.nx
+    zsize = self.msize * self.nz
+    xm %= xsize
+    zm %= zsize
+    self._velocity(xm, zm, tm, xsize, zsize)
+    eta, offsetx, offsetz = self.eta(xm, zm)
+    self.frames += 1
+
+    # queue the tiles due soon, forget queued ones no longer wanted
+    order = [i for i in np.argsort(eta) if eta[i] <= self.lookahead]
+    with self.lock:
+      for key in self.order:
+        self.scenery_list[key].status = 0
+      self.order = []
+      for i in order:
+        s_item = self.scenery_list[self.keys[i]]
+        if s_item.status == 0 and self.keys[i] != self.loading:
+          s_item.status = 1
+          self.order.append(self.keys[i])
+      if self.order:
+        self.lock.notify()
+      ready = self.ready
+      uploads = sorted(ready, key=lambda k: eta[self.index[k]])[:self.max_uploads]
+      shapes = [(k, ready.pop(k)) for k in uploads]
+
+    # upload a few each frame, the soonest needed first
+    t_up = time.time()
+    for key, shape in shapes:
+      self.upload(shape)
+      s_item = self.scenery_list[key]
+      s_item.shape = shape
+      s_item.status = 2
+      s_item.last_drawn = tm
+      self.uploads += 1
+      if key in self.missing:
+        late = tm - self.missing.pop(key)
+        self.popins += 1
+        self.popin_time += late
+        self.popin_max = max(self.popin_max, late)
+    t_up = time.time() - t_up
+    self.upload_time += t_up
+    self.upload_max = max(self.upload_max, t_up)
+
+    cmap_id = self.map_key.format(int(xm / self.msize), int(zm / self.msize))
+    self.draw_list = []
+    for i in np.nonzero(eta == 0.0)[0]: # inside the threshold
+      key = self.keys[i]
+      s_item = self.scenery_list[key]
+      if s_item.status == 2:
+        s_item.shape.position(s_item.x + offsetx[i], s_item.y, s_item.z + offsetz[i])
+        s_item.last_drawn = tm
+        self.draw_list.append(s_item)
+      elif not key in self.missing:
+        self.missing[key] = tm
+    for key in list(self.missing): # left again before it arrived
+      if eta[self.index[key]] > 0.0:
+        del self.missing[key]
+    self.draw_list = sorted(self.draw_list, key=self._key_draw_list)
+    cmap = self.scenery_list[cmap_id].shape
+    return xm, zm, cmap
+
+  def clear_scenery(self, threshold):
+    '''as Scene.clear_scenery() but only drawable tiles are cleared, not
+    ones on their way
+    '''
+    with self.lock:
+      for key in sorted(self.scenery_list, key=self._key_age_list, reverse=True)[:-30]:
+        s_item = self.scenery_list[key]
+        if s_item.status == 2 and s_item.last_drawn < threshold:
+          s_item.status = 0
+          s_item.shape = None
+
+  def _load_tiles(self):
+    while True:
+      with self.lock:
+        while not self.order:
+          self.lock.wait()
+        key = self.order.pop(0)
+        self.loading = key
+      try:
+        shape = self.load_tile(key)
+      except Exception as e:
+        LOGGER.error('unable to load %s: %s', key, e)
+        with self.lock:
+          self.loading = None
+          self.scenery_list[key].status = 0
+        continue
+      with self.lock:
+        self.ready[key] = shape
+        self.loading = None
+        self.loads += 1
+
+if __name__ == '__main__':
+  # the alpine maps with a loader as slow as a Pi reading pickles
+  import os, shutil, sys, tempfile
+  from pi3d.util.Scenery import SceneryItem
+  LOAD_TM = 0.25 # seconds per tile
+  SPEED = 150.0 # units per second, flat out on the skidoo
+  FPS = 30.0
+  RUN_TM = 12.0
+
+  class SlowScene(StreamingScene):
+    def load_tile(self, key):
+      time.sleep(LOAD_TM)
+      return StreamingScene.load_tile(self, key)
+
+  src = sys.argv[1] if len(sys.argv) > 1 else 'alpine'
+  tmp = tempfile.mkdtemp()
+  try:
+    for f in os.listdir(src):
+      if f.endswith('.png'):
+        shutil.copy(os.path.join(src, f), tmp)
+    results = []
+    for lookahead in (0.0, LOOKAHEAD):
+      sc = SlowScene(tmp, 1000.0, 5, 5, lookahead=lookahead, upload=lambda shape: None)
+      for i in range(5):
+        for j in range(5):
+          sc.scenery_list['rock_elev{}{}'.format(i, j)] = SceneryItem((0.5 + i) * 1000.0, 45.0,
+                (0.5 + j) * 1000.0, [], None, height=500.0, threshold=1500.0)
+          sc.scenery_list['map{}{}'.format(i, j)] = SceneryItem((0.5 + i) * 1000.0, 0.0,
+                (0.5 + j) * 1000.0, [], None, height=500.0, threshold=950.0)
+      sc.build()
+      x, z, heading = 500.0, 500.0, 45.0
+      while True: # wait for the tiles round the start, as a game would
+        sc.check_scenery(x, z)
+        if not sc.missing and not sc.order and not sc.ready and sc.loading is None:
+          break
+        time.sleep(1.0 / FPS)
+      sc.reset_stats()
+      tm = time.time()
+      t0 = tm
+      while tm < t0 + RUN_TM:
+        if tm > t0 + RUN_TM / 2.0: # straight then a wide turn
+          heading += 20.0 / FPS
+        x += SPEED * np.sin(np.radians(heading)) / FPS
+        z += SPEED * np.cos(np.radians(heading)) / FPS
+        x, z, cmap = sc.check_scenery(x, z, tm)
+        time.sleep(max(0.0, tm + 1.0 / FPS - time.time()))
+        tm = time.time()
+      results.append((lookahead, sc.stats()))
+    for lookahead, s in results:
+      print('lookahead {:.1f}s: {} loads, {} uploads, {} pop-ins missing {:.2f}s in all '
+            '(worst {:.2f}s)'.format(lookahead, s['loads'], s['uploads'], s['popins'],
+            s['popin_time'], s['popin_max']))
+  finally:
+    shutil.rmtree(tmp)
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Pairs of points near each other without comparing every point with
+every other. SpriteBalls.py and SpriteMulti.py find the balls touching by
+making N x N arrays of the x and y differences, which is fine for a
+hundred or two but needs 20GB for 50000.
+
+SpatialHash puts each point (2D or 3D) in a cell of a uniform grid, cells
+cell_size across, and hashes the cells into a table about twice as long
+as the number of points, so the grid can be any size. build() counts the
+points in each bucket (bincount then cumsum gives where each bucket starts
+in the sorted order) then pairs() looks in the cell of each point and
+half of the cells round it, so each pair is found once, for all the
+points at once with numpy. Points in other cells that happen to share a
+bucket are left out. The time and memory go up with the number of points
+and their neighbours rather than its square:
+
+  grid = SpatialHash(cell_size=2.0 * max_radius)
+  grid.build(loc[:, 0:2])
+  i, j = grid.pairs(radius=2.0 * max_radius) # i < j, closer than radius
+  # or grid.pairs() for everything in neighbouring cells, to test yourself
+
+The pairs come back sorted by i then j, the same order np.where() gives
+for the upper triangle of a distance matrix.
+
+python3 spatial_hash.py checks the pairs against brute force distances
+and compares the times for 1000 to 50000 points.
+"""
+import itertools
+import logging
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+HASH_PRIMES = (73856093, 19349663, 83492791) # Teschner et al. spatial hash
+TABLE_FACTOR = 2 # buckets per point
+
+def cell_hash(cells, size):
+  '''bucket in a table of size for integer cell coordinates (n, d)
+  '''
+  h = np.zeros(len(cells), dtype=np.int64)
+  for k in range(cells.shape[1]):
+    h ^= cells[:, k] * HASH_PRIMES[k]
+  return h % size
+
+def half_shell(dims):
+  '''offsets of the neighbouring cells with the first non zero coordinate
+  positive, i.e. half of them, so each pair of cells is visited once
+  '''
+  return [o for o in itertools.product((-1, 0, 1), repeat=dims)
+          if any(o) and next(v for v in o if v != 0) > 0]
+
+class SpatialHash(object):
+  def __init__(self, cell_size, table_size=None):
+    '''grid of cells cell_size across. pairs(radius) finds everything
+    closer than radius as long as radius is no more than cell_size.
+    table_size defaults to TABLE_FACTOR times the number of points
+    '''
+    self.cell_size = float(cell_size)
+    self.table_size = table_size
+    self.pos = None
+
+  def build(self, pos):
+    '''sort the points pos (n, 2) or (n, 3) into their buckets, each frame
+    after they've moved
+    '''
+    self.pos = np.asarray(pos)
+    n, dims = self.pos.shape
+    self.size = self.table_size or max(1, TABLE_FACTOR * n)
+    self.cells = np.floor(self.pos / self.cell_size).astype(np.int64)
+    self.keys = cell_hash(self.cells, self.size)
+    self.order = np.argsort(self.keys, kind='stable') # points bucket by bucket
+    self.counts = np.bincount(self.keys, minlength=self.size)
+    self.starts = np.cumsum(self.counts) - self.counts
+    self.offsets = half_shell(dims)
+
+  def _candidates(self, offset):
+    '''(i, j) for every point i and every point j in the cell at offset
+    from the cell of i
+    '''
+    cells = self.cells + offset
+    keys = cell_hash(cells, self.size)
+    n_each = self.counts[keys]
+    total = int(n_each.sum())
+    if total == 0:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    i = np.repeat(np.arange(len(cells)), n_each)
+    first = np.cumsum(n_each) - n_each
+    within = np.arange(total) - np.repeat(first, n_each)
+    j = self.order[np.repeat(self.starts[keys], n_each) + within]
+    same = np.all(self.cells[j] == cells[i], axis=1) # not another cell sharing the bucket
+    return i[same], j[same]
+
+  def pairs(self, radius=None):
+    '''arrays i, j (i < j) of the pairs of points in the same or touching
+    cells or, if radius is given, only those closer than radius
+    '''
+    i, j = self._candidates(np.zeros(self.cells.shape[1], dtype=np.int64))
+    keep = i < j
+    found = [(i[keep], j[keep])]
+    for o in self.offsets:
+      found.append(self._candidates(np.array(o, dtype=np.int64)))
+    i = np.concatenate([f[0] for f in found])
+    j = np.concatenate([f[1] for f in found])
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    if radius is not None:
+      d = self.pos[i] - self.pos[j]
+      near = (d * d).sum(axis=1) < radius * radius
+      i, j = i[near], j[near]
+    o = np.lexsort((j, i))
+    return i[o], j[o]
+
+if __name__ == '__main__':
+  import time
+  BLOCK = 1024 # rows of the distance matrix at a time for brute force
+  NEIGHBOURS = 4.0 # average points within the radius of each
+
+  def brute_force(pos, radius):
+    '''pairs closer than radius from the distance matrix, a block of rows
+    at a time so 50000 points fit in memory
+    '''
+    found_i, found_j = [], []
+    for start in range(0, len(pos), BLOCK):
+      d = ((pos[start:(start + BLOCK), np.newaxis] - pos[np.newaxis]) ** 2).sum(axis=2)
+      i, j = np.nonzero(d < radius * radius)
+      i += start
+      keep = i < j
+      found_i.append(i[keep])
+      found_j.append(j[keep])
+    return np.concatenate(found_i), np.concatenate(found_j)
+
+  rng = np.random.RandomState(2)
+  radius = 1.0
+  for dims in (2, 3):
+    for n in (1000, 5000, 20000, 50000):
+      # box sized for about NEIGHBOURS points within radius of each
+      vol = n * (np.pi if dims == 2 else 4.0 / 3.0 * np.pi) * radius ** dims / NEIGHBOURS
+      pos = rng.uniform(0.0, vol ** (1.0 / dims), (n, dims)) - 100.0 # some negative cells
+      tm = time.time()
+      grid = SpatialHash(radius)
+      grid.build(pos)
+      i, j = grid.pairs(radius)
+      t_hash = time.time() - tm
+      tm = time.time()
+      bi, bj = brute_force(pos, radius)
+      t_brute = time.time() - tm
+      o = np.lexsort((bj, bi))
+      same = np.array_equal(i, bi[o]) and np.array_equal(j, bj[o])
+      print('{}D {:6d} points: {:6d} pairs, hash {:7.1f}ms, brute force {:8.1f}ms {:6.1f}x, '
+            'same pairs {}'.format(dims, n, len(i), t_hash * 1000.0, t_brute * 1000.0,
+            t_brute / max(t_hash, 1e-9), same))
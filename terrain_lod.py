@@ -0,0 +1,244 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Terrain drawn with fewer triangles further from the camera
+(geomipmapping). ElevationMap draws every square of its grid however far
+away it is, so a map detailed enough to walk on spends most of its
+triangles on hills in the distance, and it can't be more than 199x199.
+
+TerrainLOD reads the same height map images, bigger if wanted, and splits
+the map into patches of PATCH x PATCH squares. Each frame update() gives
+every patch a step of 1, 2, 4 .. PATCH squares depending on how far it is
+from the camera. Where a patch meets one drawn with a bigger step its
+edge vertices are moved onto those of the coarser patch, so there are no
+cracks along the seams. The triangle lists for each step and set of edge
+steps are the same for every patch so are only made once, the Buffers for
+each patch are kept as they're made, up to a limit:
+
+  mymap = TerrainLOD("textures/mountainsHgt2.png", width=1000.0, depth=1000.0,
+                     height=60.0, patch=16)
+  mymap.set_draw_details(shader, [tex, bump], 128.0, 0.0)
+  ...
+  mymap.update(CAMERA.eye)
+  mymap.draw()
+
+set_draw_details() etc. are passed on to the Buffers made later. Use an
+ElevationMap, or terrain_query, for calcHeight() as before.
+
+python3 terrain_lod.py flies a scripted path over the mountains map and
+counts the triangles submitted against drawing it all, and checks that
+neighbouring patches always share their edge vertices.
+"""
+import logging
+import math
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import pi3d
+from tile_pyramid import elevation_grid
+
+LOGGER = logging.getLogger(__name__)
+
+PATCH = 16 # squares along a patch side, a power of two
+LOD_DISTANCE = 1.5 # patch widths from the camera before the step doubles
+MAX_BUFFERS = 4 # per patch kept for when they're needed again
+
+def snap(k, e):
+  '''grid positions k moved to the nearest multiple of e
+  '''
+  return (k + e // 2) // e * e
+
+def patch_faces(n, step, edges):
+  '''triangle indices for a patch of (n + 1) x (n + 1) vertices, row (z)
+  by column (x), drawn with step. edges is the step along the -x, +x, -z
+  and +z sides, at least step, to match the neighbours
+  '''
+  r, c = np.mgrid[0:n:step, 0:n:step]
+  r, c = r.ravel(), c.ravel()
+  # corners of each square then two triangles as ElevationMap
+  sq = [(r, c), (r + step, c), (r + step, c + step), (r, c + step)]
+  tris = [(sq[0], sq[1], sq[2]), (sq[2], sq[3], sq[0])]
+  faces = []
+  for tri in tris:
+    corners = []
+    for vr, vc in tri:
+      vr, vc = vr.copy(), vc.copy()
+      for side, e in zip(('-x', '+x', '-z', '+z'), edges):
+        if e <= step:
+          continue
+        if side == '-x':
+          on = vc == 0
+          vr[on] = snap(vr[on], e)
+        elif side == '+x':
+          on = vc == n
+          vr[on] = snap(vr[on], e)
+        elif side == '-z':
+          on = vr == 0
+          vc[on] = snap(vc[on], e)
+        else:
+          on = vr == n
+          vc[on] = snap(vc[on], e)
+      corners.append(vr * (n + 1) + vc)
+    faces.append(np.stack(corners, axis=1))
+  faces = np.concatenate(faces)
+  keep = ((faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) &
+          (faces[:, 2] != faces[:, 0])) # squashed onto the coarse edge
+  return faces[keep]
+
+class TerrainLOD(pi3d.Shape):
+  def __init__(self, mapfile, camera=None, light=None, width=100.0, depth=100.0,
+               height=10.0, patch=PATCH, lod_distance=None, ntiles=1.0, name="",
+               x=0.0, y=0.0, z=0.0, max_buffers=None):
+    '''height map as ElevationMap (without rotation or scale) drawn in
+    patches of patch x patch squares. The image is resized to a whole
+    number of patches if need be. lod_distance is how far from a patch the
+    camera can be before its step doubles, default LOD_DISTANCE patches.
+    The Buffers used least recently are dropped beyond max_buffers,
+    default MAX_BUFFERS for each patch
+    '''
+    super(TerrainLOD, self).__init__(camera, light, name, x, y, z, 0.0, 0.0, 0.0,
+                                     1.0, 1.0, 1.0, 0.0, 0.0, 0.0)
+    im = mapfile if isinstance(mapfile, Image.Image) else Image.open(mapfile)
+    w, h = im.size
+    self.npx = max(1, int(round((w - 1) / patch)))
+    self.npz = max(1, int(round((h - 1) / patch)))
+    grid = elevation_grid(im, self.npx, self.npz, patch)[::-1, ::-1] # as ElevationMap
+    self.patch = patch
+    self.lods = int(math.log(patch, 2)) + 1
+    self.width, self.depth, self.height = width, depth, height
+    self.iy, self.ix = grid.shape
+    self.wh, self.hh = width * 0.5, depth * 0.5
+    self.ws, self.hs = width / (self.ix - 1.0), depth / (self.iy - 1.0)
+    self.ht = height / 255.0
+    self.lod_distance = lod_distance or LOD_DISTANCE * patch * self.ws
+    hts = grid * self.ht
+    zs, xs = np.mgrid[0:self.iy, 0:self.ix]
+    self.verts = np.stack([-self.wh + xs * self.ws, hts, -self.hh + zs * self.hs], axis=2)
+    self.tex = np.stack([(self.ix - xs) * ntiles / self.ix, (self.iy - zs) * ntiles / self.iy],
+                        axis=2)
+    dz, dx = np.gradient(hts, self.hs, self.ws)
+    norms = np.stack([-dx, np.ones_like(dx), -dz], axis=2)
+    self.norms = norms / np.linalg.norm(norms, axis=2)[:, :, np.newaxis]
+    # height range of each patch for choosing its step
+    self.pmin = np.zeros((self.npz, self.npx))
+    self.pmax = np.zeros((self.npz, self.npx))
+    for pz in range(self.npz):
+      for px in range(self.npx):
+        h = hts[(pz * patch):(pz * patch + patch + 1), (px * patch):(px * patch + patch + 1)]
+        self.pmin[pz, px], self.pmax[pz, px] = h.min(), h.max()
+    self.faces = {} # (step, edges): faces
+    self.buffers = OrderedDict() # (pz, px, step, edges): Buffer, least recently used first
+    self.max_buffers = max_buffers or MAX_BUFFERS * self.npx * self.npz
+    self.made = 0 # Buffers made altogether
+    self.steps = np.full((self.npz, self.npx), patch, dtype=int)
+    self.triangles = 0 # submitted by the last update()
+    self.full_triangles = 2 * (self.ix - 1) * (self.iy - 1)
+    self.buf = self._choose()
+
+  def _faces(self, step, edges):
+    key = (step, edges)
+    if not key in self.faces:
+      self.faces[key] = patch_faces(self.patch, step, edges)
+    return self.faces[key]
+
+  def _buffer(self, pz, px, step, edges):
+    key = (pz, px, step, edges)
+    b = self.buffers.pop(key, None)
+    if b is None:
+      p = self.patch
+      sl = (slice(pz * p, pz * p + p + 1), slice(px * p, px * p + p + 1))
+      b = pi3d.Buffer(self, self.verts[sl].reshape(-1, 3), self.tex[sl].reshape(-1, 2),
+                      self._faces(step, edges), self.norms[sl].reshape(-1, 3))
+      self.made += 1
+    self.buffers[key] = b # to the end
+    while len(self.buffers) > self.max_buffers:
+      self.buffers.popitem(last=False)
+    return b
+
+  def _choose(self):
+    '''the Buffers for self.steps, each edge matching the coarser side
+    '''
+    s = np.pad(self.steps, 1, mode='edge')
+    inner = s[1:-1, 1:-1]
+    xm = np.maximum(inner, s[1:-1, :-2])
+    xp = np.maximum(inner, s[1:-1, 2:])
+    zm = np.maximum(inner, s[:-2, 1:-1])
+    zp = np.maximum(inner, s[2:, 1:-1])
+    bufs = []
+    for pz in range(self.npz):
+      for px in range(self.npx):
+        bufs.append(self._buffer(pz, px, int(inner[pz, px]), (int(xm[pz, px]),
+                    int(xp[pz, px]), int(zm[pz, px]), int(zp[pz, px]))))
+    self.triangles = sum(b.ntris for b in bufs)
+    return bufs
+
+  def choose_steps(self, cx, cy, cz):
+    '''array (npz, npx) of the step for each patch with the camera at cx,
+    cy, cz in world coordinates
+    '''
+    cx, cy, cz = cx - self.unif[0], cy - self.unif[1], cz - self.unif[2]
+    pw, pd = self.patch * self.ws, self.patch * self.hs
+    x0 = -self.wh + np.arange(self.npx) * pw
+    z0 = -self.hh + np.arange(self.npz) * pd
+    dx = np.maximum(np.maximum(x0 - cx, cx - x0 - pw), 0.0)[np.newaxis, :]
+    dz = np.maximum(np.maximum(z0 - cz, cz - z0 - pd), 0.0)[:, np.newaxis]
+    dy = np.maximum(np.maximum(self.pmin - cy, cy - self.pmax), 0.0)
+    dist = np.sqrt(dx * dx + dy * dy + dz * dz) # to the box round the patch
+    lod = np.floor(np.log2(1.0 + dist / self.lod_distance)).astype(int)
+    return 1 << np.clip(lod, 0, self.lods - 1)
+
+  def update(self, position):
+    '''pick the Buffers to draw for the camera at position (x, y, z) e.g.
+    Camera.eye. Returns the number of triangles
+    '''
+    steps = self.choose_steps(*position[0:3])
+    if not np.array_equal(steps, self.steps):
+      old = self.buf[0]
+      self.steps = steps
+      self.buf = self._choose()
+      for b in self.buf:
+        if b is not old: # keep the draw details set on the Shape
+          b.shader, b.textures, b.material = old.shader, old.textures, old.material
+          b.unib[:] = old.unib[:]
+    return self.triangles
+
+if __name__ == '__main__':
+  import time
+  # a path over the map: straight across low down then a climbing circle
+  mymap = TerrainLOD("textures/mountainsHgt2.png", width=1000.0, depth=1000.0,
+                     height=60.0, patch=PATCH)
+  print('{}x{} vertices, {}x{} patches of {}, {} triangles at full detail'.format(
+        mymap.ix, mymap.iy, mymap.npx, mymap.npz, mymap.patch, mymap.full_triangles))
+  path = [(-480.0 + i * 4.0, 40.0, -300.0 + i * 2.0) for i in range(240)]
+  path += [(300.0 * math.cos(a), 40.0 + 100.0 * a / (2.0 * math.pi), 300.0 * math.sin(a))
+           for a in np.linspace(0.0, 2.0 * math.pi, 240)]
+  tris = []
+  cracks = 0
+  t_update = 0.0
+  for pos in path:
+    tm = time.time()
+    tris.append(mymap.update(pos))
+    t_update += time.time() - tm
+    # neighbours have to use the same vertices along their shared edge
+    p = mymap.patch
+    for pz in range(mymap.npz):
+      for px in range(mymap.npx):
+        b = mymap.buf[pz * mymap.npx + px]
+        used = np.unique(b.element_array_buffer)
+        r, c = used // (p + 1), used % (p + 1)
+        if px + 1 < mymap.npx: # +x edge against the -x edge of the next
+          nb = mymap.buf[pz * mymap.npx + px + 1]
+          nused = np.unique(nb.element_array_buffer)
+          cracks += not np.array_equal(r[c == p], nused[nused % (p + 1) == 0] // (p + 1))
+        if pz + 1 < mymap.npz: # +z edge against the -z edge of the next
+          nb = mymap.buf[(pz + 1) * mymap.npx + px]
+          nused = np.unique(nb.element_array_buffer)
+          cracks += not np.array_equal(c[r == p], nused[nused < p + 1])
+  tris = np.array(tris)
+  print('{} frames: {:.0f} triangles a frame on average ({:.1f}% of full), min {} max {}'.format(
+        len(path), tris.mean(), 100.0 * tris.mean() / mymap.full_triangles, tris.min(), tris.max()))
+  print('{} triangle lists, {} Buffers made ({} kept), {} seams not matching, update() '
+        '{:.2f}ms a frame'.format(len(mymap.faces), mymap.made, len(mymap.buffers), cracks,
+        1000.0 * t_update / len(path)))
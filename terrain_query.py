@@ -0,0 +1,152 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" ElevationMap.calcHeight() for arrays of points. calcHeight() works out
+one point at a time so placing a thousand trees, or a tank and all its
+shells, means a python loop doing the barycentric sums over and over.
+TerrainQuery does the same sums for all the points at once using numpy,
+with the plane of each face worked out only when it's made:
+
+  q = terrain_query.query(mymap) # kept for the map
+  ys = q.heights(xs, zs)
+  ys, normals = q.heights(xs, zs, inc_normal=True)
+  pitch, roll = q.pitch_roll(xs, zs)
+
+The results are the same as calcHeight() (regular maps), including points
+off the map which, as there, use the plane of the first face. cluster() is
+MergeShape.cluster() with the heights done this way, the random numbers
+are drawn in the same order so the same seed gives the same trees.
+
+python3 terrain_query.py compares it with calcHeight() for 10, 1000 and
+100000 points.
+"""
+import random
+import weakref
+
+import numpy as np
+
+_QUERIES = weakref.WeakKeyDictionary() # ElevationMap: TerrainQuery
+
+class TerrainQuery(object):
+  def __init__(self, emap):
+    '''heights and normals of the regular ElevationMap emap. If the map
+    vertices change make a new one
+    '''
+    self.emap = emap
+    b = emap.buf[0]
+    v = b.array_buffer[:, 0:3].astype(np.float64)
+    f = b.element_array_buffer
+    if b.element_normals is None: # as Buffer.calc_normals()
+      n = np.cross(v[f[:, 1]] - v[f[:, 0]], v[f[:, 2]] - v[f[:, 0]])
+      n /= np.linalg.norm(n, axis=1).reshape(-1, 1)
+    else:
+      n = np.array(b.element_normals, dtype=np.float64)
+    self.normals = n
+    self.k = np.einsum('ij,ij->i', n, v[f[:, 0]]) # plane of face n.v = k
+    self.ny = np.where(n[:, 1] == 0.0, 1e-12, n[:, 1]) # vertical faces can't be hit anyway
+
+  def faces(self, px, pz):
+    '''index of the face under each point, px and pz relative to the map
+    '''
+    m = self.emap
+    fx = (m.wh + px) / m.ws
+    fz = (m.hh + pz) / m.hs
+    inside = (px > -m.wh) & (px < m.wh) & (pz > -m.hh) & (pz < m.hh)
+    ipx = np.clip(fx.astype(int), 0, m.ix - 2)
+    ipz = np.clip(fz.astype(int), 0, m.iy - 2)
+    ix = (ipx + ipz * (m.ix - 1)) * 2
+    ix += (pz + m.hh - ipz * m.hs) < (px + m.wh - ipx * m.ws) # second triangle of the square
+    return np.where(inside, ix, 0)
+
+  def heights(self, px, pz, inc_normal=False):
+    '''array of the heights at world positions px, pz (arrays or scalars)
+    and, if inc_normal, an (n, 3) array of the unit normals as well
+    '''
+    u = self.emap.unif
+    px = np.asarray(px, dtype=np.float64) - u[0]
+    pz = np.asarray(pz, dtype=np.float64) - u[2]
+    ix = self.faces(px, pz)
+    n = self.normals[ix]
+    y = u[1] + (self.k[ix] - n[..., 0] * px - n[..., 2] * pz) / self.ny[ix]
+    if inc_normal:
+      return y, n
+    return y
+
+  def pitch_roll(self, px, pz):
+    '''arrays of pitch (rx) and roll (rz) in degrees for objects standing
+    on the map, as ElevationMap.pitch_roll()
+    '''
+    _, n = self.heights(px, pz, True)
+    side = np.hypot(n[..., 0], n[..., 1])
+    # forward vector y component over its length, see ElevationMap.pitch_roll()
+    fy = -n[..., 2] * n[..., 1]
+    flen = np.sqrt((n[..., 2] * n[..., 0]) ** 2 + fy ** 2 + (n[..., 0] ** 2 + n[..., 1] ** 2) ** 2)
+    pitch = np.degrees(np.arcsin(-fy / flen))
+    roll = np.degrees(np.arctan2(-n[..., 0] / side, n[..., 1]))
+    return pitch, roll
+
+def query(emap):
+  '''the TerrainQuery for emap, made the first time it's asked for
+  '''
+  q = _QUERIES.get(emap)
+  if q is None:
+    q = _QUERIES[emap] = TerrainQuery(emap)
+  return q
+
+def cluster(shape, bufr, elevmap, xpos, zpos, w, d, count, options, minscl, maxscl,
+            bufnum=0, billboard=False, rng=None):
+  '''shape.cluster() with the same arguments, and the same random numbers,
+  but all the heights found in one go. rng is a random.Random to use
+  instead of the random module
+  '''
+  rng = rng or random
+  rnd = np.empty((count, 4))
+  for i in range(count): # same order as MergeShape.cluster()
+    rnd[i, 0] = rng.random()
+    rnd[i, 1] = rng.random()
+    rnd[i, 2] = rng.random()
+    rnd[i, 3] = 180.0 if billboard else rng.random() * 360.0
+  x = xpos + rnd[:, 0] * w - w * 0.5
+  z = zpos + rnd[:, 1] * d - d * 0.5
+  rh = rnd[:, 2] * (maxscl - minscl) + minscl
+  y = query(elevmap).heights(shape.unif[0] + x, shape.unif[2] + z) + rh * 2
+  shape.merge([[bufr, x[i], y[i], z[i], 0.0, rnd[i, 3], 0.0, rh[i], rh[i], rh[i], bufnum]
+               for i in range(count)])
+
+if __name__ == '__main__':
+  import time
+  import pi3d
+  mymap = pi3d.ElevationMap("textures/mountainsHgt.png", name="map", width=1000.0,
+                            depth=1000.0, height=80.0, divx=32, divy=32, x=20.0, y=-5.0, z=-30.0)
+  rng = np.random.RandomState(5)
+  for count in (10, 1000, 100000):
+    xs = rng.uniform(-550.0, 550.0, count) # a few off the edge
+    zs = rng.uniform(-550.0, 550.0, count)
+    tm = time.time()
+    q = TerrainQuery(mymap)
+    setup = time.time() - tm
+    tm = time.time()
+    ys, ns = q.heights(xs, zs, True)
+    vec = time.time() - tm
+    tm = time.time()
+    scalar = [mymap.calcHeight(x, z, True) for x, z in zip(xs, zs)]
+    sca = time.time() - tm
+    dy = max(abs(s[0] - y) for s, y in zip(scalar, ys))
+    dn = max(np.abs(s[1] - n).max() for s, n in zip(scalar, ns))
+    pr = np.array([mymap.pitch_roll(x, z) for x, z in zip(xs[:100], zs[:100])])
+    dpr = np.abs(np.array(q.pitch_roll(xs[:100], zs[:100])).T - pr).max()
+    print('{:6d} points: calcHeight {:8.2f}ms, heights {:6.2f}ms (+{:.2f}ms setup) {:6.0f}x, '
+          'max differences height {:.1e} normal {:.1e} pitch_roll {:.1e}'.format(count,
+          sca * 1000.0, vec * 1000.0, setup * 1000.0, sca / max(vec, 1e-9), dy, dn, dpr))
+  # placing trees as Billboard.py
+  sprite = pi3d.Sprite(w=2.0, h=3.0)
+  results = []
+  for f in (lambda s: s.cluster(sprite, mymap, 0.0, 0.0, 300.0, 600.0, 1000, "", 4.0, 2.0, billboard=True),
+            lambda s: cluster(s, sprite, mymap, 0.0, 0.0, 300.0, 600.0, 1000, "", 4.0, 2.0, billboard=True)):
+    random.seed(1)
+    trees = pi3d.MergeShape()
+    tm = time.time()
+    f(trees)
+    results.append((time.time() - tm, trees.buf[0].array_buffer.copy()))
+  print('1000 tree cluster: MergeShape.cluster {:.1f}ms, cluster {:.1f}ms, max vertex difference {:.1e}'.format(
+        results[0][0] * 1000.0, results[1][0] * 1000.0, np.abs(results[0][1] - results[1][1]).max()))
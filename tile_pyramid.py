@@ -0,0 +1,225 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+""" Cut elevation and colour images of any size into the overlapping tiles
+that Scenery needs, as alpine/extract_tiles.py does by hand for one 5x5
+grid, but for several levels of detail. Level 0 has base tiles across the
+width, each level after has twice as many in each direction (a quadtree)
+so that big maps can be loaded at the resolution needed:
+
+  python3 tile_pyramid.py big_elev.png -c big_colour.png -o big -l 4 --size 16000
+
+Each tile is tile + 1 pixels square and shares its edge pixels with the
+tiles next to it. The elevation image is resampled once to the grid of the
+finest level and the other levels take every other sample of the one
+below, so tiles of one level match exactly along their seams and the
+vertices of a coarse tile are vertices of the finer ones. 16 bit and float
+elevation images are scaled to 0-255 as ElevationMap only reads 8 bits.
+Tiles are numbered as extract_tiles.py did, i from the right of the image
+and j from the bottom, so with levels 1, base 5 and tile 32 a 161x161 image
+gives the same tiles as before.
+
+The directory gets a pyramid.json manifest with the size of each level and
+the position, files and height range of each tile. make_scene() turns a
+level of it into a Scene (a StreamingScene unless told otherwise) with its
+own cache file:
+
+  sc = tile_pyramid.make_scene('big/pyramid.json', 2, shader, ['n_norm000'])
+
+python3 tile_pyramid.py with no arguments cuts up the alpine images and
+checks the seams and that level 0 is the same as the tiles in alpine/
+"""
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+LOGGER = logging.getLogger(__name__)
+
+MANIFEST = 'pyramid.json'
+PYRAMID_VERSION = 1
+LEVELS = 3
+BASE = 5 # tiles across the width at level 0
+TILE = 32 # pixels between tile edges, the tiles are TILE + 1 square
+SIZE = 5000.0 # world width
+HEIGHT = 500.0 # world height of elevation 255
+THRESHOLD = 0.95 # of the tile size, as alpine.py
+ELEV_KEY = 'elev{}_{{}}_{{}}' # format()ed with level then i, j
+COLOUR_KEY = 'tex{}_{{}}_{{}}'
+
+def level_shape(w, h, base, level):
+  '''(nx, nz) tiles for an image w x h
+  '''
+  nz = max(1, int(round(base * h / w)))
+  return base << level, nz << level
+
+def elevation_grid(im, nx, nz, tile):
+  '''float32 array of 0-255 heights (nz * tile + 1, nx * tile + 1) from the
+  image, only resampled if it isn't that size already
+  '''
+  if im.mode in ('I;16', 'I;16B', 'I;16L', 'I', 'F'):
+    a = np.asarray(im.convert('F'), dtype=np.float32)
+    top = a.max()
+    im = Image.fromarray(a * (255.0 / top) if top > 0.0 else a)
+  else:
+    im = im.convert('L')
+  size = (nx * tile + 1, nz * tile + 1)
+  if im.size != size:
+    im = im.convert('F').resize(size, Image.BILINEAR)
+  return np.asarray(im, dtype=np.float32)
+
+def crop(a, i, j, nx, nz, tile):
+  '''tile i, j of the array a, i counted from the right and j from the
+  bottom as extract_tiles.py
+  '''
+  l = (nx - 1 - i) * tile
+  t = (nz - 1 - j) * tile
+  return a[t:(t + tile + 1), l:(l + tile + 1)]
+
+def build(elevation, colour=None, outdir='.', levels=LEVELS, base=BASE, tile=TILE,
+          colour_tile=None, size=SIZE, height=HEIGHT):
+  '''write the tiles and manifest to outdir from the elevation and colour
+  image files and return the manifest
+  '''
+  colour_tile = colour_tile or tile
+  if not os.path.isdir(outdir):
+    os.makedirs(outdir)
+  elev = Image.open(elevation)
+  col = Image.open(colour).convert('RGB') if colour else None
+  w, h = elev.size
+  nx, nz = level_shape(w, h, base, levels - 1)
+  grids = [elevation_grid(elev, nx, nz, tile)]
+  for level in range(levels - 1): # coarser levels share vertices with finer
+    grids.insert(0, grids[0][::2, ::2])
+  manifest = {'version': PYRAMID_VERSION, 'size': size, 'height': height,
+              'tile': tile, 'colour_tile': colour_tile, 'levels': []}
+  for level, grid in enumerate(grids):
+    nx, nz = level_shape(w, h, base, level)
+    elev_key, colour_key = ELEV_KEY.format(level), COLOUR_KEY.format(level)
+    lev = {'level': level, 'nx': nx, 'nz': nz, 'msize': size / nx,
+           'map_key': elev_key, 'colour_key': colour_key if col else None,
+           'tiles': []}
+    if col is not None:
+      csize = (nx * colour_tile + 1, nz * colour_tile + 1)
+      cgrid = np.asarray(col if col.size == csize else col.resize(csize, Image.LANCZOS))
+    for i in range(nx):
+      for j in range(nz):
+        g = crop(grid, i, j, nx, nz, tile)
+        key = elev_key.format(i, j)
+        Image.fromarray(np.clip(np.round(g), 0, 255).astype(np.uint8)).save(
+              os.path.join(outdir, '{}.png'.format(key)))
+        t = {'key': key, 'i': i, 'j': j, 'x': (0.5 + i) * lev['msize'],
+             'z': (0.5 + j) * lev['msize'], 'min': float(g.min()) * height / 255.0,
+             'max': float(g.max()) * height / 255.0, 'colour': None}
+        if col is not None:
+          t['colour'] = colour_key.format(i, j)
+          Image.fromarray(crop(cgrid, i, j, nx, nz, colour_tile)).save(
+                os.path.join(outdir, '{}.png'.format(t['colour'])))
+        lev['tiles'].append(t)
+    manifest['levels'].append(lev)
+    LOGGER.info('level %d %dx%d tiles of %.1f', level, nx, nz, lev['msize'])
+  with open(os.path.join(outdir, MANIFEST), 'w') as f:
+    json.dump(manifest, f, indent=1)
+  return manifest
+
+def read_manifest(path):
+  '''the manifest in path, which can be the directory or the json file
+  '''
+  if os.path.isdir(path):
+    path = os.path.join(path, MANIFEST)
+  with open(path) as f:
+    return json.load(f)
+
+def make_scene(path, level=None, shader=None, textures=(), scene_class=None,
+               threshold=THRESHOLD, **kwargs):
+  '''a Scene with an ElevationMap for each tile of level (the finest if
+  None) from the manifest at path. The colour tile is the first texture
+  then textures, the other SceneryItem arguments can be given as kwargs.
+  Nothing is loaded so the shader can be None to build the cache
+  '''
+  from pi3d.util.Scenery import SceneryItem
+  if scene_class is None:
+    from scenery_stream import StreamingScene as scene_class
+  m = read_manifest(path)
+  lev = m['levels'][-1 if level is None else level]
+  directory = path if os.path.isdir(path) else os.path.dirname(path) or '.'
+  sc = scene_class(directory, lev['msize'], lev['nx'], lev['nz'],
+                   cache_file=os.path.join(directory, 'scenery{}.p3s'.format(lev['level'])))
+  sc.map_key = lev['map_key']
+  sc.divisions = m['tile']
+  kwargs.setdefault('height', m['height'])
+  for t in lev['tiles']:
+    tex = ([t['colour']] if t['colour'] else []) + list(textures)
+    sc.scenery_list[t['key']] = SceneryItem(t['x'], 0.0, t['z'], tex, shader,
+          threshold=threshold * lev['msize'], **kwargs)
+  return sc
+
+if __name__ == '__main__':
+  parse = argparse.ArgumentParser(description="cut elevation and colour images into a pyramid of Scenery tiles")
+  parse.add_argument("elevation", nargs='?', default=None, help="elevation image, the alpine one if not given")
+  parse.add_argument("-c", "--colour", default=None, help="colour image")
+  parse.add_argument("-o", "--output", default=None, help="directory for the tiles and manifest")
+  parse.add_argument("-l", "--levels", default=LEVELS, type=int)
+  parse.add_argument("-b", "--base", default=BASE, type=int, help="tiles across at level 0")
+  parse.add_argument("-t", "--tile", default=TILE, type=int, help="elevation pixels per tile")
+  parse.add_argument("--colour_tile", default=None, type=int, help="colour pixels per tile, defaults to --tile")
+  parse.add_argument("--size", default=SIZE, type=float, help="world width")
+  parse.add_argument("--height", default=HEIGHT, type=float, help="world height of elevation 255")
+  args = parse.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  if args.elevation is not None:
+    build(args.elevation, args.colour, args.output or '.', args.levels, args.base,
+          args.tile, args.colour_tile, args.size, args.height)
+  else: # check with the alpine images
+    import shutil, tempfile, time
+    tmp = args.output or tempfile.mkdtemp()
+    try:
+      tm = time.time()
+      m = build('alpine/map.png', 'alpine/snow_tex.png', tmp, args.levels, args.base,
+                args.tile, args.colour_tile, args.size, args.height)
+      print('{} levels in {:.2f}s'.format(len(m['levels']), time.time() - tm))
+      load = lambda k: np.asarray(Image.open(os.path.join(tmp, '{}.png'.format(k))), dtype=int)
+      for lev in m['levels']: # neighbouring tiles have the same edge
+        bad = 0
+        for t in lev['tiles']:
+          a = load(t['key'])
+          if t['i'] > 0: # the tile to the right in the image
+            bad += np.any(a[:, -1] != load(lev['map_key'].format(t['i'] - 1, t['j']))[:, 0])
+          if t['j'] > 0: # the tile below
+            bad += np.any(a[-1] != load(lev['map_key'].format(t['i'], t['j'] - 1))[0])
+        print('level {} {}x{} tiles of {:.0f}, {} seams differ'.format(lev['level'],
+              lev['nx'], lev['nz'], lev['msize'], bad))
+      fine = m['levels'][-1]
+      for lev in m['levels'][:-1]: # coarse vertices are on the finest tiles
+        step = 1 << (fine['level'] - lev['level'])
+        bad = 0
+        for t in lev['tiles']:
+          a = load(t['key'])
+          for di in range(step):
+            for dj in range(step):
+              b = load(fine['map_key'].format(t['i'] * step + di, t['j'] * step + dj))
+              # fine tile di from the right of the coarse tile, dj from the bottom
+              r0 = (step - 1 - dj) * m['tile'] // step
+              c0 = (step - 1 - di) * m['tile'] // step
+              sub = a[r0:(r0 + m['tile'] // step + 1), c0:(c0 + m['tile'] // step + 1)]
+              bad += np.any(sub != b[::step, ::step])
+        print('level {} against level {}: {} tiles differ'.format(lev['level'], fine['level'], bad))
+      if args.base == BASE and args.tile == TILE: # the grid is the source size
+        same = all(np.array_equal(load(ELEV_KEY.format(0).format(i, j)),
+              np.asarray(Image.open('alpine/map{}{}.png'.format(i, j)).convert('L'), dtype=int))
+              for i in range(BASE) for j in range(BASE))
+        print('level 0 same as alpine/map??.png: {}'.format(same))
+      if args.levels > 1: # the finest grid is resampled so level 0 only matches with -l 1
+        print('(run with -l 1 to compare with alpine/map??.png)')
+      level = min(1, args.levels - 1)
+      sc = make_scene(os.path.join(tmp, MANIFEST), level)
+      tm = time.time()
+      built = sc.build()
+      print('built {} tiles of level {} through the cache in {:.2f}s, map under 2500, 2500 is {}'.format(
+            len(built), level, time.time() - tm, sc.map_key.format(int(2500 // sc.msize), int(2500 // sc.msize))))
+    finally:
+      if args.output is None:
+        shutil.rmtree(tmp)